@@ -3,17 +3,29 @@ Robust authentication dependencies that work with all request types.
 This custom implementation avoids issues with HTTPBearer and OAuth2PasswordBearer
 when dealing with multipart/form-data requests.
 """
-from fastapi import Depends, HTTPException, status, Header
+from fastapi import Depends, HTTPException, status, Header, Request, Response
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import Optional
-from database import get_db
-from auth import models, utils
+import time
+import database
+from database import get_async_db
+from auth import models, utils, user_cache
+from auth.user_cache import AuthenticatedUser
+from utils.access_log import get_logger
+
+logger = get_logger("auth")
 
 def get_user(db: Session, email: str):
     """Helper function to get user by email."""
     return db.query(models.User).filter(models.User.email == email).first()
 
+async def get_user_async(db: AsyncSession, email: str):
+    result = await db.execute(select(models.User).where(models.User.email == email))
+    return result.scalars().first()
+
 # Create a flexible bearer token extractor
 security = HTTPBearer(auto_error=False)
 
@@ -49,13 +61,14 @@ async def get_token_from_header(
     
     return token
 
-def get_current_user(
-    db: Session = Depends(get_db),
+async def get_current_user(
+    db: AsyncSession = Depends(get_async_db),
     token: str = Depends(get_token_from_header)
-) -> models.User:
+) -> AuthenticatedUser:
     """
     Get current authenticated user from JWT token.
     This is a robust implementation that works with all request types.
+    Resolved users are cached per (sub, exp) for a short TTL (see auth.user_cache).
     """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -73,23 +86,34 @@ def get_current_user(
         if not email:
             raise credentials_exception
         
+        user = user_cache.from_claims(payload)
+        if user is not None:
+            return user
+
+        exp = payload.get("exp")
+        user = user_cache.get(email, exp)
+        if user is not None:
+            return user
+
         # Get user from database
-        user = get_user(db, email=email)
-        if user is None:
+        db_user = await get_user_async(db, email=email)
+        if db_user is None:
             raise credentials_exception
-        
+
+        user = user_cache.snapshot(db_user)
+        user_cache.put(email, exp, user)
         return user
         
     except HTTPException:
         raise
     except Exception as e:
         # Log the error for debugging but don't expose details
-        print(f"Authentication error: {type(e).__name__}: {str(e)}")
+        logger.warning("Authentication error", extra={"error": f"{type(e).__name__}: {e}"})
         raise credentials_exception
 
-def get_current_active_user(
-    current_user: models.User = Depends(get_current_user)
-) -> models.User:
+async def get_current_active_user(
+    current_user: AuthenticatedUser = Depends(get_current_user)
+) -> AuthenticatedUser:
     """Get current active user (additional check for active status)."""
     if not current_user.is_active:
         raise HTTPException(
@@ -98,3 +122,38 @@ def get_current_active_user(
         )
     return current_user
 
+
+
+async def get_read_db(
+    request: Request,
+    current_user: AuthenticatedUser = Depends(get_current_user)
+):
+    """
+    Session for read-only endpoints: the read replica, unless the caller wrote
+    within READ_YOUR_WRITES_SECONDS (same-process marker or the header set by
+    pin_reads_to_primary), in which case the primary.
+    """
+    if database.has_recent_write(current_user.email) or _read_primary_requested(request):
+        source = database.get_async_db()
+    else:
+        source = database.get_async_replica_db()
+    async for db in source:
+        yield db
+
+def _read_primary_requested(request: Request) -> bool:
+    """True while the READ_PRIMARY_HEADER the client echoes back is unexpired."""
+    try:
+        until = float(request.headers.get(database.READ_PRIMARY_HEADER, ""))
+    except ValueError:
+        return False
+    now = time.time()
+    # Never further ahead than a pin this server could have issued
+    return now < until <= now + database.READ_YOUR_WRITES_SECONDS + 1
+
+def pin_reads_to_primary(response: Response, user: AuthenticatedUser) -> None:
+    """Call after a write so the user's next reads see it despite replica lag."""
+    if not database.replica_enabled():
+        return
+    database.mark_recent_write(user.email)
+    # The client echoes the header back, carrying the pin to other worker processes
+    response.headers[database.READ_PRIMARY_HEADER] = f"{time.time() + database.READ_YOUR_WRITES_SECONDS:.3f}"
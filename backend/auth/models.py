@@ -3,6 +3,9 @@ from sqlalchemy.orm import relationship
 
 from database import Base
 
+# Roles allowed to act on other users' data, e.g. grade a class's answer sheets
+PRIVILEGED_ROLES = ("teacher", "admin")
+
 class User(Base):
     __tablename__ = "users"
 
@@ -10,6 +13,7 @@ class User(Base):
     email = Column(String, unique=True, index=True)
     hashed_password = Column(String)
     is_active = Column(Boolean, default=True)
+    role = Column(String, nullable=False, default="student", server_default="student")
 
     attempts = relationship("QuizAttempt", back_populates="owner", cascade="all, delete-orphan")
     ethical_bias_profile = relationship("EthicalBiasProfile", back_populates="owner", uselist=False, cascade="all, delete-orphan")
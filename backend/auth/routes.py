@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from datetime import timedelta
@@ -9,8 +10,10 @@ from database import get_db
 from auth import models, utils
 from schemas import Token
 from auth.dependencies import get_current_user, get_current_active_user
+from utils.access_log import get_logger
 
 router = APIRouter()
+logger = get_logger("auth")
 
 
 def get_user(db: Session, email: str):
@@ -18,6 +21,21 @@ def get_user(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
 
+def _hashing_busy() -> HTTPException:
+    logger.warning("Password hashing queue is full, refusing request")
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Server is busy, please retry shortly",
+        headers={"Retry-After": "1"},
+    )
+
+
+def _save_user(db: Session, db_user: models.User) -> None:
+    db.add(db_user)
+    db.commit()
+    db.refresh(db_user)
+
+
 # Pydantic model for JSON registration
 class RegisterRequest(BaseModel):
     email: EmailStr
@@ -31,53 +49,52 @@ async def register_user(request: Request, db: Session = Depends(get_db)):
     try:
         # Read raw body
         body_bytes = await request.body()
-        print(f"DEBUG: Received body: {body_bytes[:200]}")
         
         # Parse JSON
         body_str = body_bytes.decode('utf-8')
         body_dict = json.loads(body_str)
-        print(f"DEBUG: Parsed JSON: {body_dict}")
         
         # Validate with Pydantic
         register_data = RegisterRequest(**body_dict)
         email = register_data.email
         password = register_data.password
         
-        print(f"DEBUG: Validated - email: {email}, password length: {len(password)}")
         
     except json.JSONDecodeError as e:
-        print(f"ERROR: JSON decode failed: {e}")
+        logger.info("Registration rejected: invalid JSON")
         raise HTTPException(status_code=400, detail=f"Invalid JSON: {str(e)}")
     except Exception as e:
-        print(f"ERROR: Validation failed: {e}")
+        logger.info("Registration rejected: validation failed")
         raise HTTPException(status_code=400, detail=f"Validation error: {str(e)}")
     
     # Check if user already exists
-    existing_user = get_user(db, email=email)
+    existing_user = await run_in_threadpool(get_user, db, email)
     if existing_user:
-        print(f"ERROR: Email {email} already registered")
+        logger.info("Registration rejected: email already registered")
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    # Hash password and create user
+    # Hash password off the event loop
+    try:
+        hashed_password = await utils.get_password_hash_async(password)
+    except utils.PasswordHashBusy:
+        raise _hashing_busy()
+
+    # Create user
     try:
-        hashed_password = utils.get_password_hash(password)
         db_user = models.User(email=email, hashed_password=hashed_password)
-        db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
-        print(f"SUCCESS: Created user {email}")
+        await run_in_threadpool(_save_user, db, db_user)
+        logger.info("Created user", extra={"user_id": db_user.id})
     except Exception as e:
         db.rollback()
-        print(f"ERROR: Database error: {e}")
+        logger.error("Failed to create user", extra={"error": str(e)})
         raise HTTPException(status_code=500, detail="Failed to create user")
     
     # Generate access token
     access_token_expires = timedelta(minutes=utils.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = utils.create_access_token(
-        data={"sub": db_user.email}, expires_delta=access_token_expires
+        data=utils.token_claims(db_user), expires_delta=access_token_expires
     )
     
-    print(f"SUCCESS: Generated token for {email}")
     return {"access_token": access_token, "token_type": "bearer"}
 
 
@@ -88,19 +105,21 @@ async def login_for_access_token(
 ):
     """Login with username (email) and password to get access token"""
     
-    print(f"DEBUG: Login attempt for: {form_data.username}")
-    
-    user = get_user(db, email=form_data.username)
+    user = await run_in_threadpool(get_user, db, form_data.username)
     if not user:
-        print(f"ERROR: User {form_data.username} not found")
+        logger.info("Login failed: unknown user")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    if not utils.verify_password(form_data.password, user.hashed_password):
-        print(f"ERROR: Invalid password for {form_data.username}")
+    try:
+        password_ok = await utils.verify_password_async(form_data.password, user.hashed_password)
+    except utils.PasswordHashBusy:
+        raise _hashing_busy()
+    if not password_ok:
+        logger.info("Login failed: wrong password", extra={"user_id": user.id})
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -109,9 +128,9 @@ async def login_for_access_token(
     
     access_token_expires = timedelta(minutes=utils.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = utils.create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data=utils.token_claims(user), expires_delta=access_token_expires
     )
     
-    print(f"SUCCESS: Login successful for {form_data.username}")
+    logger.info("Login succeeded", extra={"user_id": user.id})
     return {"access_token": access_token, "token_type": "bearer"}
     
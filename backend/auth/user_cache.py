@@ -0,0 +1,113 @@
+"""
+In-process cache of authenticated users, so a request with a known token does
+not query the users table.
+
+Entries are keyed by the token's (sub, exp) and live for AUTH_USER_CACHE_TTL
+seconds. Updating or deleting a User through the ORM invalidates that user's
+entries in this process. Other worker processes pick the change up within the
+TTL. Changes made outside the ORM should call invalidate_user().
+
+With AUTH_TRUST_TOKEN_CLAIMS=true, tokens that carry uid, act and rol claims are
+trusted without any lookup while they are at most AUTH_CLAIMS_MAX_AGE seconds
+old (iat); older tokens fall back to the cache and the database. Invalidation
+is per process, so that age bounds how long another worker can act on claims
+a change has made stale. A user invalidated in this process after the token
+was issued still goes back to the database.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from sqlalchemy import event, inspect
+
+from auth import models
+
+AUTH_USER_CACHE_TTL = float(os.getenv("AUTH_USER_CACHE_TTL", "60"))
+AUTH_USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", "10000"))
+AUTH_TRUST_TOKEN_CLAIMS = os.getenv("AUTH_TRUST_TOKEN_CLAIMS", "false").lower() in ("1", "true", "yes")
+AUTH_CLAIMS_MAX_AGE = float(os.getenv("AUTH_CLAIMS_MAX_AGE", str(AUTH_USER_CACHE_TTL)))
+
+
+class AuthenticatedUser(NamedTuple):
+    """What request handlers need from the current user, detached from any session."""
+    id: int
+    email: str
+    is_active: bool
+    role: str = "student"
+
+
+_entries: "OrderedDict[Tuple[str, int], Tuple[float, AuthenticatedUser]]" = OrderedDict()
+# email -> wall-clock time of the last invalidation, to distrust older token claims
+_invalidated_at: Dict[str, float] = {}
+_lock = threading.Lock()
+
+
+def snapshot(user: models.User) -> AuthenticatedUser:
+    return AuthenticatedUser(user.id, user.email, bool(user.is_active), user.role or "student")
+
+
+def get(sub: str, exp: int) -> Optional[AuthenticatedUser]:
+    with _lock:
+        entry = _entries.get((sub, exp))
+        if entry is None:
+            return None
+        expires_at, user = entry
+        if expires_at <= time.monotonic():
+            del _entries[(sub, exp)]
+            return None
+        _entries.move_to_end((sub, exp))
+        return user
+
+
+def put(sub: str, exp: int, user: AuthenticatedUser) -> None:
+    with _lock:
+        _entries[(sub, exp)] = (time.monotonic() + AUTH_USER_CACHE_TTL, user)
+        _entries.move_to_end((sub, exp))
+        while len(_entries) > AUTH_USER_CACHE_SIZE:
+            _entries.popitem(last=False)
+
+
+def from_claims(payload: dict) -> Optional[AuthenticatedUser]:
+    """The user described by the token's own claims, if trusted, recent and not invalidated since it was issued."""
+    if not AUTH_TRUST_TOKEN_CLAIMS or not all(claim in payload for claim in ("uid", "act", "rol", "iat")):
+        return None
+    issued_at = payload["iat"]
+    if time.time() - issued_at > AUTH_CLAIMS_MAX_AGE:
+        return None
+    sub = payload.get("sub")
+    invalidated = _invalidated_at.get(sub)
+    if invalidated is not None and issued_at <= invalidated:
+        return None
+    return AuthenticatedUser(int(payload["uid"]), sub, bool(payload["act"]), payload["rol"])
+
+
+def invalidate_user(email: str) -> None:
+    with _lock:
+        _invalidated_at[email] = time.time()
+        for key in [key for key in _entries if key[0] == email]:
+            del _entries[key]
+
+
+def clear() -> None:
+    with _lock:
+        _entries.clear()
+        _invalidated_at.clear()
+
+
+@event.listens_for(models.User, "after_update")
+def _user_updated(mapper, connection, target):
+    state = inspect(target)
+    changed = [attr for attr in ("is_active", "role", "hashed_password", "email") if state.attrs[attr].history.has_changes()]
+    if not changed:
+        return
+    invalidate_user(target.email)
+    if "email" in changed:
+        for old_email in state.attrs["email"].history.deleted:
+            invalidate_user(old_email)
+
+
+@event.listens_for(models.User, "after_delete")
+def _user_deleted(mapper, connection, target):
+    invalidate_user(target.email)
@@ -1,19 +1,41 @@
 from passlib.context import CryptContext
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
+import asyncio
+import threading
 from jose import JWTError, jwt
 from dotenv import load_dotenv
 import os
 
+from utils.access_log import get_logger
+
 load_dotenv()
 
+logger = get_logger("auth")
+
 SECRET_KEY = os.getenv("SECRET_KEY")
 if not SECRET_KEY:
     raise ValueError("SECRET_KEY environment variable is not set. Please set it in your environment.")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt work factor for new hashes; existing hashes keep the rounds they were made with
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# bcrypt releases the GIL, so a small thread pool hashes in parallel without blocking the event loop
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Hashes waiting or running before new ones are refused instead of queued
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64"))
+
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_lock = threading.Lock()
+_hash_stats = {"in_flight": 0, "completed": 0, "rejected": 0}
+
+
+class PasswordHashBusy(Exception):
+    """Raised when PASSWORD_HASH_MAX_QUEUE hashes are already waiting or running."""
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -21,26 +43,59 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+async def _run_hash_job(func, *args):
+    with _hash_lock:
+        if _hash_stats["in_flight"] >= PASSWORD_HASH_MAX_QUEUE:
+            _hash_stats["rejected"] += 1
+            raise PasswordHashBusy()
+        _hash_stats["in_flight"] += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, func, *args)
+    finally:
+        with _hash_lock:
+            _hash_stats["in_flight"] -= 1
+            _hash_stats["completed"] += 1
+
+async def verify_password_async(plain_password, hashed_password):
+    return await _run_hash_job(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    return await _run_hash_job(get_password_hash, password)
+
+def password_hash_stats() -> dict:
+    """Queue depth of the bcrypt pool: queued = waiting for a worker, in_flight = queued + running."""
+    with _hash_lock:
+        stats = dict(_hash_stats)
+    stats["queued"] = max(0, stats["in_flight"] - PASSWORD_HASH_WORKERS)
+    stats["workers"] = PASSWORD_HASH_WORKERS
+    stats["max_queue"] = PASSWORD_HASH_MAX_QUEUE
+    stats["rounds"] = BCRYPT_ROUNDS
+    return stats
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "iat": datetime.utcnow()})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 def decode_access_token(token: str):
     try:
         if not SECRET_KEY:
-            print("ERROR: SECRET_KEY is not set!")
+            logger.error("SECRET_KEY is not set")
             return None
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         return payload
     except JWTError as e:
-        print(f"DEBUG: JWT decode error: {e}")
+        logger.debug("JWT decode error", extra={"error": str(e)})
         return None
     except Exception as e:
-        print(f"DEBUG: Unexpected error decoding token: {type(e).__name__}: {e}")
+        logger.warning("Unexpected error decoding token", extra={"error": f"{type(e).__name__}: {e}"})
         return None
+
+def token_claims(user) -> dict:
+    """Claims for a user's access token. uid, act and rol let AUTH_TRUST_TOKEN_CLAIMS skip the user lookup."""
+    return {"sub": user.email, "uid": user.id, "act": bool(user.is_active), "rol": user.role or "student"}
@@ -0,0 +1,152 @@
+"""
+Recall and latency of the IVF-PQ index against exact search.
+
+    cd backend
+    python -m benchmarks.bench_ann
+    python -m benchmarks.bench_ann --vectors 200000 --dim 256 --m 32 --nlist 1024
+
+The corpus is synthetic: unit vectors drawn around random cluster centres,
+added in documents of --per-label vectors. Queries are perturbed corpus
+vectors. For each nprobe, recall@k is the fraction of the exact k nearest
+neighbours that the index returns. Also reported are the build time,
+the bytes stored per vector, and how long a saved index takes to load
+(memory-mapped) and answer its first query.
+
+Insert cost at scale: the corpus is added again, a document at a time,
+through an AnnStore on disk, as the ingestion worker does. Add latency is
+reported for each tenth of the corpus, with the mean bytes written per add
+and the number of snapshots published (compactions). An add should cost
+the size of the document, not of the index, apart from the occasional
+compaction. --skip-inserts leaves this out.
+"""
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from services.ann_index import AnnStore, IVFPQIndex
+
+
+def make_corpus(vectors: int, dim: int, clusters: int, queries: int, seed: int):
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    data = centres[rng.integers(0, clusters, vectors)] + 0.6 * rng.standard_normal((vectors, dim)).astype(np.float32)
+    data /= np.linalg.norm(data, axis=1, keepdims=True)
+    picked = data[rng.integers(0, vectors, queries)]
+    query = picked + 0.3 * rng.standard_normal(picked.shape).astype(np.float32) / np.sqrt(dim)
+    query /= np.linalg.norm(query, axis=1, keepdims=True)
+    return data, query
+
+
+def exact_neighbours(data: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    distances = (data * data).sum(axis=1)[None] - 2 * queries @ data.T
+    return np.argsort(distances, axis=1)[:, :k]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectors", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--clusters", type=int, default=100, help="clusters in the synthetic data")
+    parser.add_argument("--nlist", type=int, default=256)
+    parser.add_argument("--m", type=int, default=32, help="PQ code bytes per vector")
+    parser.add_argument("--train-size", type=int, default=10000)
+    parser.add_argument("--per-label", type=int, default=50, help="vectors per document label")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--skip-inserts", action="store_true", help="skip the insert cost at scale")
+    args = parser.parse_args()
+
+    data, queries = make_corpus(args.vectors, args.dim, args.clusters, args.queries, args.seed)
+    print(f"{args.vectors} vectors of dim {args.dim}, nlist {args.nlist}, m {args.m}, {args.queries} queries, k {args.k}")
+
+    index = IVFPQIndex(args.dim, nlist=args.nlist, m=args.m, train_size=args.train_size)
+    start = time.perf_counter()
+    for label, i in enumerate(range(0, len(data), args.per_label)):
+        index.add(data[i:i + args.per_label], label, [b""] * len(data[i:i + args.per_label]))
+    print(f"build {time.perf_counter() - start:.1f} s, {args.m} bytes per vector (raw {4 * args.dim})")
+
+    start = time.perf_counter()
+    truth = exact_neighbours(data, queries, args.k)
+    print(f"exact search {(time.perf_counter() - start) * 1000 / len(queries):.2f} ms per query (batched)")
+
+    def ids(hits):
+        return {hit.label * args.per_label + hit.position for hit in hits}
+
+    for nprobe in (1, 2, 4, 8, 16, 32, 64):
+        if nprobe > args.nlist:
+            break
+        latencies, found = [], 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            hits = index.search(query, args.k, nprobe=nprobe)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found += len(ids(hits) & set(expected.tolist()))
+        latencies.sort()
+        print(f"nprobe {nprobe:<3} recall@{args.k} {found / truth.size:.3f}  "
+              f"p50 {statistics.median(latencies):6.2f} ms  p95 {latencies[int(len(latencies) * 0.95)]:6.2f} ms")
+
+    # Scoped to one label, as retrieval_service searches a single document
+    latencies = []
+    for n, query in enumerate(queries):
+        start = time.perf_counter()
+        index.search(query, 3, labels=[n % (len(data) // args.per_label)])
+        latencies.append((time.perf_counter() - start) * 1000)
+    print(f"one label    p50 {statistics.median(latencies):6.2f} ms")
+
+    directory = tempfile.mkdtemp(prefix="ann_bench_")
+    try:
+        start = time.perf_counter()
+        snapshot = index.save(directory)
+        saved = time.perf_counter() - start
+        start = time.perf_counter()
+        loaded = IVFPQIndex.load(snapshot.path)
+        loaded.search(queries[0], args.k)
+        print(f"save {saved * 1000:.0f} ms, load and first query {(time.perf_counter() - start) * 1000:.1f} ms")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if not args.skip_inserts:
+        insert_cost(data, args)
+
+
+def _disk_bytes(directory: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+
+
+def insert_cost(data: np.ndarray, args) -> None:
+    print(f"insert cost at scale, {args.per_label} vectors per add")
+    directory = tempfile.mkdtemp(prefix="ann_bench_")
+    try:
+        store = AnnStore(directory, dim=args.dim, nlist=args.nlist, m=args.m, train_size=args.train_size)
+        step = max(len(data) // 10, args.per_label)
+        latencies, written, compactions, version, size = [], [], 0, None, 0
+        for label, i in enumerate(range(0, len(data), args.per_label)):
+            start = time.perf_counter()
+            store.add(f"doc{label}", data[i:i + args.per_label], [b"x" * 200] * len(data[i:i + args.per_label]))
+            latencies.append((time.perf_counter() - start) * 1000)
+            # A compaction writes a whole snapshot; any other add only what it appended to the current one
+            previous, size = size, _disk_bytes(os.path.join(directory, store._version))
+            if store._version != version:
+                compactions, version = compactions + 1, store._version
+                written.append(size)
+            else:
+                written.append(size - previous)
+            end = i + args.per_label
+            if end % step < args.per_label or end >= len(data):
+                ordered = sorted(latencies)
+                print(f"  at {min(end, len(data)):>7} vectors  add p50 {statistics.median(ordered):7.2f} ms  "
+                      f"p95 {ordered[int(len(ordered) * 0.95)]:7.2f} ms  max {ordered[-1]:8.1f} ms  "
+                      f"written {statistics.mean(written) / 1024:8.1f} KiB per add  snapshots {compactions}")
+                latencies, written = [], []
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Compare serial and process-pool PDF text extraction.
+
+    cd backend
+    python -m benchmarks.bench_pdf_extraction                 # synthetic 600-page PDF
+    python -m benchmarks.bench_pdf_extraction book.pdf --workers 4
+
+The pool is started once before timing, as it is in a running server.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import fitz  # PyMuPDF
+
+from utils import pdf_extractor
+from utils.pdf_extractor import extract_text_from_pdf, iter_pages
+
+PARAGRAPH = (
+    "Utilitarian reasoning weighs the consequences of an action for everyone it affects, "
+    "while deontological reasoning asks whether the action respects duties and rights regardless of outcome. "
+)
+
+
+def make_pdf(path: str, pages: int) -> None:
+    with fitz.open() as pdf:
+        for number in range(pages):
+            page = pdf.new_page()
+            page.insert_textbox(page.rect + (36, 36, -36, -36), f"Page {number + 1}\n" + PARAGRAPH * 14, fontsize=9)
+        pdf.save(path)
+
+
+def timed(label: str, run, repeat: int) -> list:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        pages = run()
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:<34} {best * 1000:9.1f} ms  ({len(pages)} pages)")
+    return pages
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pdf", nargs="?", help="PDF to extract (default: a generated one)")
+    parser.add_argument("--pages", type=int, default=600, help="pages in the generated PDF")
+    parser.add_argument("--workers", type=int, default=pdf_extractor.PDF_EXTRACT_WORKERS)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    path = args.pdf
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), "bench.pdf")
+        make_pdf(path, args.pages)
+    with open(path, "rb") as f:
+        data = f.read()
+    print(f"{path}: {len(data) / 1e6:.1f} MB, {args.workers} workers, {os.cpu_count()} CPUs")
+
+    # Warm the pool so worker start-up is not billed to the first run
+    list(iter_pages(path, max_pages=None, workers=args.workers))
+
+    baseline = timed("extract_text_from_pdf (generator)", lambda: list(extract_text_from_pdf(path)), args.repeat)
+    timed("iter_pages serial", lambda: list(iter_pages(path, max_pages=None, workers=1)), args.repeat)
+    parallel = timed("iter_pages parallel (path)", lambda: list(iter_pages(path, max_pages=None, workers=args.workers)), args.repeat)
+    timed("iter_pages parallel (bytes)", lambda: list(iter_pages(data, max_pages=None, workers=args.workers)), args.repeat)
+
+    assert parallel == baseline, "parallel extraction changed the page texts or their order"
+    pdf_extractor.shutdown_pool()
+
+
+if __name__ == "__main__":
+    main()
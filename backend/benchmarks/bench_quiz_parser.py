@@ -0,0 +1,240 @@
+"""
+Fuzz the quiz parser and measure its parse rate and throughput against the
+previous re.split parser.
+
+    cd backend
+    python -m benchmarks.bench_quiz_parser
+    python -m benchmarks.bench_quiz_parser --quizzes 2000 --seed 3
+
+The fuzz corpus is the sample model outputs in benchmarks/quiz_corpus plus
+generated quizzes with known answers. The generated quizzes are rendered
+with the variations seen in model output: markdown bold, "(A)" and "A."
+options, answers given as a letter or as the option text, years and wrapped
+lines that start with a number, chatter before and after, CRLF line ends,
+missing explanations and truncation. Some options start with the word "a"
+or "A", so an answer given as their text also starts with a letter.
+
+Every text is parsed whole and fed in random chunk sizes. The run fails if
+the parser raises, if the chunked parse differs from the whole one, if a
+question's span is out of order or does not start at its number, or if one
+of the REGRESSIONS resolves to the wrong answer. The parse
+rate is the share of generated questions recovered with the right text and
+answer. Throughput is measured over the whole corpus.
+"""
+import argparse
+import pathlib
+import random
+import re
+import sys
+import time
+from typing import List, NamedTuple
+
+from services.quiz_parser import QuizParser, parse_quiz
+
+CORPUS_DIR = pathlib.Path(__file__).parent / "quiz_corpus"
+
+WORDS = ("consent autonomy duty harm justice data privacy review board trial risk benefit fairness "
+         "trust bias report study subject policy rights law care virtue").split()
+
+
+# Answers that once resolved to the wrong option: (answer line, options, expected answer)
+REGRESSIONS = [
+    ("Answer: a consequentialist view", ("a deontological view", "a consequentialist view", "virtue ethics", "care ethics"),
+     "a consequentialist view"),
+    ("Answer: A consequentialist view.", ("Duty", "Rights", "A consequentialist view", "Care"), "A consequentialist view"),
+    ("Answer: (c)", ("a", "b", "c", "d"), "c"),
+    ("Answer: B) rights", ("Duty", "Rights", "Virtue", "Care"), "Rights"),
+]
+
+
+class Expected(NamedTuple):
+    question: str
+    answer: str
+
+
+def legacy_parse(quiz_text: str) -> List[dict]:
+    """The previous parse_quiz_to_json loop, without its prints or fallback, as the baseline."""
+    questions = []
+    sections = re.split(r'(\d+)\.\s+', quiz_text)
+    for i in range(1, len(sections), 2):
+        if i + 1 >= len(sections):
+            break
+        question_text, options, answer_letter, explanation = "", [], "", ""
+        for line in sections[i + 1].strip().split('\n'):
+            line = line.strip()
+            if not line:
+                continue
+            if not question_text and not re.match(r'^[A-D][\.\)]\s+', line) and 'answer' not in line.lower() and 'explanation' not in line.lower():
+                question_text = line.strip()
+            elif re.match(r'^[A-D][\.\)]\s+', line):
+                options.append(re.sub(r'^[A-D][\.\)]\s+', '', line).strip())
+            elif 'answer:' in line.lower():
+                match = re.search(r'answer:\s*([A-D])', line, re.IGNORECASE)
+                if match:
+                    answer_letter = match.group(1).strip()
+            elif 'explanation:' in line.lower():
+                match = re.search(r'explanation:\s*(.+)', line, re.IGNORECASE)
+                if match:
+                    explanation = match.group(1).strip()
+        if question_text and options and answer_letter:
+            index = ord(answer_letter.upper()) - ord('A')
+            answer = options[index] if 0 <= index < len(options) else ""
+            questions.append({"question": question_text, "answer": answer or answer_letter})
+    return questions
+
+
+def phrase(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def render_quiz(rng: random.Random, count: int):
+    """A generated quiz in a random style, with the questions a correct parse recovers."""
+    bold = rng.random() < 0.3
+    option_style = rng.choice(["{}) ", "{}. ", "({}) "])
+    crlf = rng.random() < 0.2
+    lines, expected = [], []
+    if rng.random() < 0.3:
+        lines += ["Sure! Here is the quiz you asked for:", ""]
+    for n in range(1, count + 1):
+        question = phrase(rng, rng.randint(4, 12)).capitalize()
+        if rng.random() < 0.3:
+            question = f"In {rng.randint(1900, 2024)}. the {question.lower()}"
+        question += "?"
+        options = [
+            rng.choice(["", "", "", "a ", "A "]) + phrase(rng, rng.randint(1, 4)) + f" {n}{letter}" for letter in "ABCD"
+        ]
+        correct = rng.randrange(4)
+        header = f"{n}. {question}"
+        if rng.random() < 0.2:
+            # Wrapped so that the continuation line starts with a number
+            cut = question.index(" ", len(question) // 2)
+            header = f"{n}. {question[:cut]}"
+            question_lines = [header, f"{rng.randint(10, 99)}. {question[cut + 1:]}"]
+            question = f"{question[:cut]} {question_lines[1]}"
+        else:
+            question_lines = [header]
+        if bold:
+            question_lines[0] = f"**{question_lines[0]}**"
+        lines += question_lines
+        lines += [option_style.format(letter) + option for letter, option in zip("ABCD", options)]
+        letter = "ABCD"[correct]
+        answer_style = rng.random()
+        if answer_style < 0.6:
+            answer_line = f"Answer: {letter}"
+        elif answer_style < 0.8:
+            answer_line = f"Answer: {letter}) {options[correct]}"
+        else:
+            answer_line = f"Answer: {options[correct]}"
+        lines.append(answer_line.replace("Answer:", "**Answer:**") if bold else answer_line)
+        if rng.random() < 0.8:
+            lines.append(f"Explanation: {phrase(rng, rng.randint(5, 15))}.")
+        lines.append("")
+        expected.append(Expected(question, options[correct]))
+    if rng.random() < 0.3:
+        lines.append("Let me know if you want more questions!")
+    text = ("\r\n" if crlf else "\n").join(lines)
+    if rng.random() < 0.1:
+        # Truncated output; the cut question may or may not survive
+        text = text[:rng.randrange(len(text) // 2, len(text))]
+        expected = []
+    return text, expected
+
+
+def check(text: str, rng: random.Random) -> list:
+    """Parse text whole and in random chunks; raise AssertionError on any broken invariant."""
+    questions, _ = parse_quiz(text)
+    parser = QuizParser()
+    chunked, position = [], 0
+    while position < len(text):
+        size = rng.choice([1, 2, 7, 64, 4096])
+        chunked.extend(parser.feed(text[position:position + size]))
+        position += size
+    chunked.extend(parser.close())
+    assert chunked == questions, "chunked parse differs from the whole parse"
+
+    previous_end = 0
+    for question in questions:
+        assert previous_end <= question.start < question.end <= len(text), f"bad span {question.start}:{question.end}"
+        assert str(question.number) in text[question.start:question.start + 16], "span does not start at the number"
+        assert 0 <= question.confidence <= 1
+        previous_end = question.end
+    return questions
+
+
+def mutate(rng: random.Random, text: str) -> str:
+    """Random damage to a sample: dropped, duplicated or swapped lines and stray characters."""
+    lines = text.split("\n")
+    for _ in range(rng.randint(1, 4)):
+        i = rng.randrange(len(lines))
+        operation = rng.random()
+        if operation < 0.3:
+            del lines[i]
+        elif operation < 0.5:
+            lines.insert(i, lines[i])
+        elif operation < 0.7:
+            j = rng.randrange(len(lines))
+            lines[i], lines[j] = lines[j], lines[i]
+        else:
+            k = rng.randint(0, len(lines[i]))
+            lines[i] = lines[i][:k] + rng.choice(["*", "#", ".", ")", "9", " ", "\t", "é"]) + lines[i][k:]
+        if not lines:
+            lines = [""]
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--quizzes", type=int, default=500, help="generated quizzes")
+    parser.add_argument("--questions", type=int, default=10, help="questions per generated quiz")
+    parser.add_argument("--mutations", type=int, default=200, help="mutated copies of each corpus sample")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    samples = [path.read_text(encoding="utf-8") for path in sorted(CORPUS_DIR.glob("*.txt"))]
+    fuzzed = [mutate(rng, sample) for sample in samples for _ in range(args.mutations)]
+    generated = [render_quiz(rng, args.questions) for _ in range(args.quizzes)]
+    texts = samples + fuzzed + [text for text, _ in generated]
+
+    failures = 0
+    for answer_line, options, expected in REGRESSIONS:
+        text = "1. Which view?\n" + "".join(f"{l}) {o}\n" for l, o in zip("ABCD", options)) + answer_line + "\n"
+        answers = [q.answer for q in parse_quiz(text)[0]]
+        if answers != [expected]:
+            failures += 1
+            print(f"FAIL regression {answer_line!r}: got {answers}, expected {expected!r}")
+    for text in texts:
+        try:
+            check(text, rng)
+        except Exception as e:
+            failures += 1
+            if failures <= 3:
+                print(f"FAIL {type(e).__name__}: {e}\n{text[:300]!r}\n")
+    print(f"fuzz: {len(REGRESSIONS)} regressions, {len(texts)} texts ({len(samples)} samples, {len(fuzzed)} mutated, {len(generated)} generated), "
+          f"{failures} failures")
+
+    found_new = found_legacy = total = 0
+    for text, expected in generated:
+        if not expected:
+            continue
+        total += len(expected)
+        new = {(q.question, q.answer) for q in parse_quiz(text)[0]}
+        old = {(q["question"], q["answer"]) for q in legacy_parse(text)}
+        found_new += sum(tuple(e) in new for e in expected)
+        found_legacy += sum(tuple(e) in old for e in expected)
+    print(f"parse rate: QuizParser {found_new / total:.1%}, legacy {found_legacy / total:.1%} of {total} questions")
+
+    size = sum(len(text) for text in texts)
+    for label, parse in (("QuizParser", parse_quiz), ("legacy", legacy_parse)):
+        start = time.perf_counter()
+        for text in texts:
+            parse(text)
+        elapsed = time.perf_counter() - start
+        print(f"{label:<11} {size / elapsed / 1e6:6.2f} MB/s over {size / 1e6:.1f} MB")
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Compare ingest and query cost of the BM25 inverted index with the dense paths.
+
+    cd backend
+    python -m benchmarks.bench_retrieval
+    python -m benchmarks.bench_retrieval --documents 200 --chunks 40 --vocabulary 80000
+
+The corpus is synthetic: chunks of Zipf-distributed words from a vocabulary of
+the given size, grouped into documents. Three paths are measured:
+
+    tfidf-dense   the original ingest: fit a TfidfVectorizer and expand to
+                  vocabulary-sized Python lists (ingest only, nothing stored)
+    chroma        the hashed dense embeddings of retrieval_service, written to
+                  an in-memory Chroma collection (skipped if chromadb is missing;
+                  queries use term frequencies only, as IDF lives in Postgres)
+    bm25          services.bm25_index in a temporary directory
+
+Peak memory is the Python allocation peak from tracemalloc during ingest.
+"""
+import argparse
+import pathlib
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+
+from services.bm25_index import BM25Index
+from services.retrieval_service import HASH_FEATURES
+
+
+def make_corpus(documents: int, chunks: int, vocabulary: int, words_per_chunk: int, seed: int):
+    rng = np.random.default_rng(seed)
+    words = np.array([f"t{i:x}" for i in range(vocabulary)])
+    corpus = []
+    for _ in range(documents):
+        ids = np.minimum(rng.zipf(1.2, size=(chunks, words_per_chunk)), vocabulary) - 1
+        corpus.append([" ".join(words[row]) for row in ids])
+    queries = [" ".join(words[np.minimum(rng.zipf(1.4, size=4), vocabulary) - 1]) for _ in range(200)]
+    return corpus, queries
+
+
+def measure(label: str, ingest, search, queries) -> None:
+    tracemalloc.start()
+    start = time.perf_counter()
+    ingest()
+    ingest_s = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    line = f"{label:<12} ingest {ingest_s * 1000:9.1f} ms  peak {peak / 1e6:8.1f} MB"
+    if search is not None:
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            search(query)
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+        line += f"  query p50 {statistics.median(latencies):7.2f} ms  p95 {latencies[int(len(latencies) * 0.95)]:7.2f} ms"
+    print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--documents", type=int, default=50)
+    parser.add_argument("--chunks", type=int, default=30, help="chunks per document")
+    parser.add_argument("--vocabulary", type=int, default=50000)
+    parser.add_argument("--words", type=int, default=160, help="words per chunk (about 1000 characters)")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    corpus, queries = make_corpus(args.documents, args.chunks, args.vocabulary, args.words, args.seed)
+    flat = [chunk for document in corpus for chunk in document]
+    print(f"{len(corpus)} documents, {len(flat)} chunks, vocabulary {args.vocabulary}, {len(queries)} queries")
+
+    def tfidf_ingest():
+        TfidfVectorizer().fit_transform(flat).toarray().tolist()
+
+    measure("tfidf-dense", tfidf_ingest, None, queries)
+
+    try:
+        import chromadb
+    except ImportError:
+        print("chroma       skipped: chromadb is not installed")
+    else:
+        vectorizer = HashingVectorizer(n_features=HASH_FEATURES, alternate_sign=False, norm=None)
+        collection = chromadb.Client().create_collection(f"bench_{time.time_ns()}", metadata={"hnsw:space": "cosine"})
+
+        def chroma_ingest():
+            for d, document in enumerate(corpus):
+                dense = vectorizer.transform(document).toarray().astype(np.float32)
+                norms = np.linalg.norm(dense, axis=1, keepdims=True)
+                norms[norms == 0] = 1.0
+                dense /= norms
+                for i in range(0, len(document), 32):
+                    collection.upsert(
+                        documents=document[i:i + 32],
+                        embeddings=dense[i:i + 32].tolist(),
+                        ids=[f"{d}:{j}" for j in range(i, i + len(document[i:i + 32]))],
+                    )
+
+        def chroma_search(query):
+            embedding = vectorizer.transform([query]).toarray()[0].astype(np.float32)
+            norm = np.linalg.norm(embedding)
+            if norm:
+                collection.query(query_embeddings=[(embedding / norm).tolist()], n_results=args.top_k)
+
+        measure("chroma", chroma_ingest, chroma_search, queries)
+
+    directory = tempfile.mkdtemp(prefix="bm25_bench_")
+    try:
+        index = BM25Index(directory)
+
+        def bm25_ingest():
+            for d, document in enumerate(corpus):
+                index.add(f"doc{d}", document, f"doc{d}.pdf", [f"doc{d}:{i}" for i in range(len(document))])
+
+        measure("bm25", bm25_ingest, lambda query: index.search(query, args.top_k), queries)
+        on_disk = sum(f.stat().st_size for f in pathlib.Path(directory).rglob("*") if f.is_file())
+        print(f"bm25 index on disk: {on_disk / 1e6:.1f} MB")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -17,6 +17,64 @@ OPTIONAL_VARS = {
     "PORT": "Server port (defaults to 8000)",
     "ALLOWED_ORIGINS": "CORS allowed origins (comma-separated)",
     "ENVIRONMENT": "Environment name (development/production)",
+    "ASYNC_DATABASE_URL": "asyncpg connection string (defaults to DATABASE_URL)",
+    "DB_POOL_SIZE": "Connections kept open per worker, split between the sync and async engines (defaults to 10)",
+    "DB_MAX_OVERFLOW": "Extra connections allowed above the pool size per worker, split likewise (defaults to 20)",
+    "DB_POOL_TIMEOUT": "Seconds to wait for a free connection (defaults to 30)",
+    "DB_POOL_RECYCLE": "Seconds before a pooled connection is replaced (defaults to 1800)",
+    "PARTITION_MONTHS_AHEAD": "Monthly quiz_attempts partitions to create ahead of now (defaults to 3)",
+    "ATTEMPT_RETENTION_MONTHS": "Months of raw quiz attempts kept before compaction into rollups (defaults to 12)",
+    "READ_REPLICA_URL": "Read replica connection string for read-only endpoints (defaults to the primary)",
+    "ASYNC_READ_REPLICA_URL": "asyncpg connection string for the read replica (defaults to READ_REPLICA_URL)",
+    "READ_YOUR_WRITES_SECONDS": "Seconds a user's reads stay on the primary after they write (defaults to 5)",
+    "SUBMISSION_BUFFER_ENABLED": "Journal submissions locally and write them to Postgres in batches (defaults to false)",
+    "SUBMISSION_JOURNAL_DIR": "Directory for the submission journal (defaults to db/submission_journal)",
+    "SUBMISSION_FLUSH_MS": "Milliseconds between batched submission writes (defaults to 200)",
+    "SUBMISSION_FLUSH_MAX": "Pending submissions that trigger an early flush (defaults to 500)",
+    "SUBMISSION_ID_BLOCK": "Attempt ids reserved from the sequence at a time (defaults to 100)",
+    "AUTH_USER_CACHE_TTL": "Seconds a resolved user is cached per token (defaults to 60)",
+    "AUTH_USER_CACHE_SIZE": "Maximum cached token users per process (defaults to 10000)",
+    "AUTH_TRUST_TOKEN_CLAIMS": "Trust uid/act/rol token claims and skip the user lookup (defaults to false)",
+    "BCRYPT_ROUNDS": "bcrypt work factor for new password hashes (defaults to 12)",
+    "PASSWORD_HASH_WORKERS": "Threads that hash and verify passwords (defaults to min(4, CPUs))",
+    "PASSWORD_HASH_MAX_QUEUE": "Password hashes allowed in flight before returning 503 (defaults to 64)",
+    "LOG_LEVEL": "Application log level (defaults to INFO)",
+    "ACCESS_LOG_SAMPLE_RATE": "Fraction of requests written to the access log; errors and slow requests are always logged (defaults to 1.0)",
+    "ACCESS_LOG_SLOW_MS": "Requests slower than this are always logged (defaults to 1000)",
+    "ACCESS_LOG_BODY_BYTES": "Leading request-body bytes to include in the access log; 0 disables capture (defaults to 0)",
+    "ACCESS_LOG_BODY_EXCLUDE": "Comma-separated paths whose bodies are never captured (defaults to /register,/token)",
+    "MAX_UPLOAD_MB": "Largest accepted PDF upload in MB (defaults to 25)",
+    "UPLOAD_SPOOL_MB": "Uploads larger than this spill from memory to a temp file (defaults to 5)",
+    "MAX_PDF_PAGES": "Largest accepted PDF page count (defaults to 500)",
+    "PDF_EXTRACT_WORKERS": "Processes extracting large PDFs in parallel; 1 disables the pool (defaults to the CPU count)",
+    "PDF_PARALLEL_MIN_PAGES": "PDFs with fewer pages are extracted serially (defaults to 64)",
+    "PDF_PAGES_PER_TASK": "Pages per parallel extraction task (defaults to 16)",
+    "GENERATION_CACHE_TTL_HOURS": "Hours a generated quiz is reused for the same content and settings (defaults to 168)",
+    "RETRIEVAL_BACKEND": "Retrieval index: chroma, bm25 or ivfpq (defaults to chroma)",
+    "BM25_INDEX_DIR": "Directory of the BM25 index segments (defaults to db/bm25_index)",
+    "BM25_K1": "BM25 term-frequency saturation (defaults to 1.2)",
+    "BM25_B": "BM25 length normalisation (defaults to 0.75)",
+    "INGESTION_WORKERS": "Background indexing threads per API process; 0 when a separate worker runs (defaults to 1)",
+    "INGESTION_POLL_MS": "How often idle ingestion workers look for jobs (defaults to 1000)",
+    "INGESTION_BATCH_SIZE": "Chunks embedded and written per batch (defaults to 32)",
+    "INGESTION_MAX_ATTEMPTS": "Attempts before an ingestion job is marked failed (defaults to 5)",
+    "INGESTION_RETRY_BASE_SECONDS": "First retry delay, doubled per attempt (defaults to 5)",
+    "INGESTION_STALE_SECONDS": "A running job without a heartbeat for this long is reclaimed (defaults to 300)",
+    "ANN_INDEX_DIR": "Directory of the IVF-PQ index (defaults to db/ann_index)",
+    "ANN_NLIST": "IVF-PQ coarse clusters (defaults to 256)",
+    "ANN_PQ_M": "IVF-PQ code bytes per vector; must divide the embedding size (defaults to 64)",
+    "ANN_NPROBE": "Clusters scanned per unscoped query; higher is slower with better recall (defaults to 8)",
+    "ANN_TRAIN_SIZE": "Vectors kept exact before the IVF-PQ quantisers are trained (defaults to 10000)",
+    "ANN_DELTA_FRACTION": "Appended and replaced IVF-PQ entries, as a fraction of the base, that trigger a compaction (defaults to 0.25)",
+    "SNAPSHOT_KEEP": "Published versions of each BM25 or IVF-PQ index snapshot kept on disk (defaults to 2)",
+    "DB_ASYNC_POOL_SIZE": "Share of DB_POOL_SIZE given to the async engine (defaults to half)",
+    "DB_ASYNC_MAX_OVERFLOW": "Share of DB_MAX_OVERFLOW given to the async engine (defaults to half)",
+    "ATTEMPT_DROP_COMPACTED": "Drop compacted quiz_attempts months instead of keeping them as archive tables (defaults to false)",
+    "GENERATION_INDEX_WAIT_SECONDS": "How long a new upload waits for indexing before generating without context, which is then not cached (defaults to 10)",
+    "INGESTION_HEARTBEAT_SECONDS": "How often a running ingestion job records a heartbeat (defaults to INGESTION_STALE_SECONDS / 5)",
+    "INGESTION_STOP_SECONDS": "How long shutdown waits for running ingestion jobs (defaults to 10)",
+    "GRADE_BATCH_MAX_MB": "Largest accepted grade-batch body in MB (defaults to 25)",
+    "AUTH_CLAIMS_MAX_AGE": "Seconds after issue that trusted token claims skip the user lookup (defaults to AUTH_USER_CACHE_TTL)",
 }
 
 def check_environment():
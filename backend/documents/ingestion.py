@@ -0,0 +1,214 @@
+"""
+Background indexing of uploaded documents.
+
+The upload route only records an ingestion job. Worker threads claim pending
+jobs with FOR UPDATE SKIP LOCKED. There are INGESTION_WORKERS of them per API
+process (default 1; 0 when `python -m documents.ingestion work` runs as its
+own process). Any number of workers, in any number of processes, can share
+the queue without two taking the same job.
+
+A job reads the document's stored pages and embeds and writes its chunks in
+batches of INGESTION_BATCH_SIZE. Progress is recorded after each batch. A
+heartbeat is also recorded every INGESTION_HEARTBEAT_SECONDS while the job
+runs, so a long chunking or index build keeps its claim even when no batch
+finishes. The BM25 and IVF-PQ backends write a document in a single step.
+Finally the document is marked indexed. A failed job is retried
+with exponential backoff up to INGESTION_MAX_ATTEMPTS times. A running job
+whose heartbeat is older than INGESTION_STALE_SECONDS (its worker died) is
+claimed again. Chunk ids are deterministic, so a retried or reclaimed job
+overwrites whatever a previous run had written.
+"""
+import os
+import sys
+import threading
+import time
+from datetime import timedelta
+from typing import List, Optional
+
+from sqlalchemy import func, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from documents import models
+from documents.services import mark_indexed
+from services.retrieval_service import store_text_chunks
+from utils.access_log import get_logger
+
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "1"))
+INGESTION_POLL_MS = int(os.getenv("INGESTION_POLL_MS", "1000"))
+INGESTION_BATCH_SIZE = int(os.getenv("INGESTION_BATCH_SIZE", "32"))
+INGESTION_MAX_ATTEMPTS = int(os.getenv("INGESTION_MAX_ATTEMPTS", "5"))
+INGESTION_RETRY_BASE_SECONDS = float(os.getenv("INGESTION_RETRY_BASE_SECONDS", "5"))
+INGESTION_STALE_SECONDS = int(os.getenv("INGESTION_STALE_SECONDS", "300"))
+INGESTION_HEARTBEAT_SECONDS = float(os.getenv("INGESTION_HEARTBEAT_SECONDS", str(INGESTION_STALE_SECONDS / 5)))
+# How long shutdown waits for running jobs; an unfinished job is reclaimed once its heartbeat goes stale
+INGESTION_STOP_SECONDS = float(os.getenv("INGESTION_STOP_SECONDS", "10"))
+
+logger = get_logger("ingestion")
+
+_wake = threading.Event()
+_stopping = threading.Event()
+_threads: List[threading.Thread] = []
+
+_CLAIM = text("""
+    UPDATE ingestion_jobs
+    SET status = 'running', attempts = attempts + 1, heartbeat_at = now()
+    WHERE id = (
+        SELECT id FROM ingestion_jobs
+        WHERE (status = 'pending' AND run_after <= now())
+           OR (status = 'running' AND heartbeat_at < now() - make_interval(secs => :stale))
+        ORDER BY run_after, id
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, content_hash, source_name, attempts
+""")
+
+
+def enqueue(db: Session, content_hash: str, source_name: str) -> None:
+    """
+    Queue indexing of a stored document. A finished or failed job for it is
+    queued again (the caller saw the document unindexed); a pending or running
+    one is left alone.
+    """
+    statement = pg_insert(models.IngestionJob).values(content_hash=content_hash, source_name=source_name)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=["content_hash"],
+        set_={"status": "pending", "attempts": 0, "run_after": func.now(), "last_error": None},
+        where=models.IngestionJob.status.in_(["done", "failed"]),
+    ))
+    db.commit()
+    _wake.set()
+
+
+def get_job(db: Session, content_hash: str) -> Optional[models.IngestionJob]:
+    return db.execute(
+        select(models.IngestionJob).where(models.IngestionJob.content_hash == content_hash)
+    ).scalar_one_or_none()
+
+
+def _set(job_id: int, **values) -> None:
+    with SessionLocal() as db:
+        db.execute(update(models.IngestionJob).where(models.IngestionJob.id == job_id).values(**values))
+        db.commit()
+
+
+def run_next() -> bool:
+    """Claim and run one job. Returns False if none was ready."""
+    with SessionLocal() as db:
+        job = db.execute(_CLAIM, {"stale": INGESTION_STALE_SECONDS}).first()
+        db.commit()
+    if job is None:
+        return False
+
+    def progress(done: int, total: int) -> None:
+        _set(job.id, chunks_done=done, chunks_total=total, heartbeat_at=func.now())
+
+    finished = threading.Event()
+
+    def heartbeat() -> None:
+        while not finished.wait(INGESTION_HEARTBEAT_SECONDS):
+            try:
+                _set(job.id, heartbeat_at=func.now())
+            except Exception as e:
+                logger.warning("Ingestion heartbeat failed", extra={"document": job.content_hash, "error": str(e)})
+
+    beating = threading.Thread(target=heartbeat, name=f"ingestion-heartbeat-{job.id}", daemon=True)
+    beating.start()
+    try:
+        with SessionLocal() as db:
+            pages = db.execute(
+                select(models.Document.pages).where(models.Document.content_hash == job.content_hash)
+            ).scalar_one()
+            stats = store_text_chunks(
+                pages, job.source_name, job.content_hash, batch_size=INGESTION_BATCH_SIZE, on_progress=progress
+            )
+            mark_indexed(db, job.content_hash, stats)
+        _set(job.id, status="done", chunks_done=stats.chunk_count, chunks_total=stats.chunk_count,
+             last_error=None, finished_at=func.now())
+        logger.info("Indexed document", extra={"document": job.content_hash, "chunks": stats.chunk_count})
+    except Exception as e:
+        if job.attempts >= INGESTION_MAX_ATTEMPTS:
+            _set(job.id, status="failed", last_error=str(e), finished_at=func.now())
+            logger.error("Ingestion failed for good", extra={"document": job.content_hash, "attempts": job.attempts, "error": str(e)})
+        else:
+            delay = INGESTION_RETRY_BASE_SECONDS * 2 ** (job.attempts - 1)
+            _set(job.id, status="pending", last_error=str(e),
+                 run_after=func.now() + timedelta(seconds=delay))
+            logger.warning("Ingestion failed, will retry", extra={
+                "document": job.content_hash, "attempts": job.attempts, "retry_in_s": delay, "error": str(e),
+            })
+    finally:
+        finished.set()
+        beating.join()
+    return True
+
+
+def _work() -> None:
+    while not _stopping.is_set():
+        try:
+            while not _stopping.is_set() and run_next():
+                pass
+        except Exception as e:
+            # Database unavailable and the like; try again next poll
+            logger.warning("Ingestion worker error", extra={"error": str(e)})
+        _wake.wait(INGESTION_POLL_MS / 1000.0)
+        _wake.clear()
+
+
+def start(workers: int = INGESTION_WORKERS) -> None:
+    if _threads or workers <= 0:
+        return
+    _stopping.clear()
+    for n in range(workers):
+        thread = threading.Thread(target=_work, name=f"ingestion-worker-{n}", daemon=True)
+        thread.start()
+        _threads.append(thread)
+    print(f"✓ Ingestion workers on: {workers}")
+
+
+def stop(timeout: float = INGESTION_STOP_SECONDS) -> None:
+    """
+    Let running jobs finish their current document, waiting up to timeout in
+    all. Blocks, so call it off the event loop.
+    """
+    _stopping.set()
+    _wake.set()
+    deadline = time.monotonic() + timeout
+    for thread in _threads:
+        thread.join(max(0.0, deadline - time.monotonic()))
+    running = [thread.name for thread in _threads if thread.is_alive()]
+    if running:
+        # Daemon threads; their jobs are claimed again once the heartbeat goes stale
+        logger.warning("Ingestion workers still running at shutdown", extra={"threads": running})
+    _threads.clear()
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    from database import import_models
+    from utils.access_log import setup_logging, shutdown_logging
+
+    import_models()
+    command = sys.argv[1] if len(sys.argv) > 1 else "work"
+    if command == "work":
+        setup_logging()
+        start(max(1, INGESTION_WORKERS))
+        try:
+            for thread in _threads:
+                thread.join()
+        except KeyboardInterrupt:
+            stop()
+        finally:
+            shutdown_logging()
+    elif command == "drain":
+        setup_logging()
+        while run_next():
+            pass
+        shutdown_logging()
+    else:
+        print("Usage: python -m documents.ingestion [work|drain]")
+        sys.exit(1)
@@ -0,0 +1,79 @@
+from sqlalchemy import Column, DateTime, Index, Integer, String, Text, UniqueConstraint
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.sql import func
+
+from database import Base
+
+
+class Document(Base):
+    """
+    One row per distinct uploaded file, keyed by the sha256 of its bytes.
+    The extracted page texts are kept so a re-upload skips extraction, and
+    indexed_at records that its chunks are in the retrieval index.
+    """
+    __tablename__ = "documents"
+
+    content_hash = Column(String(64), primary_key=True)
+    source_name = Column(String)  # Filename of the first upload
+    page_count = Column(Integer, nullable=False)
+    pages = Column(JSONB, nullable=False)  # Page texts, in order
+    chunk_count = Column(Integer, nullable=True)
+    indexed_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class QuizGeneration(Base):
+    """
+    A parsed quiz generated for some content at given settings, reused until
+    expires_at. content_hash is a Document's hash for uploads and the sha256
+    of the text for pasted text.
+    """
+    __tablename__ = "quiz_generations"
+    __table_args__ = (
+        UniqueConstraint(
+            "content_hash", "level", "num_questions", "prompt_version",
+            name="uq_quiz_generations_content_level_questions_prompt",
+        ),
+        Index("ix_quiz_generations_expires_at", "expires_at"),  # Purging expired rows
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    content_hash = Column(String(64), nullable=False)
+    level = Column(String, nullable=False)
+    num_questions = Column(Integer, nullable=False)
+    prompt_version = Column(String, nullable=False)
+    quiz = Column(JSONB, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class RetrievalTermStat(Base):
+    """Number of indexed chunks containing each embedding hash bucket, for query-time IDF."""
+    __tablename__ = "retrieval_term_stats"
+
+    feature = Column(Integer, primary_key=True, autoincrement=False)
+    doc_freq = Column(Integer, nullable=False, default=0)
+
+
+class IngestionJob(Base):
+    """
+    Background indexing of one document's chunks, run by documents/ingestion.py.
+    status is pending, running, done or failed.
+    """
+    __tablename__ = "ingestion_jobs"
+    __table_args__ = (
+        Index("ix_ingestion_jobs_status_run_after", "status", "run_after"),  # Claiming the next job
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    content_hash = Column(String(64), nullable=False, unique=True)
+    source_name = Column(String)
+    status = Column(String, nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    chunks_done = Column(Integer, nullable=False, default=0)
+    chunks_total = Column(Integer, nullable=True)
+    last_error = Column(Text, nullable=True)
+    run_after = Column(DateTime(timezone=True), nullable=False, server_default=func.now())  # Retry backoff
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)  # Last progress while running
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
@@ -0,0 +1,110 @@
+import os
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from documents import models
+from utils.pdf_extractor import ExtractedDocument
+
+GENERATION_CACHE_TTL_HOURS = float(os.getenv("GENERATION_CACHE_TTL_HOURS", "168"))
+# Expired cache rows removed per write, so purging never turns into one long delete
+_PURGE_BATCH = 100
+
+
+def get_document(db: Session, content_hash: str) -> Optional[models.Document]:
+    return db.execute(select(models.Document).where(models.Document.content_hash == content_hash)).scalar_one_or_none()
+
+
+def get_index_state(db: Session, content_hash: str):
+    """(indexed_at, chunk_count) of a document without loading its pages, or None."""
+    return db.execute(
+        select(models.Document.indexed_at, models.Document.chunk_count).where(models.Document.content_hash == content_hash)
+    ).first()
+
+
+def as_extracted(document: models.Document, source_name: str) -> ExtractedDocument:
+    return ExtractedDocument(source_name, tuple(document.pages))
+
+
+def save_document(db: Session, content_hash: str, extracted: ExtractedDocument) -> models.Document:
+    """Store the extracted pages under content_hash. A concurrent upload of the same file keeps the first row."""
+    db.execute(
+        pg_insert(models.Document)
+        .values(
+            content_hash=content_hash,
+            source_name=extracted.source_name,
+            page_count=extracted.page_count,
+            pages=list(extracted.pages),
+        )
+        .on_conflict_do_nothing(index_elements=["content_hash"])
+    )
+    db.commit()
+    return get_document(db, content_hash)
+
+
+def mark_indexed(db: Session, content_hash: str, stats) -> bool:
+    """
+    Record that the document's chunks are in the retrieval index and add the
+    document frequencies from store_text_chunks' ChunkStats to the term stats.
+    Only the first caller for a document counts it. Returns whether this one did.
+    """
+    claimed = db.execute(
+        update(models.Document)
+        .where(models.Document.content_hash == content_hash, models.Document.indexed_at.is_(None))
+        .values(chunk_count=stats.chunk_count, indexed_at=func.now())
+    ).rowcount
+    if claimed and stats.doc_freqs:
+        statement = pg_insert(models.RetrievalTermStat).values(
+            [{"feature": feature, "doc_freq": count} for feature, count in sorted(stats.doc_freqs.items())]
+        )
+        db.execute(statement.on_conflict_do_update(
+            index_elements=["feature"],
+            set_={"doc_freq": models.RetrievalTermStat.doc_freq + statement.excluded.doc_freq},
+        ))
+    db.commit()
+    return bool(claimed)
+
+
+def get_cached_generation(
+    db: Session, content_hash: str, level: str, num_questions: int, prompt_version: str
+) -> Optional[Dict[str, Any]]:
+    """The cached quiz for these settings, unless it has expired."""
+    return db.execute(
+        select(models.QuizGeneration.quiz).where(
+            models.QuizGeneration.content_hash == content_hash,
+            models.QuizGeneration.level == level,
+            models.QuizGeneration.num_questions == num_questions,
+            models.QuizGeneration.prompt_version == prompt_version,
+            models.QuizGeneration.expires_at > func.now(),
+        )
+    ).scalar_one_or_none()
+
+
+def save_generation(
+    db: Session, content_hash: str, level: str, num_questions: int, prompt_version: str, quiz: Dict[str, Any]
+) -> None:
+    """Cache quiz for GENERATION_CACHE_TTL_HOURS, replacing any earlier quiz for the same settings."""
+    expires_at = func.now() + timedelta(hours=GENERATION_CACHE_TTL_HOURS)
+    statement = pg_insert(models.QuizGeneration).values(
+        content_hash=content_hash,
+        level=level,
+        num_questions=num_questions,
+        prompt_version=prompt_version,
+        quiz=quiz,
+        expires_at=expires_at,
+    )
+    db.execute(statement.on_conflict_do_update(
+        constraint="uq_quiz_generations_content_level_questions_prompt",
+        set_={"quiz": statement.excluded.quiz, "created_at": func.now(), "expires_at": expires_at},
+    ))
+    expired = (
+        select(models.QuizGeneration.id)
+        .where(models.QuizGeneration.expires_at <= func.now())
+        .limit(_PURGE_BATCH)
+        .scalar_subquery()
+    )
+    db.execute(delete(models.QuizGeneration).where(models.QuizGeneration.id.in_(expired)))
+    db.commit()
@@ -1,22 +1,49 @@
 import os
 import importlib
 from dotenv import load_dotenv
-from fastapi import FastAPI, Request
+from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 
 # Load environment variables
 load_dotenv()
 
-from database import engine, Base
+from contextlib import asynccontextmanager
+import database
+from auth import utils as auth_utils
+from database import engine, Base, import_models
+import migrations
+from quizzes import partitions, submission_buffer
+from documents import ingestion
+from utils.access_log import AccessLogMiddleware, setup_logging, shutdown_logging
+from utils import pdf_extractor
+from utils.uploads import GRADE_BATCH_MAX_BYTES, UploadSizeLimitMiddleware
+
 # Import all models here so tables can be created
-from auth import models
-from quizzes import models as quiz_models
+import_models()
+setup_logging()
 
-# Automatically create all tables
-Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create tables missing on a fresh database; schema changes go through `python -m migrations upgrade`
+    Base.metadata.create_all(bind=engine)
+    # A freshly created quiz_attempts has no partitions yet; make sure the current months exist
+    with engine.begin() as conn:
+        partitions.ensure_partitions(conn)
+    migrations.report_status(engine)
+    if database.replica_enabled():
+        print(f"✓ Read-only endpoints use the read replica (read-your-writes window {database.READ_YOUR_WRITES_SECONDS}s)")
+    # Replays any journal left by a crash before taking new submissions
+    submission_buffer.start(engine)
+    ingestion.start()
+    yield
+    await run_in_threadpool(ingestion.stop)
+    submission_buffer.stop()
+    pdf_extractor.shutdown_pool()
+    shutdown_logging()
 
-app = FastAPI(title="EthQ API", version="1.0.0")
+app = FastAPI(title="EthQ API", version="1.0.0", lifespan=lifespan)
 
 # CORS Configuration - More permissive for debugging
 ALLOWED_ORIGINS = os.getenv(
@@ -37,27 +64,15 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["*"],
+    expose_headers=["*", database.READ_PRIMARY_HEADER, "X-Next-Cursor"],
 )
 
-# Add request logging middleware
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    print(f"DEBUG: {request.method} {request.url}")
-    print(f"DEBUG: Headers: {dict(request.headers)}")
-    
-    # Try to read body for POST requests
-    if request.method == "POST":
-        try:
-            body = await request.body()
-            print(f"DEBUG: Body length: {len(body)} bytes")
-            print(f"DEBUG: Body preview: {body[:200]}")
-        except Exception as e:
-            print(f"DEBUG: Could not read body: {e}")
-    
-    response = await call_next(request)
-    print(f"DEBUG: Response status: {response.status_code}")
-    return response
+# Refuse oversized uploads with 413 before their bodies are read
+app.add_middleware(UploadSizeLimitMiddleware, paths={"/quiz/upload"})
+app.add_middleware(UploadSizeLimitMiddleware, paths={r"/quizzes/\d+/grade-batch"}, max_bytes=GRADE_BATCH_MAX_BYTES)
+
+# One sampled JSON access-log line per request, written off the request path
+app.add_middleware(AccessLogMiddleware)
 
 def _safe_include(module_path: str, router_attr: str = "router", prefix: str = ""):
     """
@@ -100,7 +115,7 @@ def read_root():
 # Health check endpoint
 @app.get("/health")
 def health_check():
-    return {"status": "healthy"}
+    return {"status": "healthy", "password_hashing": auth_utils.password_hash_stats()}
 
 if __name__ == "__main__":
     import uvicorn
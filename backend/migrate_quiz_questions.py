@@ -0,0 +1,12 @@
+"""
+Superseded by migrations/versions/0003_quiz_questions.py.
+Kept so existing instructions keep working; prefer `python -m migrations upgrade`.
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from migrations import upgrade
+
+if __name__ == "__main__":
+    upgrade(target=3)
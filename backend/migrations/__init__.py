@@ -0,0 +1,170 @@
+"""
+Versioned schema migrations.
+
+Each file in migrations/versions is named NNNN_description.py and defines
+upgrade(conn). Applied versions are recorded in schema_migrations, so
+`python -m migrations upgrade` only runs what is new. A migration that sets
+TRANSACTIONAL = False (e.g. for CREATE INDEX CONCURRENTLY) runs on an
+autocommit connection and must be idempotent on its own.
+"""
+import importlib.util
+import os
+import re
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy import text
+
+VERSIONS_DIR = os.path.join(os.path.dirname(__file__), "versions")
+_VERSION_FILE = re.compile(r"^(\d{4})_(\w+)\.py$")
+
+# Arbitrary key for pg_advisory_lock so two deploys never migrate at once
+_MIGRATION_LOCK_KEY = 4242031
+
+# Indexes the hot queries rely on: (table, index name)
+REQUIRED_INDEXES = [
+    ("quiz_attempts", "ix_quiz_attempts_user_id_timestamp"),
+    ("quiz_attempts", "ix_quiz_attempts_quiz_id"),
+    ("user_justifications", "ix_user_justifications_attempt_id"),
+    ("quizzes", "ix_quizzes_created_at_id"),
+    ("quiz_questions", "ix_quiz_questions_quiz_id"),
+]
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    path: str
+
+
+def discover() -> List[Migration]:
+    migrations = []
+    for filename in sorted(os.listdir(VERSIONS_DIR)):
+        match = _VERSION_FILE.match(filename)
+        if match:
+            migrations.append(Migration(int(match.group(1)), match.group(2), os.path.join(VERSIONS_DIR, filename)))
+    return migrations
+
+
+def _load(migration: Migration):
+    spec = importlib.util.spec_from_file_location(f"migrations.versions.v{migration.version:04d}", migration.path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _ensure_version_table(conn) -> None:
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR NOT NULL,
+            applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+
+
+def applied_versions(conn) -> set:
+    exists = conn.execute(text("SELECT to_regclass('schema_migrations') IS NOT NULL")).scalar()
+    if not exists:
+        return set()
+    return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def pending(engine) -> List[Migration]:
+    with engine.connect() as conn:
+        done = applied_versions(conn)
+    return [m for m in discover() if m.version not in done]
+
+
+def create_index_concurrently(conn, name: str, table: str, definition: str) -> None:
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS, dropping an INVALID leftover from
+    an interrupted earlier attempt first. conn must be in autocommit mode.
+    """
+    valid = conn.execute(text("""
+        SELECT i.indisvalid
+        FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = :name
+    """), {"name": name}).scalar()
+    if valid:
+        # Already there (e.g. from create_all); also avoids CONCURRENTLY on partitioned tables
+        return
+    if valid is False:
+        print(f"Dropping invalid index {name}...")
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    print(f"Creating index {name}...")
+    conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}"))
+
+
+def upgrade(engine=None, target: Optional[int] = None) -> List[Migration]:
+    """Apply pending migrations up to target (inclusive). Returns the migrations applied."""
+    if engine is None:
+        from database import engine, Base, import_models
+        import_models()
+        # Bootstrap any table that does not exist yet; migrations handle existing ones
+        Base.metadata.create_all(bind=engine)
+
+    applied = []
+    # Autocommit so the lock holder is not an open transaction that CONCURRENTLY builds wait on
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_conn:
+        lock_conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": _MIGRATION_LOCK_KEY})
+        try:
+            with engine.begin() as conn:
+                _ensure_version_table(conn)
+                done = applied_versions(conn)
+
+            for migration in discover():
+                if migration.version in done or (target is not None and migration.version > target):
+                    continue
+                module = _load(migration)
+                print(f"Applying migration {migration.version:04d}_{migration.name}...")
+                if getattr(module, "TRANSACTIONAL", True):
+                    with engine.begin() as conn:
+                        module.upgrade(conn)
+                        _record(conn, migration)
+                else:
+                    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                        module.upgrade(conn)
+                        _record(conn, migration)
+                applied.append(migration)
+                print(f"✓ Applied {migration.version:04d}_{migration.name}")
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _MIGRATION_LOCK_KEY})
+    return applied
+
+
+def _record(conn, migration: Migration) -> None:
+    conn.execute(
+        text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name) ON CONFLICT (version) DO NOTHING"),
+        {"version": migration.version, "name": migration.name},
+    )
+
+
+def missing_indexes(engine) -> List[str]:
+    """Names from REQUIRED_INDEXES that are absent or INVALID in the connected database."""
+    with engine.connect() as conn:
+        valid = {
+            row[0]
+            for row in conn.execute(text("""
+                SELECT c.relname
+                FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE i.indisvalid
+            """))
+        }
+    return [name for _, name in REQUIRED_INDEXES if name not in valid]
+
+
+def report_status(engine) -> None:
+    """Startup check: print pending migrations and missing hot-path indexes without failing startup."""
+    try:
+        waiting = pending(engine)
+        missing = missing_indexes(engine)
+    except Exception as e:
+        print(f"⚠ Could not check schema status: {e}")
+        return
+    if waiting:
+        names = ", ".join(f"{m.version:04d}_{m.name}" for m in waiting)
+        print(f"⚠ {len(waiting)} pending migration(s): {names}. Run `python -m migrations upgrade`.")
+    if missing:
+        print(f"⚠ Missing indexes: {', '.join(missing)}. Run `python -m migrations upgrade`.")
+    if not waiting and not missing:
+        print("✓ Schema is up to date")
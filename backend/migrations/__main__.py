@@ -0,0 +1,38 @@
+"""
+Usage:
+    python -m migrations upgrade [--target N]
+    python -m migrations status
+"""
+import argparse
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import engine
+from migrations import discover, pending, missing_indexes, upgrade
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m migrations")
+    sub = parser.add_subparsers(dest="command", required=True)
+    up = sub.add_parser("upgrade", help="Apply pending migrations")
+    up.add_argument("--target", type=int, default=None, help="Stop after this version")
+    sub.add_parser("status", help="List migrations and missing indexes")
+    args = parser.parse_args()
+
+    if args.command == "upgrade":
+        applied = upgrade(target=args.target)
+        print(f"\n{len(applied)} migration(s) applied.")
+        return
+
+    waiting = {m.version for m in pending(engine)}
+    for m in discover():
+        state = "pending" if m.version in waiting else "applied"
+        print(f"{m.version:04d}_{m.name:40} {state}")
+    missing = missing_indexes(engine)
+    print(f"\nMissing indexes: {', '.join(missing) if missing else 'none'}")
+
+
+if __name__ == "__main__":
+    main()
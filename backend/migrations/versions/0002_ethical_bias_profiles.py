@@ -0,0 +1,59 @@
+"""
+Create ethical_bias_profiles and drop quiz_attempts.ethical_bias_summary.
+Ported from migrate_ethical_bias_profile.py.
+"""
+from sqlalchemy import text
+
+def upgrade(conn):
+    # 1. Create ethical_bias_profiles table if it doesn't exist
+    check_table = text("""
+        SELECT EXISTS (
+            SELECT FROM information_schema.tables 
+            WHERE table_name = 'ethical_bias_profiles'
+        )
+    """)
+    table_exists = conn.execute(check_table).scalar()
+    
+    if not table_exists:
+        print("Creating ethical_bias_profiles table...")
+        conn.execute(text("""
+            CREATE TABLE ethical_bias_profiles (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER NOT NULL UNIQUE REFERENCES users(id) ON DELETE CASCADE,
+                primary_framework VARCHAR,
+                secondary_frameworks JSONB DEFAULT '[]'::jsonb,
+                reasoning_patterns JSONB DEFAULT '{}'::jsonb,
+                summary TEXT,
+                recommendations JSONB DEFAULT '[]'::jsonb,
+                last_updated TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                last_justification_id INTEGER
+            )
+        """))
+        # Create index on user_id
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS idx_ethical_bias_profiles_user_id 
+            ON ethical_bias_profiles(user_id)
+        """))
+        print("✓ Created ethical_bias_profiles table")
+    else:
+        print("✓ ethical_bias_profiles table already exists")
+    
+    # 2. Remove ethical_bias_summary column from quiz_attempts if it exists
+    check_column = text("""
+        SELECT column_name 
+        FROM information_schema.columns 
+        WHERE table_name = 'quiz_attempts' 
+        AND column_name = 'ethical_bias_summary'
+    """)
+    result = conn.execute(check_column)
+    column_exists = result.fetchone() is not None
+    
+    if column_exists:
+        print("Removing ethical_bias_summary column from quiz_attempts...")
+        conn.execute(text("""
+            ALTER TABLE quiz_attempts 
+            DROP COLUMN IF EXISTS ethical_bias_summary
+        """))
+        print("✓ Removed ethical_bias_summary column")
+    else:
+        print("✓ ethical_bias_summary column does not exist (already removed)")
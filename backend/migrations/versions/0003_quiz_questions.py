@@ -0,0 +1,69 @@
+"""
+Create quiz_questions and backfill it from quizzes.questions.
+Ported from migrate_quiz_questions.py.
+"""
+from sqlalchemy import text
+
+def upgrade(conn):
+    # 1. Create quiz_questions table if it doesn't exist
+    check_table = text("""
+        SELECT EXISTS (
+            SELECT FROM information_schema.tables
+            WHERE table_name = 'quiz_questions'
+        )
+    """)
+    table_exists = conn.execute(check_table).scalar()
+
+    if not table_exists:
+        print("Creating quiz_questions table...")
+        conn.execute(text("""
+            CREATE TABLE quiz_questions (
+                id SERIAL PRIMARY KEY,
+                quiz_id INTEGER NOT NULL REFERENCES quizzes(id) ON DELETE CASCADE,
+                question_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                question_text TEXT,
+                options JSONB DEFAULT '[]'::jsonb,
+                correct_answer VARCHAR,
+                artifacts JSONB DEFAULT '{}'::jsonb,
+                CONSTRAINT uq_quiz_questions_quiz_id_question_id UNIQUE (quiz_id, question_id)
+            )
+        """))
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS ix_quiz_questions_quiz_id
+            ON quiz_questions(quiz_id)
+        """))
+        print("✓ Created quiz_questions table")
+    else:
+        print("✓ quiz_questions table already exists")
+
+    # 2. Backfill one row per element of quizzes.questions
+    print("Backfilling quiz_questions from quizzes.questions...")
+    result = conn.execute(text("""
+        INSERT INTO quiz_questions
+            (quiz_id, question_id, position, question_text, options, correct_answer, artifacts)
+        SELECT
+            q.id,
+            (elem->>'id')::int,
+            (t.ord - 1)::int,
+            elem->>'question_text',
+            COALESCE(elem->'options', '[]'::jsonb),
+            elem->>'correct_answer',
+            jsonb_build_object(
+                'correct_index', (
+                    SELECT (o.ord - 1)::int
+                    FROM jsonb_array_elements_text(COALESCE(elem->'options', '[]'::jsonb))
+                        WITH ORDINALITY AS o(val, ord)
+                    WHERE o.val = elem->>'correct_answer'
+                    ORDER BY o.ord
+                    LIMIT 1
+                ),
+                'option_count', jsonb_array_length(COALESCE(elem->'options', '[]'::jsonb))
+            )
+        FROM quizzes q
+        CROSS JOIN LATERAL jsonb_array_elements(q.questions) WITH ORDINALITY AS t(elem, ord)
+        WHERE jsonb_typeof(q.questions) = 'array'
+          AND elem->>'id' ~ '^[0-9]+$'
+        ON CONFLICT (quiz_id, question_id) DO NOTHING
+    """))
+    print(f"✓ Backfilled {result.rowcount} question rows")
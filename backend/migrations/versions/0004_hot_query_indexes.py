@@ -0,0 +1,17 @@
+"""
+Composite indexes for the history, analytics, bias-profile and quiz listing queries.
+Built with CREATE INDEX CONCURRENTLY so writes are not blocked on live tables.
+"""
+from migrations import create_index_concurrently
+
+TRANSACTIONAL = False
+
+def upgrade(conn):
+    # History pages and analytics: WHERE user_id = ? ORDER BY timestamp, id
+    create_index_concurrently(conn, "ix_quiz_attempts_user_id_timestamp", "quiz_attempts", "(user_id, timestamp, id)")
+    # Per-question stats join attempts on quiz_id
+    create_index_concurrently(conn, "ix_quiz_attempts_quiz_id", "quiz_attempts", "(quiz_id)")
+    # Bias profiling joins justifications to attempts
+    create_index_concurrently(conn, "ix_user_justifications_attempt_id", "user_justifications", "(attempt_id)")
+    # Quiz listing keyset: ORDER BY created_at, id
+    create_index_concurrently(conn, "ix_quizzes_created_at_id", "quizzes", "(created_at, id)")
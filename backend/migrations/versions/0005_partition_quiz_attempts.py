@@ -0,0 +1,94 @@
+"""
+Convert quiz_attempts into a table range-partitioned by month on timestamp,
+and create quiz_attempt_rollups for compacted months.
+
+The rows are copied in one transaction, which locks quiz_attempts for the
+duration; run this during a maintenance window on large databases.
+"""
+from sqlalchemy import text
+
+from quizzes.partitions import ensure_partitions, is_partitioned
+
+def upgrade(conn):
+    # 1. Rollup table for compacted partitions
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS quiz_attempt_rollups (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id),
+            category VARCHAR NOT NULL,
+            week_start TIMESTAMP WITH TIME ZONE NOT NULL,
+            attempts INTEGER NOT NULL,
+            score_sum INTEGER NOT NULL,
+            total_sum INTEGER NOT NULL,
+            accuracy_sum DOUBLE PRECISION NOT NULL,
+            accuracy_sq_sum DOUBLE PRECISION NOT NULL,
+            accuracy_min DOUBLE PRECISION NOT NULL,
+            accuracy_max DOUBLE PRECISION NOT NULL,
+            accuracy_histogram JSONB DEFAULT '{}'::jsonb,
+            first_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            last_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            CONSTRAINT uq_quiz_attempt_rollups_user_category_week UNIQUE (user_id, category, week_start)
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_quiz_attempt_rollups_id ON quiz_attempt_rollups(id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_quiz_attempt_rollups_user_id ON quiz_attempt_rollups(user_id)"))
+
+    if is_partitioned(conn):
+        print("✓ quiz_attempts is already partitioned")
+        ensure_partitions(conn)
+        return
+
+    # 2. user_justifications can no longer reference quiz_attempts(id) alone;
+    #    partitions.compact_partition deletes them itself when it drops a month
+    fk_names = conn.execute(text("""
+        SELECT con.conname
+        FROM pg_constraint con
+        JOIN pg_class rel ON rel.oid = con.conrelid
+        JOIN pg_class ref ON ref.oid = con.confrelid
+        WHERE con.contype = 'f' AND rel.relname = 'user_justifications' AND ref.relname = 'quiz_attempts'
+    """)).scalars().all()
+    for fk_name in fk_names:
+        conn.execute(text(f'ALTER TABLE user_justifications DROP CONSTRAINT "{fk_name}"'))
+
+    # 3. Keep the id sequence alive when the old table is dropped
+    conn.execute(text("ALTER SEQUENCE quiz_attempts_id_seq OWNED BY NONE"))
+
+    oldest = conn.execute(text("SELECT min(timestamp) FROM quiz_attempts")).scalar()
+
+    # Swap names first so partitions are created against the final table name
+    print("Creating partitioned quiz_attempts...")
+    conn.execute(text("ALTER TABLE quiz_attempts RENAME TO quiz_attempts_legacy"))
+    for index_name in conn.execute(text("""
+        SELECT indexname FROM pg_indexes WHERE tablename = 'quiz_attempts_legacy'
+    """)).scalars().all():
+        conn.execute(text(f'ALTER INDEX "{index_name}" RENAME TO "{index_name}_legacy"'))
+
+    conn.execute(text("""
+        CREATE TABLE quiz_attempts (
+            id INTEGER NOT NULL DEFAULT nextval('quiz_attempts_id_seq'),
+            user_id INTEGER REFERENCES users(id),
+            quiz_id INTEGER REFERENCES quizzes(id),
+            score INTEGER,
+            total INTEGER,
+            accuracy DOUBLE PRECISION,
+            timestamp TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            answer_details JSONB,
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+    """))
+    ensure_partitions(conn, start=oldest)
+
+    print("Copying attempts into partitions...")
+    result = conn.execute(text("""
+        INSERT INTO quiz_attempts (id, user_id, quiz_id, score, total, accuracy, timestamp, answer_details)
+        SELECT id, user_id, quiz_id, score, total, accuracy, COALESCE(timestamp, now()), answer_details
+        FROM quiz_attempts_legacy
+    """))
+    print(f"✓ Copied {result.rowcount} attempts")
+
+    conn.execute(text("DROP TABLE quiz_attempts_legacy"))
+    conn.execute(text("ALTER SEQUENCE quiz_attempts_id_seq OWNED BY quiz_attempts.id"))
+    conn.execute(text("CREATE INDEX ix_quiz_attempts_id ON quiz_attempts (id)"))
+    conn.execute(text("CREATE INDEX ix_quiz_attempts_user_id_timestamp ON quiz_attempts (user_id, timestamp, id)"))
+    conn.execute(text("CREATE INDEX ix_quiz_attempts_quiz_id ON quiz_attempts (quiz_id)"))
+    print("✓ quiz_attempts is now partitioned by month")
@@ -0,0 +1,19 @@
+"""
+Create documents, which stores each distinct uploaded file's page texts once,
+keyed by the sha256 of its bytes.
+"""
+from sqlalchemy import text
+
+def upgrade(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS documents (
+            content_hash VARCHAR(64) PRIMARY KEY,
+            source_name VARCHAR,
+            page_count INTEGER NOT NULL,
+            pages JSONB NOT NULL,
+            chunk_count INTEGER,
+            indexed_at TIMESTAMP WITH TIME ZONE,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+        )
+    """))
+    print("✓ documents table is present")
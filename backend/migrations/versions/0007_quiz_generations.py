@@ -0,0 +1,24 @@
+"""
+Create quiz_generations, the cache of parsed quizzes per
+(content hash, level, question count, prompt version).
+"""
+from sqlalchemy import text
+
+def upgrade(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS quiz_generations (
+            id SERIAL PRIMARY KEY,
+            content_hash VARCHAR(64) NOT NULL,
+            level VARCHAR NOT NULL,
+            num_questions INTEGER NOT NULL,
+            prompt_version VARCHAR NOT NULL,
+            quiz JSONB NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            CONSTRAINT uq_quiz_generations_content_level_questions_prompt
+                UNIQUE (content_hash, level, num_questions, prompt_version)
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_quiz_generations_expires_at ON quiz_generations (expires_at)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_quiz_generations_id ON quiz_generations (id)"))
+    print("✓ quiz_generations table is present")
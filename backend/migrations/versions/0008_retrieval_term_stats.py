@@ -0,0 +1,17 @@
+"""
+Create retrieval_term_stats for the hashed embeddings, and mark every document
+as not indexed: their chunks were embedded with the old fitted TF-IDF
+vocabulary in a collection the hashed embeddings no longer read, so each is
+re-indexed on its next upload.
+"""
+from sqlalchemy import text
+
+def upgrade(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS retrieval_term_stats (
+            feature INTEGER PRIMARY KEY,
+            doc_freq INTEGER NOT NULL DEFAULT 0
+        )
+    """))
+    reset = conn.execute(text("UPDATE documents SET indexed_at = NULL, chunk_count = NULL WHERE indexed_at IS NOT NULL"))
+    print(f"✓ retrieval_term_stats table is present; {reset.rowcount} document(s) will be re-indexed")
@@ -0,0 +1,25 @@
+"""
+Create ingestion_jobs, the queue the background indexing worker claims from.
+"""
+from sqlalchemy import text
+
+def upgrade(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS ingestion_jobs (
+            id SERIAL PRIMARY KEY,
+            content_hash VARCHAR(64) NOT NULL UNIQUE,
+            source_name VARCHAR,
+            status VARCHAR NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            chunks_done INTEGER NOT NULL DEFAULT 0,
+            chunks_total INTEGER,
+            last_error TEXT,
+            run_after TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            heartbeat_at TIMESTAMP WITH TIME ZONE,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            finished_at TIMESTAMP WITH TIME ZONE
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_ingestion_jobs_status_run_after ON ingestion_jobs (status, run_after)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_ingestion_jobs_id ON ingestion_jobs (id)"))
+    print("✓ ingestion_jobs table is present")
@@ -0,0 +1,9 @@
+"""
+Add users.role. Everyone starts as a student; teachers and admins
+(auth.models.PRIVILEGED_ROLES) are set by hand.
+"""
+from sqlalchemy import text
+
+def upgrade(conn):
+    conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS role VARCHAR NOT NULL DEFAULT 'student'"))
+    print("✓ users.role is present")
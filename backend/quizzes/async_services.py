@@ -0,0 +1,48 @@
+"""
+AsyncSession versions of the read queries in quizzes.services.
+Statements are shared with the sync module so both paths return the same rows.
+"""
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Any, Optional, Tuple
+
+from quizzes import models
+from quizzes.services import quizzes_page_statement, attempts_page_statement, split_page
+
+async def get_quiz(db: AsyncSession, quiz_id: int) -> Optional[models.Quiz]:
+    result = await db.execute(select(models.Quiz).where(models.Quiz.id == quiz_id))
+    return result.scalars().first()
+
+async def get_quizzes_page(
+    db: AsyncSession,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    include_details: bool = False
+) -> Tuple[List[Any], Optional[str]]:
+    result = await db.execute(quizzes_page_statement(limit, cursor, include_details))
+    return split_page(result.all(), limit, "created_at")
+
+async def get_quiz_questions(db: AsyncSession, quiz_id: int) -> List[models.QuizQuestion]:
+    result = await db.execute(
+        select(models.QuizQuestion)
+        .where(models.QuizQuestion.quiz_id == quiz_id)
+        .order_by(models.QuizQuestion.position.asc())
+    )
+    return list(result.scalars().all())
+
+async def get_user_quiz_attempts_page(
+    db: AsyncSession,
+    user_id: int,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    include_details: bool = False
+) -> Tuple[List[Any], Optional[str]]:
+    result = await db.execute(attempts_page_statement(user_id, limit, cursor, include_details))
+    return split_page(result.all(), limit, "timestamp")
+
+async def get_attempt_by_id(db: AsyncSession, attempt_id: int, user_id: int = None) -> Optional[models.QuizAttempt]:
+    statement = select(models.QuizAttempt).where(models.QuizAttempt.id == attempt_id)
+    if user_id:
+        statement = statement.where(models.QuizAttempt.user_id == user_id)
+    result = await db.execute(statement)
+    return result.scalars().first()
@@ -0,0 +1,173 @@
+"""
+Precompiled answer keys for grading submissions.
+
+Quizzes are immutable once created, so the answer key of a quiz is built once
+from its question rows and kept in a small in-process LRU cache. Grading a
+submission is then a single pass over the key with no database access, and
+grade_batch scores many submissions at once as one array comparison.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from quizzes import models
+
+GRADING_PLAN_CACHE_SIZE = int(os.getenv("GRADING_PLAN_CACHE_SIZE", "1024"))
+
+
+class GradingPlan(NamedTuple):
+    quiz_id: int
+    # (question_id as the string key used in submissions, correct_answer) in quiz order
+    answer_key: Tuple[Tuple[str, Optional[str]], ...]
+
+    @property
+    def total(self) -> int:
+        return len(self.answer_key)
+
+
+class GradedSubmission(NamedTuple):
+    score: int
+    total: int
+    accuracy: float
+    answer_details: Dict[str, Dict[str, Any]]
+    # Rows for user_justifications, without attempt_id
+    justification_rows: List[Dict[str, Any]]
+
+
+_plans: "OrderedDict[int, GradingPlan]" = OrderedDict()
+_plans_lock = threading.Lock()
+
+
+def _load_plan(db: Session, quiz_id: int) -> Optional[GradingPlan]:
+    rows = (
+        db.query(models.QuizQuestion.question_id, models.QuizQuestion.correct_answer)
+        .filter(models.QuizQuestion.quiz_id == quiz_id)
+        .order_by(models.QuizQuestion.position.asc())
+        .all()
+    )
+    if rows:
+        return GradingPlan(quiz_id, tuple((str(r.question_id), r.correct_answer) for r in rows))
+
+    # Quizzes without question rows (not yet backfilled, or empty) fall back to the JSONB payload
+    quiz = db.query(models.Quiz.questions).filter(models.Quiz.id == quiz_id).first()
+    if quiz is None:
+        return None
+    return GradingPlan(
+        quiz_id, tuple((str(q.get("id")), q.get("correct_answer")) for q in (quiz.questions or []))
+    )
+
+
+def get_grading_plan(db: Session, quiz_id: int) -> Optional[GradingPlan]:
+    """Return the cached answer key for quiz_id, loading it on a miss. None if the quiz does not exist."""
+    with _plans_lock:
+        plan = _plans.get(quiz_id)
+        if plan is not None:
+            _plans.move_to_end(quiz_id)
+            return plan
+
+    plan = _load_plan(db, quiz_id)
+    if plan is None:
+        return None
+
+    with _plans_lock:
+        _plans[quiz_id] = plan
+        _plans.move_to_end(quiz_id)
+        while len(_plans) > GRADING_PLAN_CACHE_SIZE:
+            _plans.popitem(last=False)
+    return plan
+
+
+def invalidate_grading_plan(quiz_id: int) -> None:
+    with _plans_lock:
+        _plans.pop(quiz_id, None)
+
+
+def grade_submission(
+    plan: GradingPlan,
+    answers: Optional[Dict[str, str]] = None,
+    justifications: Optional[Dict[str, str]] = None
+) -> GradedSubmission:
+    """Grade answers against the plan in one pass, building answer_details and justification rows together."""
+    answers = answers or {}
+    justifications = justifications or {}
+
+    answer_details: Dict[str, Dict[str, Any]] = {}
+    justification_rows: List[Dict[str, Any]] = []
+    score = 0
+
+    for question_id, correct_answer in plan.answer_key:
+        user_answer = answers.get(question_id, "")
+        justification = justifications.get(question_id, "")
+        is_correct = (user_answer == correct_answer)
+        if is_correct:
+            score += 1
+
+        answer_details[question_id] = {
+            "answer": user_answer,
+            "justification": justification,
+            "is_correct": is_correct,
+            "correct_answer": correct_answer
+        }
+
+        if justification:
+            justification_rows.append({
+                "question_id": int(question_id),
+                "justification_text": justification,
+                "user_answer": user_answer,
+                "is_correct": 1 if is_correct else 0
+            })
+
+    total = plan.total
+    accuracy = (score / total) * 100 if total > 0 else 0
+    return GradedSubmission(score, total, accuracy, answer_details, justification_rows)
+
+
+def grade_batch(
+    plan: GradingPlan,
+    answers: List[Dict[str, str]],
+    justifications: List[Dict[str, str]]
+) -> List[GradedSubmission]:
+    """
+    Grade many submissions against one plan. Correctness and scores come from
+    comparing a (submissions x questions) answer matrix with the key in one
+    numpy operation. Results match grade_submission for each submission.
+    """
+    question_ids = [question_id for question_id, _ in plan.answer_key]
+    key = np.array([correct for _, correct in plan.answer_key], dtype=object)
+    matrix = np.empty((len(answers), len(question_ids)), dtype=object)
+    for row, submitted in enumerate(answers):
+        matrix[row, :] = [submitted.get(question_id, "") for question_id in question_ids]
+
+    correct = (matrix == key) if len(question_ids) else np.zeros(matrix.shape, dtype=bool)
+    scores = correct.sum(axis=1)
+    total = plan.total
+
+    results = []
+    for row, notes in enumerate(justifications):
+        answer_details: Dict[str, Dict[str, Any]] = {}
+        justification_rows: List[Dict[str, Any]] = []
+        for col, (question_id, correct_answer) in enumerate(plan.answer_key):
+            user_answer = matrix[row, col]
+            is_correct = bool(correct[row, col])
+            justification = notes.get(question_id, "")
+            answer_details[question_id] = {
+                "answer": user_answer,
+                "justification": justification,
+                "is_correct": is_correct,
+                "correct_answer": correct_answer
+            }
+            if justification:
+                justification_rows.append({
+                    "question_id": int(question_id),
+                    "justification_text": justification,
+                    "user_answer": user_answer,
+                    "is_correct": 1 if is_correct else 0
+                })
+        score = int(scores[row])
+        accuracy = (score / total) * 100 if total > 0 else 0
+        results.append(GradedSubmission(score, total, accuracy, answer_details, justification_rows))
+    return results
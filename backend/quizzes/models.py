@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Float, Text
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Float, Text, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from sqlalchemy.dialects.postgresql import JSONB
@@ -7,6 +7,9 @@ from database import Base
 
 class Quiz(Base):
     __tablename__ = "quizzes"
+    __table_args__ = (
+        Index("ix_quizzes_created_at_id", "created_at", "id"),  # Keyset listing
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)
@@ -15,36 +18,83 @@ class Quiz(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     attempts = relationship("QuizAttempt", back_populates="quiz")
+    question_rows = relationship(
+        "QuizQuestion", back_populates="quiz", order_by="QuizQuestion.position", cascade="all, delete-orphan"
+    )
+
+class QuizQuestion(Base):
+    """One row per question, so single questions can be fetched and joined without unpacking quizzes.questions."""
+    __tablename__ = "quiz_questions"
+    __table_args__ = (
+        UniqueConstraint("quiz_id", "question_id", name="uq_quiz_questions_quiz_id_question_id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    quiz_id = Column(Integer, ForeignKey("quizzes.id", ondelete="CASCADE"), nullable=False, index=True)
+    question_id = Column(Integer, nullable=False)  # The "id" inside the quiz payload
+    position = Column(Integer, nullable=False)
+    question_text = Column(Text)
+    options = Column(JSONB, default=[])
+    correct_answer = Column(String)
+    # Precomputed per-question data: {correct_index, option_count, conflict_explanation}
+    artifacts = Column(JSONB, default={})
+
+    quiz = relationship("Quiz", back_populates="question_rows")
 
 class QuizAttempt(Base):
+    """
+    Range-partitioned by month on timestamp (see quizzes/partitions.py), so the
+    partition key is part of the primary key. id alone is still unique and is
+    what the ORM uses as identity.
+    """
     __tablename__ = "quiz_attempts"
+    __table_args__ = (
+        Index("ix_quiz_attempts_user_id_timestamp", "user_id", "timestamp", "id"),  # History and analytics
+        Index("ix_quiz_attempts_quiz_id", "quiz_id"),  # Per-question stats
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     quiz_id = Column(Integer, ForeignKey("quizzes.id"))
     score = Column(Integer)
     total = Column(Integer)
     accuracy = Column(Float)
-    timestamp = Column(DateTime(timezone=True), server_default=func.now())
+    timestamp = Column(DateTime(timezone=True), primary_key=True, nullable=False, server_default=func.now())
     # Store detailed answer breakdown: {question_id: {answer, justification, is_correct}}
     answer_details = Column(JSONB, default={})
 
+    __mapper_args__ = {"primary_key": [id]}
+
     owner = relationship("User", back_populates="attempts")
     quiz = relationship("Quiz", back_populates="attempts")
-    justifications = relationship("UserJustification", back_populates="attempt", cascade="all, delete-orphan")
+    justifications = relationship(
+        "UserJustification",
+        primaryjoin="QuizAttempt.id == foreign(UserJustification.attempt_id)",
+        back_populates="attempt",
+        cascade="all, delete-orphan",
+    )
 
 class UserJustification(Base):
     __tablename__ = "user_justifications"
+    __table_args__ = (
+        Index("ix_user_justifications_attempt_id", "attempt_id"),  # Bias profiling join
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    attempt_id = Column(Integer, ForeignKey("quiz_attempts.id"))
+    # No FOREIGN KEY: quiz_attempts is partitioned and its id is only unique together with timestamp
+    attempt_id = Column(Integer)
     question_id = Column(Integer)
     justification_text = Column(Text)
     user_answer = Column(String)
     is_correct = Column(Integer, default=0)  # 0 = wrong, 1 = correct
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
 
-    attempt = relationship("QuizAttempt", back_populates="justifications")
+    attempt = relationship(
+        "QuizAttempt",
+        primaryjoin="foreign(UserJustification.attempt_id) == QuizAttempt.id",
+        back_populates="justifications",
+    )
 
 
 class EthicalBiasProfile(Base):
@@ -60,4 +110,28 @@ class EthicalBiasProfile(Base):
     last_updated = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     last_justification_id = Column(Integer, nullable=True)  # Track last justification used for computation
 
-    owner = relationship("User", back_populates="ethical_bias_profile")
\ No newline at end of file
+    owner = relationship("User", back_populates="ethical_bias_profile")
+
+
+class QuizAttemptRollup(Base):
+    """Per-user, per-category, per-week aggregates of attempts from compacted (dropped) partitions."""
+    __tablename__ = "quiz_attempt_rollups"
+    __table_args__ = (
+        UniqueConstraint("user_id", "category", "week_start", name="uq_quiz_attempt_rollups_user_category_week"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    category = Column(String, nullable=False)
+    week_start = Column(DateTime(timezone=True), nullable=False)
+    attempts = Column(Integer, nullable=False)
+    score_sum = Column(Integer, nullable=False)
+    total_sum = Column(Integer, nullable=False)
+    accuracy_sum = Column(Float, nullable=False)
+    accuracy_sq_sum = Column(Float, nullable=False)  # For the exact standard deviation
+    accuracy_min = Column(Float, nullable=False)
+    accuracy_max = Column(Float, nullable=False)
+    # Attempt counts per score-distribution range: {"0-20": n, "21-40": n, ...}
+    accuracy_histogram = Column(JSONB, default={})
+    first_attempt_at = Column(DateTime(timezone=True), nullable=False)
+    last_attempt_at = Column(DateTime(timezone=True), nullable=False)
@@ -0,0 +1,28 @@
+"""
+Opaque keyset cursors for paginated listings.
+
+A cursor encodes the sort key of the last row of a page, e.g. (created_at, id)
+for quizzes or (timestamp, id) for attempts. The id breaks ties between rows
+sharing a timestamp, so pages stay stable while new rows are inserted.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Tuple
+
+
+def encode_cursor(ts: datetime, row_id: int) -> str:
+    payload = json.dumps({"ts": ts.isoformat(), "id": row_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    """Decode a cursor produced by encode_cursor. Raises ValueError if malformed."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(payload["ts"]), int(payload["id"])
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
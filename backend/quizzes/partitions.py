@@ -0,0 +1,243 @@
+"""
+Monthly range partitions for quiz_attempts and compaction of old months into rollups.
+
+Partitions are named quiz_attempts_pYYYYMM and cover [month start, next month
+start). A DEFAULT partition catches rows outside the prepared months; creating
+a month moves any such rows out of it first, so it never blocks a new partition.
+
+Partitions older than ATTEMPT_RETENTION_MONTHS are aggregated into
+quiz_attempt_rollups (per user, category and week) and then detached, which
+keeps per-user queries over raw rows bounded. A detached month is kept as
+the plain table quiz_attempts_archive_pYYYYMM unless ATTEMPT_DROP_COMPACTED
+is set, in which case it is dropped along with its user_justifications rows.
+
+Run periodically (e.g. a daily cron):
+    python -m quizzes.partitions maintain
+"""
+import os
+import re
+import sys
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+ATTEMPT_RETENTION_MONTHS = int(os.getenv("ATTEMPT_RETENTION_MONTHS", "12"))
+ATTEMPT_DROP_COMPACTED = os.getenv("ATTEMPT_DROP_COMPACTED", "false").lower() == "true"
+
+PARENT_TABLE = "quiz_attempts"
+DEFAULT_PARTITION = "quiz_attempts_default"
+_PARTITION_NAME = re.compile(r"^quiz_attempts_p(\d{4})(\d{2})$")
+
+# Arbitrary key for pg_advisory_xact_lock so workers starting together never create the same month twice
+_PARTITION_LOCK_KEY = 4242032
+
+# Score-distribution ranges, matching analytics_service: (label, lower exclusive, upper inclusive)
+SCORE_RANGES = [("0-20", None, 20), ("21-40", 20, 40), ("41-60", 40, 60), ("61-80", 60, 80), ("81-100", 80, None)]
+
+
+def month_start(dt: datetime) -> datetime:
+    return datetime(dt.year, dt.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(dt: datetime, months: int) -> datetime:
+    index = dt.year * 12 + (dt.month - 1) + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(start: datetime) -> str:
+    return f"{PARENT_TABLE}_p{start.year:04d}{start.month:02d}"
+
+
+def is_partitioned(conn) -> bool:
+    return bool(conn.execute(text("""
+        SELECT EXISTS (
+            SELECT FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid
+            WHERE c.relname = :name
+        )
+    """), {"name": PARENT_TABLE}).scalar())
+
+
+def list_partitions(conn) -> List[Tuple[str, datetime, datetime]]:
+    """Monthly partitions as (name, lower bound, upper bound), oldest first. The DEFAULT partition is not included."""
+    names = conn.execute(text("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = :name
+    """), {"name": PARENT_TABLE}).scalars().all()
+    partitions = []
+    for name in names:
+        match = _PARTITION_NAME.match(name)
+        if match:
+            start = datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc)
+            partitions.append((name, start, add_months(start, 1)))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def create_month_partition(conn, start: datetime) -> bool:
+    """Create the partition for the month starting at start. Returns False if it already exists."""
+    name = partition_name(start)
+    if conn.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name}).scalar():
+        return False
+    end = add_months(start, 1)
+    bounds = {"lower": start, "upper": end}
+    conn.execute(text(f"CREATE TABLE {name} (LIKE {PARENT_TABLE} INCLUDING DEFAULTS)"))
+    # Rows that landed in DEFAULT for this month would make ATTACH fail; move them first
+    if conn.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": DEFAULT_PARTITION}).scalar():
+        conn.execute(text(f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT_PARTITION}
+                WHERE timestamp >= :lower AND timestamp < :upper
+                RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+        """), bounds)
+    conn.execute(text(
+        f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    ))
+    print(f"✓ Created partition {name}")
+    return True
+
+
+def ensure_partitions(conn, start: Optional[datetime] = None, months_ahead: int = PARTITION_MONTHS_AHEAD) -> None:
+    """Create the DEFAULT partition and every month from start (default: this month) to months_ahead from now."""
+    if not is_partitioned(conn):
+        return
+    # Held until the caller's transaction ends, so the existence checks below see other workers' partitions
+    conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _PARTITION_LOCK_KEY})
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {PARENT_TABLE} DEFAULT"))
+    now = month_start(datetime.now(timezone.utc))
+    month = month_start(start) if start else now
+    last = add_months(now, months_ahead)
+    while month <= last:
+        create_month_partition(conn, month)
+        month = add_months(month, 1)
+
+
+def _histogram_sql(alias: str) -> str:
+    parts = []
+    for label, lower, upper in SCORE_RANGES:
+        conditions = []
+        if lower is not None:
+            conditions.append(f"{alias}.accuracy > {lower}")
+        if upper is not None:
+            conditions.append(f"{alias}.accuracy <= {upper}")
+        parts.append(f"'{label}', count(*) FILTER (WHERE {' AND '.join(conditions)})")
+    return f"jsonb_build_object({', '.join(parts)})"
+
+
+def _histogram_merge_sql() -> str:
+    parts = [
+        f"'{label}', COALESCE((r.accuracy_histogram->>'{label}')::int, 0) "
+        f"+ COALESCE((EXCLUDED.accuracy_histogram->>'{label}')::int, 0)"
+        for label, _, _ in SCORE_RANGES
+    ]
+    return f"jsonb_build_object({', '.join(parts)})"
+
+
+def archive_name(name: str) -> str:
+    return name.replace(f"{PARENT_TABLE}_p", f"{PARENT_TABLE}_archive_p", 1)
+
+
+def compact_partition(conn, name: str, drop: bool = ATTEMPT_DROP_COMPACTED) -> int:
+    """
+    Fold one partition into quiz_attempt_rollups, then detach it. Returns the rows compacted.
+
+    The detached table is renamed to its archive name, or with drop=True
+    dropped together with the justifications of its attempts.
+    """
+    rows = conn.execute(text(f"SELECT count(*) FROM {name}")).scalar()
+    conn.execute(text(f"""
+        INSERT INTO quiz_attempt_rollups AS r (
+            user_id, category, week_start, attempts, score_sum, total_sum,
+            accuracy_sum, accuracy_sq_sum, accuracy_min, accuracy_max,
+            accuracy_histogram, first_attempt_at, last_attempt_at
+        )
+        SELECT
+            a.user_id,
+            COALESCE(q.category, 'Uncategorized'),
+            date_trunc('week', a.timestamp),
+            count(*),
+            COALESCE(sum(a.score), 0),
+            COALESCE(sum(a.total), 0),
+            COALESCE(sum(a.accuracy), 0),
+            COALESCE(sum(a.accuracy * a.accuracy), 0),
+            COALESCE(min(a.accuracy), 0),
+            COALESCE(max(a.accuracy), 0),
+            {_histogram_sql("a")},
+            min(a.timestamp),
+            max(a.timestamp)
+        FROM {name} a
+        LEFT JOIN quizzes q ON q.id = a.quiz_id
+        WHERE a.user_id IS NOT NULL
+        GROUP BY a.user_id, COALESCE(q.category, 'Uncategorized'), date_trunc('week', a.timestamp)
+        ON CONFLICT (user_id, category, week_start) DO UPDATE SET
+            attempts = r.attempts + EXCLUDED.attempts,
+            score_sum = r.score_sum + EXCLUDED.score_sum,
+            total_sum = r.total_sum + EXCLUDED.total_sum,
+            accuracy_sum = r.accuracy_sum + EXCLUDED.accuracy_sum,
+            accuracy_sq_sum = r.accuracy_sq_sum + EXCLUDED.accuracy_sq_sum,
+            accuracy_min = LEAST(r.accuracy_min, EXCLUDED.accuracy_min),
+            accuracy_max = GREATEST(r.accuracy_max, EXCLUDED.accuracy_max),
+            accuracy_histogram = {_histogram_merge_sql()},
+            first_attempt_at = LEAST(r.first_attempt_at, EXCLUDED.first_attempt_at),
+            last_attempt_at = GREATEST(r.last_attempt_at, EXCLUDED.last_attempt_at)
+    """))
+    conn.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}"))
+    if drop:
+        # No foreign key covers these since the table was partitioned (migration 0005)
+        conn.execute(text(f"DELETE FROM user_justifications j USING {name} a WHERE j.attempt_id = a.id"))
+        conn.execute(text(f"DROP TABLE {name}"))
+        print(f"✓ Compacted {rows} attempts from {name} into rollups and dropped it")
+    elif conn.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": archive_name(name)}).scalar():
+        # The month was recreated and compacted again; add to the earlier archive
+        conn.execute(text(f"INSERT INTO {archive_name(name)} SELECT * FROM {name}"))
+        conn.execute(text(f"DROP TABLE {name}"))
+        print(f"✓ Compacted {rows} attempts from {name} into rollups, added to {archive_name(name)}")
+    else:
+        conn.execute(text(f"ALTER TABLE {name} RENAME TO {archive_name(name)}"))
+        print(f"✓ Compacted {rows} attempts from {name} into rollups, kept as {archive_name(name)}")
+    return rows
+
+
+def compact_old_partitions(engine, retention_months: int = ATTEMPT_RETENTION_MONTHS) -> int:
+    """Compact every monthly partition that ends before the retention window. One transaction per partition."""
+    cutoff = add_months(month_start(datetime.now(timezone.utc)), -retention_months)
+    with engine.connect() as conn:
+        if not is_partitioned(conn):
+            return 0
+        old = [name for name, _, upper in list_partitions(conn) if upper <= cutoff]
+    compacted = 0
+    for name in old:
+        with engine.begin() as conn:
+            compacted += compact_partition(conn, name)
+    return compacted
+
+
+def maintain(engine) -> None:
+    with engine.begin() as conn:
+        ensure_partitions(conn)
+    compact_old_partitions(engine)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    from database import engine
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "maintain"
+    if command == "ensure":
+        with engine.begin() as conn:
+            ensure_partitions(conn)
+    elif command == "compact":
+        compact_old_partitions(engine)
+    elif command == "maintain":
+        maintain(engine)
+    else:
+        print("Usage: python -m quizzes.partitions [maintain|ensure|compact]")
+        sys.exit(1)
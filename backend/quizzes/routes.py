@@ -1,36 +1,293 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List, Dict, Optional
-from pydantic import BaseModel
+from typing import Any, BinaryIO, Iterator, List, Dict, Optional, TextIO
+import csv
+import io
+import itertools
+import json
+import tempfile
+from pydantic import BaseModel, ValidationError
 
-from database import get_db
-from auth.dependencies import get_current_active_user
-from quizzes import services, models
+from database import get_db, SessionLocal
+from auth.dependencies import AuthenticatedUser, get_current_active_user, get_read_db, get_user, pin_reads_to_primary
+from auth.models import PRIVILEGED_ROLES
+from quizzes import services, async_services, models, grading, submission_buffer
 from schemas import (
-    Quiz, QuizCreate, QuizAttempt, UserCreate, QuizAttemptCreate,
-    PostQuizAnalysis, AnswerExplanation, EthicalConflictExplanation, EthicalBiasProfile
+    Quiz, QuizCreate, QuizSummary, QuizAttempt,
+    PostQuizAnalysis, AnswerExplanation, EthicalConflictExplanation, EthicalBiasProfile, QuestionStats
 )
-from auth import models as auth_models
 from services.explanation_service import explain_wrong_answer, explain_ethical_conflict
+from utils.ndjson import MAX_LINE_BYTES, iter_ndjson_lines
 
 router = APIRouter()
 
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def _wants_details(include: Optional[str]) -> bool:
+    return "details" in [part.strip() for part in (include or "").split(",")]
+
+def _validation_message(e: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in err['loc']) or 'row'}: {err['msg']}" for err in e.errors()
+    )
+
 class QuizSubmission(BaseModel):
     answers: Dict[str, str]  # {question_id: selected_answer}
     justifications: Dict[str, str] = {}  # {question_id: justification_text}
 
+class StudentSubmission(QuizSubmission):
+    student: str  # Email of a registered user
+
+JUSTIFICATION_COLUMN_PREFIX = "justification_"
+
+# Bounds the import response; the failed count still covers every line
+IMPORT_MAX_REPORTED_ERRORS = 1000
+
+# grade-batch bodies held in memory up to this size, then spooled to disk
+GRADE_BATCH_SPOOL_BYTES = 1024 * 1024
+GRADE_BATCH_READ_CHARS = 64 * 1024
+
+def _iter_json_list(f: TextIO, max_item_chars: int = MAX_LINE_BYTES) -> Iterator[Any]:
+    """Items of the JSON list in f, read a chunk at a time. Raises ValueError if f is not a JSON list."""
+    decoder = json.JSONDecoder()
+    buffer, eof = "", False
+
+    def fill() -> None:
+        nonlocal buffer, eof
+        chunk = f.read(GRADE_BATCH_READ_CHARS)
+        buffer += chunk
+        eof = not chunk
+
+    def next_char() -> str:
+        nonlocal buffer
+        buffer = buffer.lstrip()
+        while not buffer and not eof:
+            fill()
+            buffer = buffer.lstrip()
+        if not buffer:
+            raise ValueError("unexpected end of input")
+        return buffer[0]
+
+    if next_char() != "[":
+        raise ValueError("expected a JSON list")
+    buffer = buffer[1:]
+    if next_char() == "]":
+        buffer = buffer[1:]
+    else:
+        while True:
+            next_char()  # raw_decode does not skip leading whitespace
+            while True:
+                try:
+                    item, end = decoder.raw_decode(buffer)
+                except json.JSONDecodeError as e:
+                    if eof:
+                        raise ValueError(str(e))
+                    if len(buffer) > max_item_chars:
+                        raise ValueError(f"list item exceeds {max_item_chars} characters")
+                    fill()
+                    continue
+                if not eof and (end == len(buffer) or buffer[end] in "+-.eE0123456789"):
+                    fill()  # A number may continue in the next chunk
+                    continue
+                break
+            buffer = buffer[end:]
+            yield item
+            separator = next_char()
+            buffer = buffer[1:]
+            if separator == "]":
+                break
+            if separator != ",":
+                raise ValueError(f"expected ',' or ']' but found {separator!r}")
+    while not eof:
+        fill()
+        if buffer.strip():
+            break
+    if buffer.strip():
+        raise ValueError("unexpected data after the list")
+
+
+def _iter_grading_batch(f: BinaryIO, content_type: str) -> Iterator[Any]:
+    """
+    Parse a grade-batch body a row at a time into StudentSubmission objects, or
+    error strings for bad rows. Raises ValueError if the body as a whole is malformed.
+    CSV: a student column, one column per question id with the answer, and
+    optional justification_<question id> columns. JSON: a list of
+    {student, answers, justifications} objects.
+    """
+    f.seek(0)
+    text_file = io.TextIOWrapper(f, encoding="utf-8-sig", newline="")
+    try:
+        if "csv" in content_type:
+            for row in csv.DictReader(text_file):
+                student = (row.pop("student", None) or "").strip()
+                answers, justifications = {}, {}
+                for column_name, value in row.items():
+                    if column_name is None or value in (None, ""):
+                        continue
+                    if column_name.startswith(JUSTIFICATION_COLUMN_PREFIX):
+                        justifications[column_name[len(JUSTIFICATION_COLUMN_PREFIX):].strip()] = value
+                    else:
+                        answers[column_name.strip()] = value.strip()
+                yield (
+                    StudentSubmission(student=student, answers=answers, justifications=justifications)
+                    if student else "student: missing"
+                )
+        else:
+            for item in _iter_json_list(text_file):
+                try:
+                    yield StudentSubmission.model_validate(item)
+                except ValidationError as e:
+                    yield _validation_message(e)
+    except (csv.Error, UnicodeDecodeError) as e:
+        raise ValueError(str(e))
+    finally:
+        text_file.detach()  # Leave f open for the next pass
+
+
+def _check_grading_batch(f: BinaryIO, content_type: str, db: Session, current_user: AuthenticatedUser) -> None:
+    """
+    Read the whole batch once before grading: 400 if it is malformed, and 403
+    if a caller without a privileged role submits for anyone but themselves.
+    The role is read from the database rather than the cached user or the
+    token, so a role revoked with a plain UPDATE takes effect at once.
+    """
+    user = get_user(db, current_user.email)
+    privileged = user is not None and user.role in PRIVILEGED_ROLES
+    try:
+        for row in _iter_grading_batch(f, content_type):
+            if not privileged and isinstance(row, StudentSubmission) and row.student != current_user.email:
+                raise HTTPException(status_code=403, detail="Only teachers can grade other students' answer sheets")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid {'CSV' if 'csv' in content_type else 'JSON'}: {e}")
+
 @router.post("", response_model=Quiz)
-def create_new_quiz(quiz: QuizCreate, db: Session = Depends(get_db), current_user: UserCreate = Depends(get_current_active_user)):
-    return services.create_quiz(db=db, quiz=quiz)
+def create_new_quiz(quiz: QuizCreate, response: Response, db: Session = Depends(get_db), current_user: AuthenticatedUser = Depends(get_current_active_user)):
+    created = services.create_quiz(db=db, quiz=quiz)
+    pin_reads_to_primary(response, current_user)
+    return created
 
-@router.get("", response_model=List[Quiz])
-def read_quizzes(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: UserCreate = Depends(get_current_active_user)):
-    quizzes = services.get_quizzes(db, skip=skip, limit=limit)
+@router.post("/import")
+async def import_quizzes(
+    request: Request,
+    response: Response,
+    batch_size: int = Query(500, ge=1, le=5000),
+    db: Session = Depends(get_db),
+    current_user: AuthenticatedUser = Depends(get_current_active_user)
+):
+    """
+    Bulk import quizzes from an NDJSON / JSON Lines body, one QuizCreate per line.
+    The body is validated as it streams in and inserted in batches; only the
+    current batch is held in memory. The response has the counts and the
+    failed lines (the first IMPORT_MAX_REPORTED_ERRORS of them), not a
+    result per line.
+    """
+    counts = {"total": 0, "created": 0, "failed": 0}
+    errors: List[Dict[str, Any]] = []
+    batch: List[QuizCreate] = []
+    batch_lines: List[int] = []
+
+    def fail(line: Optional[int], error: str) -> None:
+        counts["failed"] += 1
+        if len(errors) < IMPORT_MAX_REPORTED_ERRORS:
+            errors.append({"line": line, "error": error})
+
+    async def flush():
+        try:
+            quiz_ids = await run_in_threadpool(services.bulk_create_quizzes, db, batch)
+            counts["created"] += len(quiz_ids)
+        except Exception as e:
+            await run_in_threadpool(db.rollback)
+            for line in batch_lines:
+                fail(line, f"Batch insert failed: {e}")
+        batch.clear()
+        batch_lines.clear()
+
+    try:
+        async for line_number, line in iter_ndjson_lines(request.stream()):
+            counts["total"] += 1
+            try:
+                quiz = QuizCreate.model_validate_json(line)
+            except ValidationError as e:
+                fail(line_number, _validation_message(e))
+                continue
+            batch.append(quiz)
+            batch_lines.append(line_number)
+            if len(batch) >= batch_size:
+                await flush()
+    except ValueError as e:
+        # Unframeable input: keep what was validated so far and stop reading
+        fail(None, str(e))
+    if batch:
+        await flush()
+
+    if counts["created"]:
+        pin_reads_to_primary(response, current_user)
+
+    # Invalid rows are reported immediately, failed batches when they land
+    errors.sort(key=lambda r: (r["line"] is None, r["line"] or 0))
+    return {**counts, "errors": errors, "errors_truncated": counts["failed"] > len(errors)}
+
+@router.get("", response_model=List[QuizSummary], response_model_exclude_none=True)
+async def read_quizzes(
+    response: Response,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
+    include: Optional[str] = Query(None, description="Pass 'details' to include the questions of each quiz"),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: AuthenticatedUser = Depends(get_current_active_user)
+):
+    try:
+        quizzes, next_cursor = await async_services.get_quizzes_page(
+            db, limit=limit, cursor=cursor, include_details=_wants_details(include)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     return quizzes
 
+# Registered before "/{quiz_id}" so "history" is not parsed as a quiz id
+@router.get("/history")
+async def get_user_quiz_history(
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000, description="Page size; follow X-Next-Cursor for the rest"),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
+    include: Optional[str] = Query(None, description="Pass 'details' to include answer_details of each attempt"),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: AuthenticatedUser = Depends(get_current_active_user)
+):
+    include_details = _wants_details(include)
+    try:
+        attempts, next_cursor = await async_services.get_user_quiz_attempts_page(
+            db, user_id=current_user.id, limit=limit, cursor=cursor, include_details=include_details
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    # Serialize to plain JSON-safe dicts
+    result = []
+    for attempt in attempts:
+        item = {
+            "id": attempt.id,
+            "user_id": attempt.user_id,
+            "quiz_id": attempt.quiz_id,
+            "score": attempt.score,
+            "total": attempt.total,
+            "accuracy": float(attempt.accuracy) if attempt.accuracy is not None else 0.0,
+            "timestamp": attempt.timestamp.isoformat() if attempt.timestamp else None,
+        }
+        if include_details:
+            item["answer_details"] = attempt.answer_details or {}
+        result.append(item)
+    return result
+
 @router.get("/{quiz_id}", response_model=Quiz)
-def read_quiz(quiz_id: int, db: Session = Depends(get_db), current_user: UserCreate = Depends(get_current_active_user)):
-    quiz = services.get_quiz(db, quiz_id=quiz_id)
+async def read_quiz(quiz_id: int, db: AsyncSession = Depends(get_read_db), current_user: AuthenticatedUser = Depends(get_current_active_user)):
+    quiz = await async_services.get_quiz(db, quiz_id=quiz_id)
     if quiz is None:
         raise HTTPException(status_code=404, detail="Quiz not found")
     return quiz
@@ -39,93 +296,206 @@ def read_quiz(quiz_id: int, db: Session = Depends(get_db), current_user: UserCre
 def submit_quiz_answers(
     quiz_id: int,
     submission: QuizSubmission,
+    response: Response,
     db: Session = Depends(get_db),
-    current_user: auth_models.User = Depends(get_current_active_user)
+    current_user: AuthenticatedUser = Depends(get_current_active_user)
 ):
-    quiz = services.get_quiz(db, quiz_id=quiz_id)
-    if quiz is None:
+    plan = grading.get_grading_plan(db, quiz_id=quiz_id)
+    if plan is None:
         raise HTTPException(status_code=404, detail="Quiz not found")
 
-    quiz_attempt = QuizAttemptCreate(
-        quiz_id=quiz_id,
-        score=0,  # Will be calculated in record_quiz_attempt
-        total=len(quiz.questions),
-        accuracy=0.0
-    )
+    if submission_buffer.enabled():
+        # Acknowledged once journaled; written to Postgres by the next batch flush
+        attempt = submission_buffer.get_buffer().submit(
+            user_id=current_user.id,
+            plan=plan,
+            answers=submission.answers,
+            justifications=submission.justifications
+        )
+    else:
+        attempt = services.record_quiz_attempt(
+            db=db,
+            user_id=current_user.id,
+            plan=plan,
+            answers=submission.answers,
+            justifications=submission.justifications
+        )
+    pin_reads_to_primary(response, current_user)
+    return attempt
 
-    db_quiz_attempt = services.record_quiz_attempt(
-        db=db,
-        user_id=current_user.id,
-        attempt=quiz_attempt,
-        quiz=quiz,
-        answers=submission.answers,
-        justifications=submission.justifications
-    )
-    return db_quiz_attempt
+@router.post("/{quiz_id}/grade-batch")
+async def grade_answer_sheets(
+    quiz_id: int,
+    request: Request,
+    batch_size: int = Query(500, ge=1, le=5000),
+    db: Session = Depends(get_db),
+    current_user: AuthenticatedUser = Depends(get_current_active_user)
+):
+    """
+    Grade a batch of offline answer sheets against one quiz and record an
+    attempt for each student. The body is CSV (Content-Type: text/csv) or a
+    JSON list. Results stream back as NDJSON, one line per row in input
+    order as each batch is written, followed by a summary line.
+
+    Teachers and admins (PRIVILEGED_ROLES) may grade any student; anyone else
+    only rows for themselves, or the whole batch is refused with 403. The body
+    is capped at GRADE_BATCH_MAX_MB (413) and is parsed a row at a time, never
+    held in memory whole.
+    """
+    plan = await run_in_threadpool(grading.get_grading_plan, db, quiz_id)
+    if plan is None:
+        raise HTTPException(status_code=404, detail="Quiz not found")
+
+    # The response body is written while the rows are parsed, so the request
+    # body is spooled first; small bodies stay in memory, larger ones go to disk
+    content_type = request.headers.get("content-type", "")
+    body = tempfile.SpooledTemporaryFile(max_size=GRADE_BATCH_SPOOL_BYTES)
+    try:
+        async for chunk in request.stream():
+            # Past GRADE_BATCH_SPOOL_BYTES this is a disk write
+            await run_in_threadpool(body.write, chunk)
+        await run_in_threadpool(_check_grading_batch, body, content_type, db, current_user)
+    except BaseException:
+        body.close()
+        raise
+
+    def results() -> Iterator[bytes]:
+        total = graded_count = failed = 0
+        # The request's session is closed once the response starts; writes get their own
+        write_db = SessionLocal()
+        try:
+            rows = _iter_grading_batch(body, content_type)
+            while True:
+                chunk = list(enumerate(itertools.islice(rows, batch_size), start=total + 1))
+                if not chunk:
+                    break
+                total += len(chunk)
+                user_ids = services.get_user_ids_by_email(
+                    write_db, list({row.student for _, row in chunk if isinstance(row, StudentSubmission)})
+                )
+                lines: Dict[int, Dict[str, Any]] = {}
+                valid = []
+                for line, row in chunk:
+                    if not isinstance(row, StudentSubmission):
+                        lines[line] = {"line": line, "status": "error", "error": row}
+                    elif row.student not in user_ids:
+                        lines[line] = {"line": line, "student": row.student, "status": "error", "error": "Unknown student"}
+                    else:
+                        valid.append((line, row))
+
+                if valid:
+                    graded = grading.grade_batch(
+                        plan, [row.answers for _, row in valid], [row.justifications for _, row in valid]
+                    )
+                    try:
+                        attempts = services.record_graded_attempts(
+                            write_db, quiz_id, [user_ids[row.student] for _, row in valid], graded
+                        )
+                        for (line, row), g, attempt in zip(valid, graded, attempts):
+                            lines[line] = {
+                                "line": line, "student": row.student, "status": "graded", "attempt_id": attempt.id,
+                                "score": g.score, "total": g.total, "accuracy": g.accuracy
+                            }
+                    except Exception as e:
+                        write_db.rollback()
+                        for line, row in valid:
+                            lines[line] = {"line": line, "student": row.student, "status": "error", "error": f"Batch insert failed: {e}"}
+
+                for line in sorted(lines):
+                    if lines[line]["status"] == "graded":
+                        graded_count += 1
+                    else:
+                        failed += 1
+                    yield (json.dumps(lines[line]) + "\n").encode("utf-8")
+        finally:
+            write_db.close()
+            body.close()
+        yield (json.dumps({"status": "done", "total": total, "graded": graded_count, "failed": failed}) + "\n").encode("utf-8")
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
 
 @router.get("/{quiz_id}/explain-conflict/{question_id}", response_model=EthicalConflictExplanation)
 def explain_question_conflict(
     quiz_id: int,
     question_id: int,
     db: Session = Depends(get_db),
-    current_user: auth_models.User = Depends(get_current_active_user)
+    current_user: AuthenticatedUser = Depends(get_current_active_user)
 ):
     """Get explanation for an ethical conflict in a specific question"""
-    quiz = services.get_quiz(db, quiz_id=quiz_id)
-    if quiz is None:
-        raise HTTPException(status_code=404, detail="Quiz not found")
-    
-    # Find the question
-    question_data = None
-    for q in quiz.questions:
-        if q.get("id") == question_id:
-            question_data = q
-            break
-    
-    if not question_data:
+    question = services.get_quiz_question(db, quiz_id=quiz_id, question_id=question_id)
+    if question is None:
         raise HTTPException(status_code=404, detail="Question not found")
     
-    # Generate explanation
-    explanation_data = explain_ethical_conflict(
-        question_text=question_data.get("question_text", ""),
-        options=question_data.get("options", []),
-        correct_answer=question_data.get("correct_answer")
-    )
+    # Reuse the explanation stored with the question, generating it on first request
+    explanation_data = (question.artifacts or {}).get("conflict_explanation")
+    if not explanation_data:
+        explanation_data = explain_ethical_conflict(
+            question_text=question.question_text or "",
+            options=question.options or [],
+            correct_answer=question.correct_answer
+        )
+        if not explanation_data.get("explanation", "").startswith("Error "):
+            services.save_question_artifact(db, question, "conflict_explanation", explanation_data)
     
     return EthicalConflictExplanation(
         question_id=question_id,
-        question_text=question_data.get("question_text", ""),
-        options=question_data.get("options", []),
+        question_text=question.question_text or "",
+        options=question.options or [],
         pros_cons=explanation_data.get("pros_cons", {}),
         ethical_frameworks=explanation_data.get("ethical_frameworks", []),
         real_world_parallels=explanation_data.get("real_world_parallels", []),
         explanation=explanation_data.get("explanation", "")
     )
 
+@router.get("/{quiz_id}/question-stats", response_model=List[QuestionStats])
+def read_question_stats(
+    quiz_id: int,
+    db: Session = Depends(get_db),
+    current_user: AuthenticatedUser = Depends(get_current_active_user)
+):
+    """Attempt and correct counts for each question of a quiz"""
+    rows = services.get_question_stats(db, quiz_id=quiz_id)
+    if not rows:
+        raise HTTPException(status_code=404, detail="Quiz not found")
+    return [
+        QuestionStats(
+            question_id=row.question_id,
+            question_text=row.question_text or "",
+            attempts=row.attempts,
+            correct=row.correct,
+            accuracy=(row.correct / row.attempts) * 100 if row.attempts else 0.0
+        )
+        for row in rows
+    ]
+
 @router.get("/attempts/{attempt_id}/analysis", response_model=PostQuizAnalysis)
 def get_post_quiz_analysis(
     attempt_id: int,
     db: Session = Depends(get_db),
-    current_user: auth_models.User = Depends(get_current_active_user)
+    current_user: AuthenticatedUser = Depends(get_current_active_user)
 ):
     """Get detailed post-quiz analysis with explanations for wrong answers"""
     attempt = services.get_attempt_by_id(db, attempt_id, user_id=current_user.id)
+    if not attempt and submission_buffer.enabled():
+        # The results page asks for this right after submitting, maybe to another worker
+        if submission_buffer.get_buffer().write_through(attempt_id):
+            attempt = services.get_attempt_by_id(db, attempt_id, user_id=current_user.id)
     if not attempt:
         raise HTTPException(status_code=404, detail="Quiz attempt not found")
     
-    quiz = services.get_quiz(db, attempt.quiz_id)
-    if not quiz:
+    questions = services.get_quiz_questions(db, attempt.quiz_id)
+    if not questions:
         raise HTTPException(status_code=404, detail="Quiz not found")
     
     explanations = []
     answer_details = attempt.answer_details or {}
     
     # Generate explanations for each question
-    for q_data in quiz.questions:
-        question_id = str(q_data.get("id"))
-        question_text = q_data.get("question_text", "")
-        options = q_data.get("options", [])
-        correct_answer = q_data.get("correct_answer", "")
+    for question in questions:
+        question_id = str(question.question_id)
+        question_text = question.question_text or ""
+        options = question.options or []
+        correct_answer = question.correct_answer or ""
         
         if question_id in answer_details:
             detail = answer_details[question_id]
@@ -185,26 +555,8 @@ def get_post_quiz_analysis(
 @router.get("/ethical-bias-profile", response_model=EthicalBiasProfile)
 def get_ethical_bias_profile(
     db: Session = Depends(get_db),
-    current_user: auth_models.User = Depends(get_current_active_user),
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
     force_refresh: bool = Query(False, description="Force refresh of the profile")
 ):
     # Feature temporarily disabled
     raise HTTPException(status_code=404, detail="Ethical bias profile is temporarily disabled")
-
-@router.get("/history")
-def get_user_quiz_history(db: Session = Depends(get_db), current_user: auth_models.User = Depends(get_current_active_user)):
-    attempts = services.get_user_quiz_attempts(db, user_id=current_user.id)
-    # Serialize to plain JSON-safe dicts
-    result = []
-    for attempt in attempts:
-        result.append({
-            "id": attempt.id,
-            "user_id": attempt.user_id,
-            "quiz_id": attempt.quiz_id,
-            "score": attempt.score,
-            "total": attempt.total,
-            "accuracy": float(attempt.accuracy) if attempt.accuracy is not None else 0.0,
-            "timestamp": attempt.timestamp.isoformat() if attempt.timestamp else None,
-            "answer_details": attempt.answer_details or {}
-        })
-    return result
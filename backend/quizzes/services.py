@@ -1,102 +1,274 @@
+from sqlalchemy import Boolean, Integer, String, Text, cast, column, func, insert, select, true, tuple_, values
 from sqlalchemy.orm import Session
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 
+from auth.models import User
 from quizzes import models
-from schemas import QuizCreate, QuizAttemptCreate
+from quizzes.grading import GradedSubmission, GradingPlan, grade_submission
+from quizzes.pagination import encode_cursor, decode_cursor
+from schemas import QuizCreate
 
 def get_quiz(db: Session, quiz_id: int):
     return db.query(models.Quiz).filter(models.Quiz.id == quiz_id).first()
 
-def get_quizzes(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Quiz).offset(skip).limit(limit).all()
+def _keyset(statement, sort_columns, limit: Optional[int], cursor: Optional[str]):
+    """Order statement by sort_columns and start it after the cursor. Fetches one extra row to detect a next page."""
+    after = decode_cursor(cursor)
+    if after is not None:
+        statement = statement.where(tuple_(*sort_columns) > tuple_(*after))
+    statement = statement.order_by(*(c.asc() for c in sort_columns))
+    if limit is not None:
+        statement = statement.limit(limit + 1)
+    return statement
+
+def split_page(rows: List[Any], limit: Optional[int], ts_attr: str) -> Tuple[List[Any], Optional[str]]:
+    """Trim the extra row fetched by _keyset and build the cursor for the next page."""
+    if limit is None or len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, ts_attr), last.id)
+
+def quizzes_page_statement(limit: Optional[int], cursor: Optional[str], include_details: bool):
+    """Quizzes ordered by (created_at, id). The questions JSONB is only selected with include_details."""
+    columns = [
+        models.Quiz.id,
+        models.Quiz.title,
+        models.Quiz.category,
+        models.Quiz.created_at,
+        func.coalesce(func.jsonb_array_length(models.Quiz.questions), 0).label("question_count"),
+    ]
+    if include_details:
+        columns.append(models.Quiz.questions)
+    return _keyset(select(*columns), (models.Quiz.created_at, models.Quiz.id), limit, cursor)
+
+def attempts_page_statement(user_id: int, limit: Optional[int], cursor: Optional[str], include_details: bool):
+    """A user's attempts ordered by (timestamp, id). answer_details is only selected with include_details."""
+    columns = [
+        models.QuizAttempt.id,
+        models.QuizAttempt.user_id,
+        models.QuizAttempt.quiz_id,
+        models.QuizAttempt.score,
+        models.QuizAttempt.total,
+        models.QuizAttempt.accuracy,
+        models.QuizAttempt.timestamp,
+    ]
+    if include_details:
+        columns.append(models.QuizAttempt.answer_details)
+    statement = select(*columns).where(models.QuizAttempt.user_id == user_id)
+    return _keyset(statement, (models.QuizAttempt.timestamp, models.QuizAttempt.id), limit, cursor)
+
+def get_quizzes_page(
+    db: Session,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    include_details: bool = False
+) -> Tuple[List[Any], Optional[str]]:
+    rows = db.execute(quizzes_page_statement(limit, cursor, include_details)).all()
+    return split_page(rows, limit, "created_at")
+
+def question_artifacts(question: Dict[str, Any]) -> Dict[str, Any]:
+    """Precompute the per-question answer key data stored alongside each question row."""
+    options = question.get("options") or []
+    correct_answer = question.get("correct_answer")
+    return {
+        "correct_index": options.index(correct_answer) if correct_answer in options else None,
+        "option_count": len(options),
+    }
+
+def build_question_rows(questions: List[Dict[str, Any]]) -> List[models.QuizQuestion]:
+    return [
+        models.QuizQuestion(
+            question_id=int(q.get("id")),
+            position=position,
+            question_text=q.get("question_text", ""),
+            options=q.get("options", []),
+            correct_answer=q.get("correct_answer"),
+            artifacts=question_artifacts(q),
+        )
+        for position, q in enumerate(questions)
+    ]
 
 def create_quiz(db: Session, quiz: QuizCreate):
     questions_payload = [q.dict() for q in quiz.questions]
     db_quiz = models.Quiz(title=quiz.title, category=quiz.category, questions=questions_payload)
+    db_quiz.question_rows = build_question_rows(questions_payload)
     db.add(db_quiz)
     db.commit()
     db.refresh(db_quiz)
     return db_quiz
 
+def bulk_create_quizzes(db: Session, quizzes: List[QuizCreate]) -> List[int]:
+    """
+    Insert a batch of quizzes and their question rows with two multi-row
+    INSERTs and a single commit. Returns the new quiz ids in input order.
+    """
+    if not quizzes:
+        return []
+    payloads = [[q.dict() for q in quiz.questions] for quiz in quizzes]
+    quiz_ids = db.execute(
+        insert(models.Quiz).returning(models.Quiz.id, sort_by_parameter_order=True),
+        [
+            {"title": quiz.title, "category": quiz.category, "questions": questions}
+            for quiz, questions in zip(quizzes, payloads)
+        ],
+    ).scalars().all()
+    question_rows = [
+        {
+            "quiz_id": quiz_id,
+            "question_id": int(q.get("id")),
+            "position": position,
+            "question_text": q.get("question_text", ""),
+            "options": q.get("options", []),
+            "correct_answer": q.get("correct_answer"),
+            "artifacts": question_artifacts(q),
+        }
+        for quiz_id, questions in zip(quiz_ids, payloads)
+        for position, q in enumerate(questions)
+    ]
+    if question_rows:
+        db.execute(insert(models.QuizQuestion), question_rows)
+    db.commit()
+    return list(quiz_ids)
+
+def get_quiz_question(db: Session, quiz_id: int, question_id: int) -> Optional[models.QuizQuestion]:
+    return (
+        db.query(models.QuizQuestion)
+        .filter(models.QuizQuestion.quiz_id == quiz_id, models.QuizQuestion.question_id == question_id)
+        .first()
+    )
+
+def get_quiz_questions(db: Session, quiz_id: int) -> List[models.QuizQuestion]:
+    return (
+        db.query(models.QuizQuestion)
+        .filter(models.QuizQuestion.quiz_id == quiz_id)
+        .order_by(models.QuizQuestion.position.asc())
+        .all()
+    )
+
+def save_question_artifact(db: Session, question: models.QuizQuestion, key: str, value: Any) -> None:
+    # Reassign so SQLAlchemy detects the JSONB change
+    question.artifacts = {**(question.artifacts or {}), key: value}
+    db.commit()
+
+def get_question_stats(db: Session, quiz_id: int) -> List[Any]:
+    """Per-question attempt and correct counts, joining question rows with each attempt's answer_details."""
+    is_correct = cast(
+        models.QuizAttempt.answer_details[cast(models.QuizQuestion.question_id, String)]["is_correct"].astext,
+        Boolean,
+    )
+    return (
+        db.query(
+            models.QuizQuestion.question_id,
+            models.QuizQuestion.question_text,
+            func.count(models.QuizAttempt.id).label("attempts"),
+            func.coalesce(func.sum(cast(is_correct, Integer)), 0).label("correct"),
+        )
+        .outerjoin(models.QuizAttempt, models.QuizAttempt.quiz_id == models.QuizQuestion.quiz_id)
+        .filter(models.QuizQuestion.quiz_id == quiz_id)
+        .group_by(models.QuizQuestion.question_id, models.QuizQuestion.question_text, models.QuizQuestion.position)
+        .order_by(models.QuizQuestion.position.asc())
+        .all()
+    )
+
 def record_quiz_attempt(
     db: Session,
     user_id: int,
-    attempt: QuizAttemptCreate,
-    quiz: models.Quiz,
+    plan: GradingPlan,
     answers: Dict[str, str] = None,
     justifications: Dict[str, str] = None
-) -> models.QuizAttempt:
-    """Record quiz attempt with detailed answer breakdown and justifications"""
-    answers = answers or {}
-    justifications = justifications or {}
-    
-    # Build answer_details: {question_id: {answer, justification, is_correct}}
-    answer_details = {}
-    score = 0
-    
-    for q_data in quiz.questions:
-        question_id = str(q_data.get("id"))
-        correct_answer = q_data.get("correct_answer")
-        user_answer = answers.get(question_id, "")
-        justification = justifications.get(question_id, "")
-        is_correct = (user_answer == correct_answer)
-        
-        if is_correct:
-            score += 1
-        
-        answer_details[question_id] = {
-            "answer": user_answer,
-            "justification": justification,
-            "is_correct": is_correct,
-            "correct_answer": correct_answer
-        }
-        
-        # Store justification in UserJustification table
-        if justification:
-            db_justification = models.UserJustification(
-                attempt_id=None,  # Will be set after attempt is created
-                question_id=int(question_id),
-                justification_text=justification,
-                user_answer=user_answer,
-                is_correct=1 if is_correct else 0
-            )
-            # We'll add this after the attempt is created
-    
-    total = len(quiz.questions)
-    accuracy = (score / total) * 100 if total > 0 else 0
-    
-    # Create attempt
-    db_attempt = models.QuizAttempt(
-        user_id=user_id,
-        quiz_id=attempt.quiz_id,
-        score=score,
-        total=total,
-        accuracy=accuracy,
-        answer_details=answer_details
+):
+    """
+    Grade and record a quiz attempt with its justifications.
+    The attempt and its justifications are written by one statement (a
+    data-modifying CTE) and the attempt row comes back via RETURNING, so a
+    submission is a single round trip plus the commit.
+    """
+    graded = grade_submission(plan, answers, justifications)
+
+    attempt_insert = (
+        insert(models.QuizAttempt)
+        .values(
+            user_id=user_id,
+            quiz_id=plan.quiz_id,
+            score=graded.score,
+            total=graded.total,
+            accuracy=graded.accuracy,
+            answer_details=graded.answer_details
+        )
+        .returning(*models.QuizAttempt.__table__.c)
     )
-    db.add(db_attempt)
-    db.flush()  # Get the ID without committing
-    
-    # Now add justifications with the attempt_id
-    for q_data in quiz.questions:
-        question_id = str(q_data.get("id"))
-        justification = justifications.get(question_id, "")
-        if justification:
-            user_answer = answers.get(question_id, "")
-            is_correct = answer_details[question_id]["is_correct"]
-            db_justification = models.UserJustification(
-                attempt_id=db_attempt.id,
-                question_id=int(question_id),
-                justification_text=justification,
-                user_answer=user_answer,
-                is_correct=1 if is_correct else 0
-            )
-            db.add(db_justification)
-    
+
+    if graded.justification_rows:
+        new_attempt = attempt_insert.cte("new_attempt")
+        rows = values(
+            column("question_id", Integer),
+            column("justification_text", Text),
+            column("user_answer", String),
+            column("is_correct", Integer),
+            name="justification_rows",
+        ).data([
+            (r["question_id"], r["justification_text"], r["user_answer"], r["is_correct"])
+            for r in graded.justification_rows
+        ])
+        justification_insert = insert(models.UserJustification).from_select(
+            ["attempt_id", "question_id", "justification_text", "user_answer", "is_correct"],
+            select(new_attempt.c.id, rows.c.question_id, rows.c.justification_text, rows.c.user_answer, rows.c.is_correct)
+            .select_from(new_attempt)
+            .join(rows, true()),
+        ).cte("new_justifications")
+        statement = select(new_attempt).add_cte(justification_insert)
+    else:
+        statement = attempt_insert
+
+    db_attempt = db.execute(statement).one()
     db.commit()
-    db.refresh(db_attempt)
     return db_attempt
 
+def get_user_ids_by_email(db: Session, emails: List[str]) -> Dict[str, int]:
+    if not emails:
+        return {}
+    rows = db.execute(select(User.email, User.id).where(User.email.in_(emails))).all()
+    return {row.email: row.id for row in rows}
+
+def record_graded_attempts(
+    db: Session,
+    quiz_id: int,
+    user_ids: List[int],
+    graded: List[GradedSubmission]
+) -> List[Any]:
+    """
+    Insert already graded attempts and their justifications with two multi-row
+    INSERTs and one commit. Returns (id, timestamp) rows in input order.
+    """
+    if not graded:
+        return []
+    attempts = db.execute(
+        insert(models.QuizAttempt).returning(
+            models.QuizAttempt.id, models.QuizAttempt.timestamp, sort_by_parameter_order=True
+        ),
+        [
+            {
+                "user_id": user_id,
+                "quiz_id": quiz_id,
+                "score": g.score,
+                "total": g.total,
+                "accuracy": g.accuracy,
+                "answer_details": g.answer_details,
+            }
+            for user_id, g in zip(user_ids, graded)
+        ],
+    ).all()
+    justification_rows = [
+        {"attempt_id": attempt.id, **row}
+        for attempt, g in zip(attempts, graded)
+        for row in g.justification_rows
+    ]
+    if justification_rows:
+        db.execute(insert(models.UserJustification), justification_rows)
+    db.commit()
+    return attempts
+
 def get_user_quiz_attempts(db: Session, user_id: int) -> List[models.QuizAttempt]:
     return (
         db.query(models.QuizAttempt)
@@ -105,11 +277,21 @@ def get_user_quiz_attempts(db: Session, user_id: int) -> List[models.QuizAttempt
         .all()
     )
 
+def get_user_quiz_attempts_page(
+    db: Session,
+    user_id: int,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    include_details: bool = False
+) -> Tuple[List[Any], Optional[str]]:
+    rows = db.execute(attempts_page_statement(user_id, limit, cursor, include_details)).all()
+    return split_page(rows, limit, "timestamp")
+
 def get_user_justifications(db: Session, user_id: int) -> List[models.UserJustification]:
     """Get all justifications for a user across all attempts"""
     return (
         db.query(models.UserJustification)
-        .join(models.QuizAttempt)
+        .join(models.QuizAttempt, models.UserJustification.attempt_id == models.QuizAttempt.id)
         .filter(models.QuizAttempt.user_id == user_id)
         .order_by(models.UserJustification.timestamp.desc())
         .all()
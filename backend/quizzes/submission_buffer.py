@@ -0,0 +1,402 @@
+"""
+Write-behind buffer for quiz submissions, enabled with SUBMISSION_BUFFER_ENABLED=true.
+
+A buffered submission is graded in-process, given an id from a block reserved
+from quiz_attempts_id_seq and appended to a local journal. The request is only
+acknowledged after an fsync of the journal. A background thread then writes
+the pending attempts to Postgres in one transaction. It does this every
+SUBMISSION_FLUSH_MS milliseconds, or as soon as SUBMISSION_FLUSH_MAX are waiting.
+
+The journal is a directory of JSON Lines segments. Each flush seals the active
+segment and deletes it once its attempts are committed. On startup, segments
+left behind by a crash are replayed. A live process holds a lock on its active
+segment, so other processes skip it. Attempts are inserted with
+ON CONFLICT DO NOTHING, and justifications only for attempts that were
+actually inserted, so replaying a partly flushed segment is safe.
+
+Buffered attempts reach history and analytics within one flush interval.
+A read of one specific attempt can call write_through(), which writes it
+straight from the journal. That works from any worker sharing the journal
+directory, not only the one that took the submission.
+
+An entry that Postgres rejects (bad data, a deleted quiz) would block every
+flush behind it. When a batch fails that way its entries are retried one by
+one, and those that still fail are moved to dead_letter/ with their error.
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import exc, insert, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from quizzes import models
+from quizzes.grading import GradingPlan, grade_submission
+from utils.access_log import get_logger
+
+SUBMISSION_BUFFER_ENABLED = os.getenv("SUBMISSION_BUFFER_ENABLED", "false").lower() in ("1", "true", "yes")
+SUBMISSION_JOURNAL_DIR = os.getenv("SUBMISSION_JOURNAL_DIR", "db/submission_journal")
+SUBMISSION_FLUSH_MS = int(os.getenv("SUBMISSION_FLUSH_MS", "200"))
+SUBMISSION_FLUSH_MAX = int(os.getenv("SUBMISSION_FLUSH_MAX", "500"))
+# Attempt ids reserved from the sequence per round trip
+SUBMISSION_ID_BLOCK = int(os.getenv("SUBMISSION_ID_BLOCK", "100"))
+
+logger = get_logger("submissions")
+
+_SEGMENT_SUFFIX = ".jsonl"
+DEAD_LETTER_DIR = "dead_letter"
+
+# Errors that retrying cannot fix; anything else (e.g. the database being down) is retried
+_POISON_ERRORS = (exc.IntegrityError, exc.DataError, exc.ProgrammingError, KeyError, TypeError, ValueError)
+
+
+def _fsync_directory(directory: str) -> None:
+    """Make a file created or removed in directory durable."""
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _segment_path(directory: str) -> str:
+    return os.path.join(directory, f"{os.getpid()}-{time.time_ns()}{_SEGMENT_SUFFIX}")
+
+
+def _read_segment(path: str) -> List[Dict[str, Any]]:
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                # A torn final line from a crash mid-write; it was never acknowledged
+                logger.warning("Skipping unreadable journal line", extra={"segment": path, "line": line_number})
+    return entries
+
+
+def write_attempts(engine, entries: List[Dict[str, Any]]) -> int:
+    """Insert journal entries in one transaction. Returns how many attempts were new."""
+    entries = list({e["id"]: e for e in entries}.values())
+    if not entries:
+        return 0
+    attempts = models.QuizAttempt.__table__
+    with engine.begin() as conn:
+        inserted = set(conn.execute(
+            pg_insert(attempts)
+            .values([
+                {
+                    "id": e["id"],
+                    "user_id": e["user_id"],
+                    "quiz_id": e["quiz_id"],
+                    "score": e["score"],
+                    "total": e["total"],
+                    "accuracy": e["accuracy"],
+                    "timestamp": datetime.fromisoformat(e["timestamp"]),
+                    "answer_details": e["answer_details"],
+                }
+                for e in entries
+            ])
+            .on_conflict_do_nothing()
+            .returning(attempts.c.id)
+        ).scalars())
+        justification_rows = [
+            {"attempt_id": e["id"], **row}
+            for e in entries if e["id"] in inserted
+            for row in e["justifications"]
+        ]
+        if justification_rows:
+            conn.execute(insert(models.UserJustification.__table__), justification_rows)
+    return len(inserted)
+
+
+def write_or_dead_letter(engine, directory: str, entries: List[Dict[str, Any]]) -> int:
+    """
+    write_attempts, isolating entries Postgres rejects: if the batch fails with
+    a poison error, each entry is written alone and those that fail are moved
+    to the dead letter directory. Other errors propagate so the batch is retried.
+    """
+    try:
+        return write_attempts(engine, entries)
+    except _POISON_ERRORS as e:
+        if len(entries) == 1:
+            dead_letter(directory, entries[0], e)
+            return 0
+    written = 0
+    for entry in entries:
+        try:
+            written += write_attempts(engine, [entry])
+        except _POISON_ERRORS as e:
+            dead_letter(directory, entry, e)
+    return written
+
+
+def dead_letter(directory: str, entry: Dict[str, Any], error: Exception) -> None:
+    dead_dir = os.path.join(directory, DEAD_LETTER_DIR)
+    os.makedirs(dead_dir, exist_ok=True)
+    path = os.path.join(dead_dir, f"{os.getpid()}{_SEGMENT_SUFFIX}")
+    created = not os.path.exists(path)
+    # The driver's message, without the statement and parameters SQLAlchemy appends
+    record = {"error": f"{type(error).__name__}: {getattr(error, 'orig', error)}".strip(), "entry": entry}
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, separators=(",", ":"), default=str) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    if created:
+        _fsync_directory(dead_dir)
+    logger.warning("Moved submission to dead letter", extra={"attempt": entry.get("id"), "segment": path, "error": record["error"]})
+
+
+class SubmissionBuffer:
+    def __init__(self, engine, directory: str = SUBMISSION_JOURNAL_DIR,
+                 flush_ms: int = SUBMISSION_FLUSH_MS, flush_max: int = SUBMISSION_FLUSH_MAX):
+        self.engine = engine
+        self.directory = directory
+        self.flush_interval = flush_ms / 1000.0
+        self.flush_max = flush_max
+
+        self._ids: deque = deque()
+        self._ids_lock = threading.Lock()
+
+        # Lock order: _sync_lock, then _write_lock
+        self._write_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._file = None
+        self._path: Optional[str] = None
+        self._pending: List[Dict[str, Any]] = []
+        self._appended = 0  # Entries written, across segments
+        self._synced = 0  # Entries known to be on disk
+
+        self._flush_lock = threading.Lock()
+        self._sealed: List[Tuple[str, List[Dict[str, Any]]]] = []
+        self._unflushed = set()
+        self._flushed = threading.Condition()
+
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ---- lifecycle ----
+
+    def start(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self.recover()
+        self._open_segment()
+        self._thread = threading.Thread(target=self._run, name="submission-flusher", daemon=True)
+        self._thread.start()
+        print(f"✓ Submission buffer on: flush every {int(self.flush_interval * 1000)}ms or {self.flush_max} submissions")
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+        with self._sync_lock, self._write_lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+            # Nothing left in the active segment once the final flush succeeded
+            if self._path and not self._pending and not self._sealed and os.path.exists(self._path):
+                os.remove(self._path)
+
+    def recover(self) -> int:
+        """Replay segments no live process owns. Returns the attempts inserted."""
+        recovered = 0
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith(_SEGMENT_SUFFIX):
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                with open(path, "r+", encoding="utf-8") as f:
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue  # Another worker's active segment
+                    entries = _read_segment(path)
+                    recovered += write_or_dead_letter(self.engine, self.directory, entries)
+                os.remove(path)
+            except FileNotFoundError:
+                continue  # Replayed and removed by another worker
+            except Exception as e:
+                logger.warning("Could not replay journal segment", extra={"segment": path, "error": str(e)})
+        if recovered:
+            print(f"✓ Recovered {recovered} buffered submissions from the journal")
+        return recovered
+
+    # ---- submissions ----
+
+    def _next_id(self) -> int:
+        with self._ids_lock:
+            if not self._ids:
+                with self.engine.connect() as conn:
+                    self._ids.extend(conn.execute(
+                        text("SELECT nextval('quiz_attempts_id_seq') FROM generate_series(1, :n)"),
+                        {"n": SUBMISSION_ID_BLOCK},
+                    ).scalars())
+            return self._ids.popleft()
+
+    def submit(
+        self,
+        user_id: int,
+        plan: GradingPlan,
+        answers: Optional[Dict[str, str]] = None,
+        justifications: Optional[Dict[str, str]] = None
+    ) -> Dict[str, Any]:
+        """Grade and journal a submission. Returns the attempt as it will be stored, once it is durable."""
+        graded = grade_submission(plan, answers, justifications)
+        attempt = {
+            "id": self._next_id(),
+            "user_id": user_id,
+            "quiz_id": plan.quiz_id,
+            "score": graded.score,
+            "total": graded.total,
+            "accuracy": graded.accuracy,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "answer_details": graded.answer_details,
+        }
+        entry = {**attempt, "justifications": graded.justification_rows}
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+
+        with self._write_lock:
+            self._file.write(line)
+            self._file.flush()
+            self._appended += 1
+            position = self._appended
+            self._pending.append(entry)
+            pending = len(self._pending)
+            with self._flushed:
+                self._unflushed.add(attempt["id"])
+        self._sync(position)
+
+        if pending >= self.flush_max:
+            self._wake.set()
+        attempt["timestamp"] = datetime.fromisoformat(attempt["timestamp"])
+        return attempt
+
+    def _sync(self, position: int) -> None:
+        # Group commit: one fsync covers every entry appended before it
+        with self._sync_lock:
+            if self._synced >= position:
+                return
+            with self._write_lock:
+                target = self._appended
+                fd = self._file.fileno()
+            os.fsync(fd)
+            self._synced = target
+
+    def write_through(self, attempt_id: int) -> bool:
+        """
+        Make sure attempt_id is in Postgres if any process journaled it. Returns
+        False if no journal segment holds it.
+
+        Entries are fsynced before the submission is acknowledged and segments
+        are removed only after their commit, so an acknowledged attempt is
+        always in one or the other. Writing it here as well is safe:
+        write_attempts skips attempts that are already in Postgres.
+        """
+        with self._flushed:
+            local = attempt_id in self._unflushed
+        if local:
+            self.flush()
+            return True
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith(_SEGMENT_SUFFIX):
+                continue
+            try:
+                entries = _read_segment(os.path.join(self.directory, filename))
+            except FileNotFoundError:
+                continue  # Flushed and removed meanwhile
+            for entry in entries:
+                if entry.get("id") == attempt_id:
+                    write_or_dead_letter(self.engine, self.directory, [entry])
+                    return True
+        return False
+
+    # ---- flushing ----
+
+    def _open_segment(self) -> None:
+        self._path = _segment_path(self.directory)
+        self._file = open(self._path, "a", encoding="utf-8")
+        fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # An fsync of the file alone does not make its directory entry durable
+        _fsync_directory(self.directory)
+
+    def _seal(self) -> Optional[Tuple[str, List[Dict[str, Any]]]]:
+        """Swap in a fresh segment and hand back the old one with its entries."""
+        with self._sync_lock, self._write_lock:
+            if not self._pending:
+                return None
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._synced = self._appended
+            self._file.close()
+            sealed = (self._path, self._pending)
+            self._pending = []
+            self._open_segment()
+        return sealed
+
+    def flush(self) -> int:
+        """Write every sealed and pending submission to Postgres. Returns the attempts written."""
+        written = 0
+        with self._flush_lock:
+            sealed = self._seal()
+            if sealed:
+                self._sealed.append(sealed)
+            while self._sealed:
+                path, entries = self._sealed[0]
+                try:
+                    written += write_or_dead_letter(self.engine, self.directory, entries)
+                except Exception as e:
+                    # Still journaled; retried on the next flush or replayed after a restart
+                    logger.warning("Submission flush failed, kept in journal", extra={"submissions": len(entries), "error": str(e)})
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                self._sealed.pop(0)
+                with self._flushed:
+                    self._unflushed.difference_update(e["id"] for e in entries)
+                    self._flushed.notify_all()
+        return written
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+        self.flush()
+
+
+_buffer: Optional[SubmissionBuffer] = None
+
+
+def enabled() -> bool:
+    return _buffer is not None
+
+
+def get_buffer() -> Optional[SubmissionBuffer]:
+    return _buffer
+
+
+def start(engine) -> None:
+    global _buffer
+    if not SUBMISSION_BUFFER_ENABLED or _buffer is not None:
+        return
+    _buffer = SubmissionBuffer(engine)
+    _buffer.start()
+
+
+def stop() -> None:
+    global _buffer
+    if _buffer is not None:
+        _buffer.stop()
+        _buffer = None
@@ -1,12 +1,10 @@
 from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from database import get_db
-from auth.dependencies import get_current_active_user
-from auth import models as auth_models
-from services.analytics_service import compute_user_analytics
+from sqlalchemy.ext.asyncio import AsyncSession
+from auth.dependencies import AuthenticatedUser, get_current_active_user, get_read_db
+from services.analytics_service import compute_user_analytics_async
 
 router = APIRouter(tags=["Analytics"])
 
 @router.get("/summary")
-def get_summary(db: Session = Depends(get_db), current_user: auth_models.User = Depends(get_current_active_user)):
-    return compute_user_analytics(db, user_id=current_user.id)
+async def get_summary(db: AsyncSession = Depends(get_read_db), current_user: AuthenticatedUser = Depends(get_current_active_user)):
+    return await compute_user_analytics_async(db, user_id=current_user.id)
@@ -1,18 +1,40 @@
-from fastapi import APIRouter, UploadFile, HTTPException, Form, Depends
+from fastapi import APIRouter, HTTPException, Form, Depends, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
+import asyncio
+import hashlib
+import os
+import time
+from typing import Dict, Optional
 from sqlalchemy.orm import Session
 from database import get_db
-from auth.dependencies import get_current_active_user
-from auth import models as auth_models
-from utils.pdf_extractor import extract_text_from_pdf
-from services.retrieval_service import store_text_chunks
-from services.gemini_service import generate_quiz, reformat_quiz_output, generate_quiz_from_text
-from services.quiz_parser import parse_quiz_to_json
+from auth.dependencies import AuthenticatedUser, get_current_active_user
+from documents import ingestion, services as document_services
+from utils.pdf_extractor import MAX_PDF_PAGES, PdfTooManyPages, extract_document
+from utils.uploads import InvalidUpload, UploadTooLarge, spool_multipart_upload
+from services.gemini_service import PROMPT_VERSION, clamp_question_count, generate_quiz, reformat_quiz_output, generate_quiz_from_text
+from services.quiz_parser import is_placeholder_quiz, parse_quiz_to_json, title_from_filename
 from services.ethics_filter import refine_quiz # Import refine_quiz
-import tempfile
-import os
+from utils.access_log import get_logger
 
 router = APIRouter(tags=["Quiz"])
+logger = get_logger("quiz")
+
+# How long a first upload waits for its document to be indexed before generating without context
+GENERATION_INDEX_WAIT_SECONDS = float(os.getenv("GENERATION_INDEX_WAIT_SECONDS", "10"))
+_INDEX_POLL_SECONDS = 0.25
+
+
+async def _wait_indexed(db: Session, content_hash: str, timeout: float = GENERATION_INDEX_WAIT_SECONDS) -> bool:
+    """Poll until the ingestion workers have indexed the document. False if they have not within timeout."""
+    deadline = time.monotonic() + timeout
+    while True:
+        state = await run_in_threadpool(document_services.get_index_state, db, content_hash)
+        if state is not None and state.indexed_at is not None:
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(_INDEX_POLL_SECONDS)
 
 
 def _raise_if_gemini_error(text: str, context: str):
@@ -29,80 +51,171 @@ def _raise_if_gemini_error(text: str, context: str):
     raise HTTPException(status_code=502, detail=f"Gemini upstream error: {context}")
 
 
+def _parse_generated_quiz(quiz_text: str, source_name: str, questions: int) -> dict:
+    """Parse a generated quiz, falling back to a reformat pass and keeping a refinement if it parses as well."""
+    _raise_if_gemini_error(quiz_text, "generation")
+
+    # Primary parse
+    quiz_json = parse_quiz_to_json(quiz_text, source_name)
+
+    # If too few questions parsed, attempt reformat pass then re-parse
+    if len(quiz_json.get("questions", [])) < max(3, int(min(questions, 10) * 0.6)):
+        reformatted = reformat_quiz_output(quiz_text, num_questions=questions)
+        _raise_if_gemini_error(reformatted, "reformat")
+        try:
+            reformatted_parsed = parse_quiz_to_json(reformatted, source_name)
+        except Exception as e:
+            logger.warning("Reformat parse failed", extra={"error": str(e)})
+            reformatted_parsed = None
+        if reformatted_parsed and len(reformatted_parsed.get("questions", [])) >= len(quiz_json.get("questions", [])):
+            quiz_json = reformatted_parsed
+
+    # Optional refinement; keep the better of the two
+    try:
+        refined_quiz_text = refine_quiz(quiz_text) or ""
+        if refined_quiz_text:
+            # ignore refine errors silently
+            refined_parsed = parse_quiz_to_json(refined_quiz_text, source_name)
+            if refined_parsed and len(refined_parsed.get("questions", [])) >= len(quiz_json.get("questions", [])):
+                quiz_json = refined_parsed
+    except Exception as e:
+        logger.warning("Refine failed", extra={"error": str(e)})
+
+    return quiz_json
+
+
+async def _cached_quiz(db: Session, content_hash: str, level: str, questions: int, source_name: str):
+    quiz_json = await run_in_threadpool(
+        document_services.get_cached_generation, db, content_hash, level, questions, PROMPT_VERSION
+    )
+    if quiz_json is None:
+        return None
+    # The cached quiz may have been generated from an upload with another filename
+    return {**quiz_json, "title": title_from_filename(source_name)}
+
+
+async def _cache_quiz(db: Session, content_hash: str, level: str, questions: int, quiz_json: dict) -> None:
+    # Never pin the parse-failure placeholder; the next request should try the model again
+    if is_placeholder_quiz(quiz_json):
+        return
+    # A failed cache write only costs the next request a regeneration
+    try:
+        await run_in_threadpool(
+            document_services.save_generation, db, content_hash, level, questions, PROMPT_VERSION, quiz_json
+        )
+    except Exception as e:
+        db.rollback()
+        logger.warning("Caching generated quiz failed", extra={"error": str(e)})
+
+
+def _quiz_response(quiz_json: dict, cache_status: str, document_hash: Optional[str] = None) -> JSONResponse:
+    headers = {"X-Generation-Cache": cache_status}
+    if document_hash:
+        # What /quiz/documents/{hash}/ingestion takes
+        headers["X-Document-Hash"] = document_hash
+    return JSONResponse(content=quiz_json, headers=headers)
+
+
+def _form_int(fields: Dict[str, str], name: str, default: int) -> int:
+    try:
+        return int(fields.get(name, default))
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f"{name}: expected an integer")
+
+
+def _form_bool(fields: Dict[str, str], name: str) -> bool:
+    return fields.get(name, "").strip().lower() in ("1", "true", "yes", "on")
+
+
 @router.post("/upload")
 async def upload_pdf(
-    file: UploadFile, 
-    level: str = Form("intermediate"), 
-    questions: int = Form(10),
+    request: Request,
     db: Session = Depends(get_db),
-    current_user: auth_models.User = Depends(get_current_active_user)
+    current_user: AuthenticatedUser = Depends(get_current_active_user)
 ):
-    try:
-        if not file.filename.lower().endswith('.pdf'):
-            raise HTTPException(status_code=400, detail="Only PDF files are allowed")
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            content = await file.read()
-            tmp.write(content)
-            tmp_path = tmp.name
+    """
+    Generate a quiz from a PDF. A quiz generated earlier for the same file, level
+    and question count is returned from the cache; fresh=true generates a new
+    variant and caches that instead.
 
+    The multipart form (file, and optional level, questions and fresh) is
+    parsed here as it streams in, so the file is spooled once.
+    """
+    try:
+        # Stream the upload into a bounded spool, then parse once; every stage below reads the same page texts
         try:
-            # Extract minimal text to validate content volume
-            preview_text = " ".join(list(extract_text_from_pdf(tmp_path))[:5])
-            if len(preview_text.strip()) < 800:
-                raise HTTPException(status_code=400, detail="PDF has insufficient extractable text. Please provide a text-based PDF or run OCR.")
-            
-            # Store chunks best-effort
-            try:
-                store_text_chunks(extract_text_from_pdf(tmp_path), file.filename or "unknown.pdf")
-            except Exception as e:
-                print(f"WARN: store_text_chunks failed: {e}")
-
-            # Generate
-            quiz_text = generate_quiz(extract_text_from_pdf(tmp_path), level=level, num_questions=questions)
-            _raise_if_gemini_error(quiz_text, "generation")
-            
-            # Primary parse
-            quiz_json = parse_quiz_to_json(quiz_text, file.filename or "unknown.pdf")
-            
-            # If too few questions parsed, attempt reformat pass then re-parse
-            if len(quiz_json.get("questions", [])) < max(3, int(min(questions, 10) * 0.6)):
-                reformatted = reformat_quiz_output(quiz_text, num_questions=questions)
-                _raise_if_gemini_error(reformatted, "reformat")
+            upload, fields = await spool_multipart_upload(request)
+        except UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except InvalidUpload as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        with upload:
+            if not (upload.filename or "").lower().endswith('.pdf'):
+                raise HTTPException(status_code=400, detail="Only PDF files are allowed")
+
+            source_name = upload.filename
+            level = (fields.get("level") or "intermediate").strip().lower()
+            questions = clamp_question_count(_form_int(fields, "questions", 10))
+            fresh = _form_bool(fields, "fresh")
+
+            if not fresh:
+                cached = await _cached_quiz(db, upload.content_hash, level, questions, source_name)
+                if cached is not None:
+                    logger.info("Served cached quiz for PDF", extra={"document": upload.content_hash})
+                    return _quiz_response(cached, "hit", upload.content_hash)
+
+            # The same file uploaded before: reuse its stored pages instead of extracting again
+            stored = await run_in_threadpool(document_services.get_document, db, upload.content_hash)
+            if stored is not None:
+                if stored.page_count > MAX_PDF_PAGES:
+                    raise HTTPException(status_code=413, detail=f"PDF has {stored.page_count} pages; the limit is {MAX_PDF_PAGES}")
+                document = document_services.as_extracted(stored, source_name)
+            else:
                 try:
-                    reformatted_parsed = parse_quiz_to_json(reformatted, file.filename or "unknown.pdf")
+                    document = await run_in_threadpool(extract_document, upload.source, source_name)
+                except PdfTooManyPages as e:
+                    raise HTTPException(status_code=413, detail=str(e))
                 except Exception as e:
-                    print(f"WARN: reformat parse failed: {e}")
-                    reformatted_parsed = None
-                if reformatted_parsed and len(reformatted_parsed.get("questions", [])) >= len(quiz_json.get("questions", [])):
-                    quiz_json = reformatted_parsed
+                    raise HTTPException(status_code=400, detail=f"Could not read PDF: {e}")
 
-            # Optional refinement; keep the better of the two
+        # Validate content volume
+        if len(document.preview().strip()) < 800:
+            raise HTTPException(status_code=400, detail="PDF has insufficient extractable text. Please provide a text-based PDF or run OCR.")
+
+        if stored is None:
+            stored = await run_in_threadpool(document_services.save_document, db, upload.content_hash, document)
+
+        # Indexing runs in the background ingestion workers; a new document gets a
+        # short wait for it, and a quiz generated without its context is not cached
+        indexed = stored.indexed_at is not None
+        if not indexed:
             try:
-                refined_quiz_text = refine_quiz(quiz_text) or ""
-                if refined_quiz_text:
-                    # ignore refine errors silently
-                    refined_parsed = parse_quiz_to_json(refined_quiz_text, file.filename or "unknown.pdf")
-                    if refined_parsed and len(refined_parsed.get("questions", [])) >= len(quiz_json.get("questions", [])):
-                        quiz_json = refined_parsed
+                await run_in_threadpool(ingestion.enqueue, db, upload.content_hash, source_name)
+                indexed = await _wait_indexed(db, upload.content_hash)
             except Exception as e:
-                print(f"WARN: refine failed: {e}")
-
-            print(f"DEBUG: Generated {len(quiz_json.get('questions', []))} questions")
-            print(f"DEBUG: Quiz JSON structure: {quiz_json}")
-            return JSONResponse(content=quiz_json)
-            
-        finally:
-            if os.path.exists(tmp_path):
-                try:
-                    os.unlink(tmp_path)
-                except Exception as e:
-                    print(f"WARN: tmp cleanup failed: {e}")
-                
+                db.rollback()
+                logger.warning("Queueing ingestion failed", extra={"document": upload.content_hash, "error": str(e)})
+
+        quiz_text = await run_in_threadpool(
+            generate_quiz, document.pages, level=level, num_questions=questions, document_hash=upload.content_hash
+        )
+        quiz_json = await run_in_threadpool(_parse_generated_quiz, quiz_text, source_name, questions)
+        if indexed:
+            await _cache_quiz(db, upload.content_hash, level, questions, quiz_json)
+        else:
+            logger.info("Not caching quiz generated before indexing finished", extra={"document": upload.content_hash})
+
+        logger.info("Generated quiz from PDF", extra={
+            "questions": len(quiz_json.get("questions", [])),
+            "pages": document.page_count,
+            "document": upload.content_hash,
+        })
+        return _quiz_response(quiz_json, "bypass" if fresh else "miss", upload.content_hash)
+
     except HTTPException:
         raise
     except Exception as e:
-        print(f"ERROR: Unhandled in /quiz/upload: {e}")
+        logger.exception("Unhandled error in /quiz/upload")
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
 
 
@@ -111,44 +224,62 @@ async def generate_from_text(
     text: str = Form(...), 
     level: str = Form("intermediate"), 
     questions: int = Form(10),
+    fresh: bool = Form(False),
     db: Session = Depends(get_db),
-    current_user: auth_models.User = Depends(get_current_active_user)
+    current_user: AuthenticatedUser = Depends(get_current_active_user)
 ):
+    """Generate a quiz from pasted text, cached like /upload by the text's hash."""
     try:
         if len((text or "").strip()) < 400:
             raise HTTPException(status_code=400, detail="Text is too short to generate a quality quiz. Provide more content.")
 
-        # Generate from text
-        quiz_text = generate_quiz_from_text(text, level=level, num_questions=questions)
-        _raise_if_gemini_error(quiz_text, "generation")
-        quiz_json = parse_quiz_to_json(quiz_text, "pasted_text")
+        level = (level or "intermediate").strip().lower()
+        questions = clamp_question_count(questions)
+        content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        if not fresh:
+            cached = await _cached_quiz(db, content_hash, level, questions, "pasted_text")
+            if cached is not None:
+                logger.info("Served cached quiz for text", extra={"content_hash": content_hash})
+                return _quiz_response(cached, "hit")
 
-        # Reformat pass if needed
-        if len(quiz_json.get("questions", [])) < max(3, int(min(questions, 10) * 0.6)):
-            reformatted = reformat_quiz_output(quiz_text, num_questions=questions)
-            _raise_if_gemini_error(reformatted, "reformat")
-            try:
-                reformatted_parsed = parse_quiz_to_json(reformatted, "pasted_text")
-            except Exception as e:
-                print(f"WARN: reformat parse failed: {e}")
-                reformatted_parsed = None
-            if reformatted_parsed and len(reformatted_parsed.get("questions", [])) >= len(quiz_json.get("questions", [])):
-                quiz_json = reformatted_parsed
+        quiz_text = await run_in_threadpool(generate_quiz_from_text, text, level=level, num_questions=questions)
+        quiz_json = await run_in_threadpool(_parse_generated_quiz, quiz_text, "pasted_text", questions)
+        await _cache_quiz(db, content_hash, level, questions, quiz_json)
 
-        # Optional refinement
-        try:
-            refined_quiz_text = refine_quiz(quiz_text) or ""
-            if refined_quiz_text:
-                refined_parsed = parse_quiz_to_json(refined_quiz_text, "pasted_text")
-                if refined_parsed and len(refined_parsed.get("questions", [])) >= len(quiz_json.get("questions", [])):
-                    quiz_json = refined_parsed
-        except Exception as e:
-            print(f"WARN: refine failed: {e}")
-
-        print(f"DEBUG: Generated {len(quiz_json.get('questions', []))} questions from text input")
-        return JSONResponse(content=quiz_json)
+        logger.info("Generated quiz from text", extra={"questions": len(quiz_json.get("questions", []))})
+        return _quiz_response(quiz_json, "bypass" if fresh else "miss")
     except HTTPException:
         raise
     except Exception as e:
-        print(f"ERROR: Unhandled in /quiz/generate-text: {e}")
+        logger.exception("Unhandled error in /quiz/generate-text")
         raise HTTPException(status_code=500, detail=f"Error generating from text: {str(e)}")
+
+
+@router.get("/documents/{content_hash}/ingestion")
+async def get_ingestion_status(
+    content_hash: str,
+    db: Session = Depends(get_db),
+    current_user: AuthenticatedUser = Depends(get_current_active_user)
+):
+    """Indexing progress of an uploaded document (its hash is the upload's X-Document-Hash header)."""
+    job = await run_in_threadpool(ingestion.get_job, db, content_hash)
+    index_state = await run_in_threadpool(document_services.get_index_state, db, content_hash)
+    if job is None and index_state is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    indexed_at = index_state.indexed_at if index_state else None
+    if job is None:
+        # Indexed before ingestion jobs existed, or never queued
+        status = "done" if indexed_at else "not_queued"
+        chunk_count = index_state.chunk_count or 0
+        return {"content_hash": content_hash, "status": status, "attempts": 0,
+                "chunks_done": chunk_count, "chunks_total": index_state.chunk_count,
+                "last_error": None, "indexed_at": indexed_at}
+    return {
+        "content_hash": content_hash,
+        "status": job.status,
+        "attempts": job.attempts,
+        "chunks_done": job.chunks_done,
+        "chunks_total": job.chunks_total,
+        "last_error": job.last_error,
+        "indexed_at": indexed_at,
+    }
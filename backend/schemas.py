@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, EmailStr, Field, field_validator
 from typing import List, Optional
 from datetime import datetime
 
@@ -29,7 +29,14 @@ class QuizBase(BaseModel):
     questions: List[Question]
 
 class QuizCreate(QuizBase):
-    pass
+    @field_validator("questions")
+    @classmethod
+    def question_ids_unique(cls, questions: List[Question]) -> List[Question]:
+        # quiz_questions is unique on (quiz_id, question_id)
+        ids = [q.id for q in questions]
+        if len(set(ids)) != len(ids):
+            raise ValueError("duplicate question id")
+        return questions
 
 class Quiz(QuizBase):
     id: int
@@ -38,6 +45,17 @@ class Quiz(QuizBase):
     class Config:
         from_attributes = True  # Pydantic V2 (replaces orm_mode)
 
+class QuizSummary(BaseModel):
+    id: int
+    title: str
+    category: str
+    created_at: datetime
+    question_count: int
+    questions: Optional[List[Question]] = None  # Only populated with include=details
+
+    class Config:
+        from_attributes = True
+
 class QuizAttemptBase(BaseModel):
     quiz_id: int
     score: int
@@ -83,6 +101,13 @@ class EthicalConflictExplanation(BaseModel):
     real_world_parallels: List[str]
     explanation: str
 
+class QuestionStats(BaseModel):
+    question_id: int
+    question_text: str
+    attempts: int
+    correct: int
+    accuracy: float
+
 class EthicalBiasProfile(BaseModel):
     user_id: int
     primary_framework: str  # e.g., "Utilitarian", "Deontological", "Virtue Ethics"
@@ -1,10 +1,14 @@
 from typing import Dict, Any, List
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from quizzes import models as quiz_models
 import numpy as np
 from sklearn.linear_model import LinearRegression
 from datetime import datetime, timedelta
 from collections import defaultdict
+from types import SimpleNamespace
 
 
 def _mastery_level(acc: float) -> str:
@@ -17,15 +21,86 @@ def _mastery_level(acc: float) -> str:
     return "Needs Practice"
 
 
+def _attempts_statement(user_id: int):
+    # Only the columns the analytics use; answer_details is never needed here
+    return (
+        select(
+            quiz_models.QuizAttempt.id,
+            quiz_models.QuizAttempt.quiz_id,
+            quiz_models.QuizAttempt.score,
+            quiz_models.QuizAttempt.total,
+            quiz_models.QuizAttempt.accuracy,
+            quiz_models.QuizAttempt.timestamp,
+        )
+        .where(quiz_models.QuizAttempt.user_id == user_id)
+        .order_by(quiz_models.QuizAttempt.timestamp.asc(), quiz_models.QuizAttempt.id.asc())
+    )
+
+
+def _categories_statement(quiz_ids: List[int]):
+    return select(quiz_models.Quiz.id, quiz_models.Quiz.category).where(quiz_models.Quiz.id.in_(quiz_ids))
+
+
+def _rollups_statement(user_id: int):
+    # Weekly aggregates of attempts whose partitions were compacted away
+    return (
+        select(quiz_models.QuizAttemptRollup)
+        .where(quiz_models.QuizAttemptRollup.user_id == user_id)
+        .order_by(quiz_models.QuizAttemptRollup.week_start.asc(), quiz_models.QuizAttemptRollup.category.asc())
+    )
+
+
 def compute_user_analytics(db: Session, user_id: int) -> Dict[str, Any]:
-    attempts: List[quiz_models.QuizAttempt] = (
-        db.query(quiz_models.QuizAttempt)
-        .filter(quiz_models.QuizAttempt.user_id == user_id)
-        .order_by(quiz_models.QuizAttempt.timestamp.asc())
-        .all()
+    attempts = db.execute(_attempts_statement(user_id)).all()
+    rollups = db.execute(_rollups_statement(user_id)).scalars().all()
+    quiz_ids = list({a.quiz_id for a in attempts})
+    quizzes = db.execute(_categories_statement(quiz_ids)).all() if quiz_ids else []
+    return build_user_analytics(attempts, {q.id: (q.category or "Uncategorized") for q in quizzes}, rollups)
+
+
+async def compute_user_analytics_async(db: AsyncSession, user_id: int) -> Dict[str, Any]:
+    attempts = (await db.execute(_attempts_statement(user_id))).all()
+    rollups = (await db.execute(_rollups_statement(user_id))).scalars().all()
+    quiz_ids = list({a.quiz_id for a in attempts})
+    quizzes = (await db.execute(_categories_statement(quiz_ids))).all() if quiz_ids else []
+    id_to_cat = {q.id: (q.category or "Uncategorized") for q in quizzes}
+    # The numpy / sklearn work is CPU-bound; keep it off the event loop
+    return await run_in_threadpool(build_user_analytics, attempts, id_to_cat, rollups)
+
+
+def _rollup_point(rollup) -> SimpleNamespace:
+    """One analytics data point standing in for a week of compacted attempts in one category."""
+    return SimpleNamespace(
+        quiz_id=None,
+        category=rollup.category,
+        score=rollup.score_sum,
+        total=rollup.total_sum,
+        accuracy=rollup.accuracy_sum / rollup.attempts,
+        timestamp=rollup.week_start,
+        weight=rollup.attempts,
+        accuracy_sum=rollup.accuracy_sum,
+        accuracy_sq_sum=rollup.accuracy_sq_sum,
+        accuracy_min=rollup.accuracy_min,
+        accuracy_max=rollup.accuracy_max,
+        histogram=rollup.accuracy_histogram or {},
     )
 
-    if not attempts:
+
+def _mean(values, weights=None) -> float:
+    return float(np.mean(values)) if weights is None else float(np.average(values, weights=weights))
+
+
+def build_user_analytics(attempts: List[Any], id_to_cat: Dict[int, str], rollups: List[Any] = ()) -> Dict[str, Any]:
+    """
+    Compute the analytics payload from a user's attempts (oldest first) and a quiz_id -> category map.
+
+    rollups are weekly aggregates of compacted attempts. Each becomes one point
+    weighted by its attempt count, ahead of the raw attempts; means, standard
+    deviation, totals and the score histogram stay exact, while the median and
+    quartiles treat a rollup as its mean. Without rollups the result is the same
+    as computing from raw attempts alone.
+    """
+    if not attempts and not rollups:
         return {
             "has_data": False,
             "trend_slope": 0.0,
@@ -70,36 +145,59 @@ def compute_user_analytics(db: Session, user_id: int) -> Dict[str, Any]:
             }
         }
 
+    # Rollups are all older than the raw attempts kept in the table
+    attempts = [_rollup_point(r) for r in rollups] + list(attempts)
+
+    def category_of(a) -> str:
+        return getattr(a, "category", None) or id_to_cat.get(a.quiz_id, "Uncategorized")
+
+    def accuracy_sum(a) -> float:
+        return getattr(a, "accuracy_sum", a.accuracy)
+
+    def weight_of(a) -> int:
+        return getattr(a, "weight", 1)
+
+    weights = np.array([weight_of(a) for a in attempts], dtype=float) if rollups else None
+    total_weight = sum(weight_of(a) for a in attempts)
+
     accuracies = np.array([a.accuracy for a in attempts], dtype=float)
 
     # Trend via linear regression
     x = np.arange(len(accuracies)).reshape(-1, 1)
     y = accuracies.reshape(-1, 1)
     try:
-        model = LinearRegression().fit(x, y)
+        model = LinearRegression().fit(x, y, sample_weight=weights)
         slope = float(model.coef_[0][0])
     except Exception:
         slope = 0.0
 
     # Rolling average (last 10)
     N = min(10, len(accuracies))
-    rolling_avg = float(np.mean(accuracies[-N:])) if N > 0 else 0.0
+    rolling_avg = _mean(accuracies[-N:], weights[-N:] if rollups else None) if N > 0 else 0.0
 
     # Volatility
-    volatility = float(np.std(accuracies)) if len(accuracies) > 1 else 0.0
+    if rollups:
+        # Exact pooled standard deviation from the stored sums
+        mean_accuracy = sum(accuracy_sum(a) for a in attempts) / total_weight
+        mean_square = sum(getattr(a, "accuracy_sq_sum", a.accuracy * a.accuracy) for a in attempts) / total_weight
+        volatility = float(np.sqrt(max(0.0, mean_square - mean_accuracy ** 2))) if total_weight > 1 else 0.0
+    else:
+        volatility = float(np.std(accuracies)) if len(accuracies) > 1 else 0.0
 
     # Last, best, worst
     last_accuracy = float(accuracies[-1])
-    best_idx = int(np.argmax(accuracies))
-    worst_idx = int(np.argmin(accuracies))
+    best_values = np.array([getattr(a, "accuracy_max", a.accuracy) for a in attempts], dtype=float)
+    worst_values = np.array([getattr(a, "accuracy_min", a.accuracy) for a in attempts], dtype=float)
+    best_idx = int(np.argmax(best_values))
+    worst_idx = int(np.argmin(worst_values))
     best_attempt = attempts[best_idx]
     worst_attempt = attempts[worst_idx]
 
     # Improvement percentage over recent window vs previous window
     half = len(accuracies) // 2
     if half > 0:
-        prev_mean = float(np.mean(accuracies[:half]))
-        recent_mean = float(np.mean(accuracies[half:]))
+        prev_mean = _mean(accuracies[:half], weights[:half] if rollups else None)
+        recent_mean = _mean(accuracies[half:], weights[half:] if rollups else None)
         denom = prev_mean if prev_mean != 0 else 1.0
         improvement_pct_recent = float(((recent_mean - prev_mean) / denom) * 100.0)
     else:
@@ -110,20 +208,12 @@ def compute_user_analytics(db: Session, user_id: int) -> Dict[str, Any]:
     consistency_score = float(max(0.0, min(100.0, 100.0 - (volatility / 35.0) * 100.0)))
 
     # Category accuracy
-    quiz_ids = list({a.quiz_id for a in attempts})
-    quizzes = (
-        db.query(quiz_models.Quiz)
-        .filter(quiz_models.Quiz.id.in_(quiz_ids))
-        .all()
-    )
-    id_to_cat = {q.id: (q.category or "Uncategorized") for q in quizzes}
-
     cat_stats: Dict[str, Dict[str, float]] = {}
     for a in attempts:
-        cat = id_to_cat.get(a.quiz_id, "Uncategorized")
+        cat = category_of(a)
         stat = cat_stats.setdefault(cat, {"sum": 0.0, "n": 0})
-        stat["sum"] += a.accuracy
-        stat["n"] += 1
+        stat["sum"] += accuracy_sum(a)
+        stat["n"] += weight_of(a)
 
     category_accuracy = {k: (v["sum"] / v["n"]) for k, v in cat_stats.items() if v["n"] > 0}
     mastery_by_category = {k: _mastery_level(v) for k, v in category_accuracy.items()}
@@ -178,6 +268,10 @@ def compute_user_analytics(db: Session, user_id: int) -> Dict[str, Any]:
         "0-20": 0, "21-40": 0, "41-60": 0, "61-80": 0, "81-100": 0
     }
     for a in attempts:
+        if hasattr(a, "histogram"):
+            for label, count in a.histogram.items():
+                score_ranges[label] = score_ranges.get(label, 0) + int(count)
+            continue
         acc = a.accuracy
         if acc <= 20:
             score_ranges["0-20"] += 1
@@ -191,7 +285,7 @@ def compute_user_analytics(db: Session, user_id: int) -> Dict[str, Any]:
             score_ranges["81-100"] += 1
     
     score_distribution = [
-        {"range": k, "count": v, "percentage": round((v / len(attempts)) * 100, 1) if attempts else 0}
+        {"range": k, "count": v, "percentage": round((v / total_weight) * 100, 1) if attempts else 0}
         for k, v in score_ranges.items()
     ]
     
@@ -216,10 +310,10 @@ def compute_user_analytics(db: Session, user_id: int) -> Dict[str, Any]:
                 max(0, int((a.timestamp - first_date).days / 7))
             )
             week_label = weeks[week_idx].strftime("%Y-%m-%d")
-            cat = id_to_cat.get(a.quiz_id, "Uncategorized")
+            cat = category_of(a)
             
-            heatmap_data[cat][week_label] += a.accuracy
-            heatmap_counts[cat][week_label] += 1
+            heatmap_data[cat][week_label] += accuracy_sum(a)
+            heatmap_counts[cat][week_label] += weight_of(a)
         
         # Calculate averages
         performance_heatmap = []
@@ -266,7 +360,7 @@ def compute_user_analytics(db: Session, user_id: int) -> Dict[str, Any]:
     # 6. Category Progress Over Time (Multi-line chart)
     category_progress = defaultdict(list)
     for a in attempts:
-        cat = id_to_cat.get(a.quiz_id, "Uncategorized")
+        cat = category_of(a)
         category_progress[cat].append({
             "timestamp": a.timestamp.isoformat(),
             "accuracy": float(a.accuracy)
@@ -282,11 +376,11 @@ def compute_user_analytics(db: Session, user_id: int) -> Dict[str, Any]:
     
     # 7. Performance Metrics Summary
     performance_metrics = {
-        "average_accuracy": round(float(np.mean(accuracies)), 2),
+        "average_accuracy": round(_mean(accuracies, weights), 2),
         "median_accuracy": round(float(np.median(accuracies)), 2),
-        "std_deviation": round(float(np.std(accuracies)), 2),
-        "min_accuracy": round(float(np.min(accuracies)), 2),
-        "max_accuracy": round(float(np.max(accuracies)), 2),
+        "std_deviation": round(volatility if rollups else float(np.std(accuracies)), 2),
+        "min_accuracy": round(float(np.min(worst_values)), 2),
+        "max_accuracy": round(float(np.max(best_values)), 2),
         "quartile_25": round(float(np.percentile(accuracies, 25)), 2),
         "quartile_75": round(float(np.percentile(accuracies, 75)), 2),
         "total_questions_answered": sum(a.total for a in attempts),
@@ -303,16 +397,16 @@ def compute_user_analytics(db: Session, user_id: int) -> Dict[str, Any]:
         "weak_categories": weak_categories,
         "category_accuracy": category_accuracy,
         "mastery_by_category": mastery_by_category,
-        "attempts_count": len(attempts),
+        "attempts_count": total_weight,
         "last_accuracy": last_accuracy,
         "best_attempt": {
             "quiz_id": best_attempt.quiz_id,
-            "accuracy": float(best_attempt.accuracy),
+            "accuracy": float(best_values[best_idx]),
             "timestamp": best_attempt.timestamp.isoformat(),
         },
         "worst_attempt": {
             "quiz_id": worst_attempt.quiz_id,
-            "accuracy": float(worst_attempt.accuracy),
+            "accuracy": float(worst_values[worst_idx]),
             "timestamp": worst_attempt.timestamp.isoformat(),
         },
         "improvement_pct_recent": improvement_pct_recent,
@@ -0,0 +1,481 @@
+"""
+Approximate nearest-neighbour search with an IVF-PQ index in NumPy, used by
+retrieval_service when RETRIEVAL_BACKEND=ivfpq.
+
+How vectors are stored:
+- Each vector is assigned to the nearest of ANN_NLIST coarse centroids
+  (its inverted list).
+- Its residual from that centroid is compressed to ANN_PQ_M one-byte codes
+  by product quantisation. The residual is cut into ANN_PQ_M sub-vectors,
+  and each is replaced by the nearest of 256 learned centroids.
+- A chunk then costs ANN_PQ_M bytes instead of 4 * dim.
+
+How a query works:
+- It scans the ANN_NPROBE lists nearest to it.
+- Codes are scored by table lookups. The per-list part of the tables is
+  precomputed at training time, so a probe costs no arithmetic beyond
+  the lookups.
+- nprobe is the recall/latency knob: nprobe = nlist scans every list.
+
+Training:
+- There is nothing to train the quantisers on until ANN_TRAIN_SIZE
+  vectors have been added. Until then, vectors are kept raw and searched
+  exactly.
+- The add that reaches the threshold trains on everything so far and
+  encodes it.
+
+Labels:
+- Every entry carries an integer label, the document it came from.
+- Adding a label again replaces its entries.
+- A search limited to labels scores exactly those labels' entries,
+  wherever they are.
+
+Persistence:
+- save() publishes every array as .npy in a new versioned snapshot under
+  ANN_INDEX_DIR (see services/snapshots.py). That base is never modified.
+- Each later add is appended to the current snapshot as a small delta
+  segment (delta-00000001.npz, ...): the new entries, and the label they
+  replace. Replaced entries are masked by deletion bitmaps kept in memory,
+  so an add costs the size of the document, not of the corpus.
+- Once the delta entries and the dead base entries pass ANN_DELTA_FRACTION
+  of the base, the next add compacts everything into a new snapshot.
+- load() memory-maps a snapshot read-only, so a worker starts without
+  reading the index into memory, and all workers share its pages. It then
+  applies the snapshot's segments. Readers pick up new segments as they
+  appear, without reloading the base.
+- Writers in different processes serialise on a lock file. Each catches up
+  with the current snapshot and its segments before adding to it.
+"""
+import copy
+import json
+import mmap
+import os
+import threading
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from sklearn.cluster import KMeans
+
+from services import snapshots
+
+ANN_INDEX_DIR = os.getenv("ANN_INDEX_DIR", "db/ann_index")
+ANN_NLIST = int(os.getenv("ANN_NLIST", "256"))
+ANN_PQ_M = int(os.getenv("ANN_PQ_M", "64"))
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+ANN_TRAIN_SIZE = int(os.getenv("ANN_TRAIN_SIZE", "10000"))
+# Delta and dead entries, as a fraction of the base, that trigger a compaction
+ANN_DELTA_FRACTION = float(os.getenv("ANN_DELTA_FRACTION", "0.25"))
+PQ_CENTROIDS = 256  # One byte per code
+
+_DELTA_PREFIX = "delta-"
+
+
+class AnnHit(NamedTuple):
+    distance: float
+    label: int
+    position: int  # Order of the entry within its label when it was added
+    payload: bytes
+
+
+def _kmeans(data: np.ndarray, clusters: int) -> np.ndarray:
+    return KMeans(n_clusters=clusters, n_init=1, max_iter=20, random_state=0).fit(data).cluster_centers_.astype(np.float32)
+
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # ||v - c||^2 without the ||v||^2 term, which does not change the argmin
+    scores = (centroids * centroids).sum(axis=1) - 2 * vectors @ centroids.T
+    return scores.argmin(axis=1).astype(np.int32)
+
+
+class _Entries:
+    """Column arrays of index entries; vectors holds PQ codes once trained and raw vectors before."""
+
+    def __init__(self, vectors: np.ndarray, list_ids: np.ndarray, labels: np.ndarray,
+                 positions: np.ndarray, payloads: List[bytes]):
+        self.vectors = vectors
+        self.list_ids = list_ids
+        self.labels = labels
+        self.positions = positions
+        self.payloads = payloads
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def select(self, keep: np.ndarray) -> "_Entries":
+        return _Entries(
+            np.asarray(self.vectors[keep]), np.asarray(self.list_ids[keep]), np.asarray(self.labels[keep]),
+            np.asarray(self.positions[keep]), [self.payloads[i] for i in np.flatnonzero(keep)],
+        )
+
+    @staticmethod
+    def concat(parts: List["_Entries"], width: int, dtype) -> "_Entries":
+        parts = [p for p in parts if len(p)]
+        if not parts:
+            return _Entries(np.zeros((0, width), dtype=dtype), np.zeros(0, np.int32), np.zeros(0, np.int32),
+                            np.zeros(0, np.int32), [])
+        return _Entries(
+            np.concatenate([np.asarray(p.vectors) for p in parts]),
+            np.concatenate([np.asarray(p.list_ids) for p in parts]),
+            np.concatenate([np.asarray(p.labels) for p in parts]),
+            np.concatenate([np.asarray(p.positions) for p in parts]),
+            [payload for p in parts for payload in p.payloads],
+        )
+
+
+class _Payloads:
+    """Read-only view of payload blobs stored back to back in a memory-mapped file."""
+
+    def __init__(self, path: str, offsets: np.ndarray):
+        self.offsets = offsets
+        with open(path, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> bytes:
+        return bytes(self._data[self.offsets[i]:self.offsets[i + 1]])
+
+    def __iter__(self) -> Iterator[bytes]:
+        return (self[i] for i in range(len(self)))
+
+
+class IVFPQIndex:
+    def __init__(self, dim: int, nlist: int = ANN_NLIST, m: int = ANN_PQ_M, train_size: int = ANN_TRAIN_SIZE):
+        if dim % m:
+            raise ValueError(f"dim {dim} is not divisible into {m} sub-vectors")
+        self.dim = dim
+        self.nlist = nlist
+        self.m = m
+        self.train_size = max(train_size, nlist, PQ_CENTROIDS)
+        self.centroids: Optional[np.ndarray] = None  # (nlist, dim)
+        self.codebooks: Optional[np.ndarray] = None  # (m, 256, dim / m)
+        self.list_terms: Optional[np.ndarray] = None  # (nlist, m, 256): ||code||^2 + 2 <centroid, code>
+        # Base entries are sorted by list (list_offsets); entries added since the last save are in the tail
+        self.base = _Entries.concat([], dim, np.float32)
+        self.list_offsets = np.zeros(1, np.int64)
+        self.tail = _Entries.concat([], dim, np.float32)
+        self.base_alive = np.zeros(0, dtype=bool)
+        self.keys: Dict[str, int] = {}  # Caller's names for labels, saved with the index
+        self.segments = 0  # Delta segments of the loaded snapshot applied so far
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def __len__(self) -> int:
+        return int(self.base_alive.sum()) + len(self.tail)
+
+    @property
+    def delta_size(self) -> int:
+        """Entries added since the base was written, plus base entries they replaced."""
+        return len(self.tail) + len(self.base) - int(self.base_alive.sum())
+
+    @property
+    def needs_training(self) -> bool:
+        return not self.trained and len(self) >= self.train_size
+
+    def _fork(self) -> "IVFPQIndex":
+        """A copy sharing the arrays, which are replaced rather than modified, so the original stays searchable."""
+        index = copy.copy(self)
+        index.keys = dict(self.keys)
+        return index
+
+    # ---- building ----
+
+    def _encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """PQ codes and list ids of vectors."""
+        list_ids = _nearest(vectors, self.centroids)
+        residuals = vectors - self.centroids[list_ids]
+        sub = self.dim // self.m
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = _nearest(residuals[:, j * sub:(j + 1) * sub], self.codebooks[j])
+        return codes, list_ids
+
+    def _train(self, vectors: np.ndarray) -> None:
+        self.centroids = _kmeans(vectors, self.nlist)
+        residuals = vectors - self.centroids[_nearest(vectors, self.centroids)]
+        sub = self.dim // self.m
+        self.codebooks = np.stack([_kmeans(residuals[:, j * sub:(j + 1) * sub], PQ_CENTROIDS) for j in range(self.m)])
+        code_norms = (self.codebooks ** 2).sum(axis=2)  # (m, 256)
+        centroid_dots = np.einsum("ljd,jcd->ljc", self.centroids.reshape(self.nlist, self.m, sub), self.codebooks)
+        self.list_terms = (code_norms[None] + 2 * centroid_dots).astype(np.float32)
+
+    def remove(self, label: int) -> None:
+        if len(self.base):
+            self.base_alive = self.base_alive & (np.asarray(self.base.labels) != label)
+        if len(self.tail):
+            self.tail = self.tail.select(self.tail.labels != label)
+
+    def entries(self, vectors: np.ndarray, label: int, payloads: Sequence[bytes]) -> _Entries:
+        """Entries for one label's vectors: PQ codes once trained, raw vectors before."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        positions = np.arange(len(vectors), dtype=np.int32)
+        labels = np.full(len(vectors), label, dtype=np.int32)
+        if self.trained:
+            codes, list_ids = self._encode(vectors)
+            return _Entries(codes, list_ids, labels, positions, list(payloads))
+        return _Entries(vectors, np.zeros(len(vectors), np.int32), labels, positions, list(payloads))
+
+    def append(self, label: int, part: _Entries) -> None:
+        """Replace label's entries with part."""
+        self.remove(label)
+        width, dtype = (self.m, np.uint8) if self.trained else (self.dim, np.float32)
+        self.tail = _Entries.concat([self.tail, part], width, dtype)
+
+    def train(self) -> None:
+        """Train the quantisers on every entry so far and encode them all into the base."""
+        everything = self._merged()
+        self._train(np.asarray(everything.vectors))
+        everything.vectors, everything.list_ids = self._encode(np.asarray(everything.vectors))
+        self._set_base(everything)
+
+    def add(self, vectors: np.ndarray, label: int, payloads: Sequence[bytes]) -> None:
+        """Add (or replace) the vectors of one label, with a payload per vector."""
+        self.append(label, self.entries(vectors, label, payloads))
+        if self.needs_training:
+            self.train()
+
+    def _merged(self) -> _Entries:
+        width, dtype = (self.m, np.uint8) if self.trained else (self.dim, np.float32)
+        return _Entries.concat([self.base.select(self.base_alive), self.tail], width, dtype)
+
+    def _set_base(self, entries: _Entries) -> None:
+        order = np.argsort(entries.list_ids, kind="stable")
+        self.base = _Entries(
+            np.asarray(entries.vectors)[order], np.asarray(entries.list_ids)[order], np.asarray(entries.labels)[order],
+            np.asarray(entries.positions)[order], [entries.payloads[i] for i in order],
+        )
+        counts = np.bincount(self.base.list_ids, minlength=self.nlist if self.trained else 1)
+        self.list_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        self.base_alive = np.ones(len(self.base), dtype=bool)
+        width, dtype = (self.m, np.uint8) if self.trained else (self.dim, np.float32)
+        self.tail = _Entries.concat([], width, dtype)
+
+    # ---- searching ----
+
+    def _distances(self, entries: _Entries, rows: np.ndarray, query: np.ndarray, coarse: Optional[np.ndarray],
+                   query_terms: Optional[np.ndarray]) -> np.ndarray:
+        vectors = np.asarray(entries.vectors[rows])
+        if not self.trained:
+            diff = vectors - query
+            return (diff * diff).sum(axis=1)
+        list_ids = np.asarray(entries.list_ids[rows])
+        j = np.arange(self.m)
+        # ||q - c - r||^2 = ||q - c||^2 + sum_j (||r_j||^2 + 2 <c_j, r_j>) - 2 sum_j <q_j, r_j>
+        return coarse[list_ids] + self.list_terms[list_ids[:, None], j, vectors].sum(axis=1) \
+            + query_terms[j, vectors].sum(axis=1)
+
+    def search(self, query: np.ndarray, k: int = 10, nprobe: int = ANN_NPROBE,
+               labels: Optional[Sequence[int]] = None) -> List[AnnHit]:
+        """The k nearest entries to query: from the nprobe nearest lists, or from every entry of labels."""
+        query = np.asarray(query, dtype=np.float32)
+        coarse = query_terms = None
+        if self.trained:
+            coarse = ((self.centroids - query) ** 2).sum(axis=1)
+            sub = self.dim // self.m
+            query_terms = -2 * np.einsum("jd,jcd->jc", query.reshape(self.m, sub), self.codebooks)
+
+        candidates = []
+        for entries, alive, sorted_by_list in ((self.base, self.base_alive, True), (self.tail, None, False)):
+            if not len(entries):
+                continue
+            if labels is not None:
+                keep = np.isin(entries.labels, labels)
+            elif self.trained and sorted_by_list:
+                probe = np.argsort(coarse)[:nprobe]
+                keep = np.zeros(len(entries), dtype=bool)
+                for l in probe:
+                    keep[self.list_offsets[l]:self.list_offsets[l + 1]] = True
+            elif self.trained:
+                keep = np.isin(entries.list_ids, np.argsort(coarse)[:nprobe])
+            else:
+                keep = np.ones(len(entries), dtype=bool)
+            if alive is not None:
+                keep &= alive
+            rows = np.flatnonzero(keep)
+            if len(rows):
+                candidates.append((entries, rows, self._distances(entries, rows, query, coarse, query_terms)))
+
+        if not candidates:
+            return []
+        distances = np.concatenate([dist for _, _, dist in candidates])
+        best = np.argpartition(distances, k)[:k] if len(distances) > k else np.arange(len(distances))
+        best = best[np.argsort(distances[best], kind="stable")]
+        # Map positions in the concatenation back to (entries, row)
+        starts = np.cumsum([0] + [len(rows) for _, rows, _ in candidates])
+        hits = []
+        for i in best:
+            part = int(np.searchsorted(starts, i, side="right")) - 1
+            entries, rows, _ = candidates[part]
+            row = int(rows[i - starts[part]])
+            hits.append(AnnHit(float(distances[i]), int(entries.labels[row]), int(entries.positions[row]), entries.payloads[row]))
+        return hits
+
+    # ---- persistence ----
+
+    def _write(self, path: str) -> None:
+        arrays = {
+            "vectors": np.asarray(self.base.vectors), "list_ids": self.base.list_ids, "labels": self.base.labels,
+            "positions": self.base.positions, "list_offsets": self.list_offsets,
+            "payload_offsets": np.concatenate(([0], np.cumsum([len(p) for p in self.base.payloads]))).astype(np.int64),
+        }
+        if self.trained:
+            arrays.update(centroids=self.centroids, codebooks=self.codebooks, list_terms=self.list_terms)
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), array)
+        with open(os.path.join(path, "payloads.bin"), "wb") as f:
+            for payload in self.base.payloads:
+                f.write(payload)
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "nlist": self.nlist, "m": self.m, "train_size": self.train_size,
+                       "trained": self.trained, "keys": self.keys}, f)
+
+    def save(self, directory: str) -> snapshots.Snapshot:
+        """Publish everything as a new snapshot in directory."""
+        self._set_base(self._merged())
+        self.segments = 0
+        return snapshots.publish(directory, self._write)
+
+    def save_delta(self, path: str, key: str, label: int, part: _Entries) -> None:
+        """Write part, the entries just appended for key, as the next delta segment of the snapshot at path."""
+        staging = os.path.join(path, f".{_DELTA_PREFIX}{os.getpid()}-{threading.get_ident()}")
+        try:
+            with open(staging, "wb") as f:
+                np.savez(
+                    f, vectors=np.asarray(part.vectors), list_ids=part.list_ids, labels=part.labels,
+                    positions=part.positions,
+                    payload_offsets=np.concatenate(([0], np.cumsum([len(p) for p in part.payloads]))).astype(np.int64),
+                    payloads=np.frombuffer(b"".join(part.payloads), dtype=np.uint8),
+                    key=np.array(key), label=np.array(label),
+                )
+            # Complete segments appear under their final name only, in order
+            os.rename(staging, os.path.join(path, f"{_DELTA_PREFIX}{self.segments + 1:08d}.npz"))
+        except BaseException:
+            if os.path.exists(staging):
+                os.unlink(staging)
+            raise
+        self.segments += 1
+
+    def with_deltas(self, path: str) -> "IVFPQIndex":
+        """This index with any delta segments of the snapshot at path it has not applied yet; self if none."""
+        names = sorted(name for name in os.listdir(path) if name.startswith(_DELTA_PREFIX))[self.segments:]
+        if not names:
+            return self
+        index = self._fork()
+        for name in names:
+            with np.load(os.path.join(path, name)) as data:
+                offsets, blob = data["payload_offsets"], data["payloads"].tobytes()
+                part = _Entries(data["vectors"], data["list_ids"], data["labels"], data["positions"],
+                                [blob[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)])
+                label = int(data["label"])
+                index.keys[str(data["key"])] = label
+            index.append(label, part)
+            index.segments += 1
+        return index
+
+    @classmethod
+    def load(cls, path: str) -> "IVFPQIndex":
+        """Memory-map the snapshot at path read-only."""
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        index = cls(meta["dim"], meta["nlist"], meta["m"], meta["train_size"])
+        index.keys = meta["keys"]
+
+        def array(name):
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+
+        if meta["trained"]:
+            # Mapped like the codes, so every worker shares one copy of the tables
+            index.centroids = array("centroids")
+            index.codebooks = array("codebooks")
+            index.list_terms = array("list_terms")
+        index.base = _Entries(array("vectors"), array("list_ids"), array("labels"), array("positions"),
+                              _Payloads(os.path.join(path, "payloads.bin"), array("payload_offsets")))
+        index.list_offsets = array("list_offsets")
+        index.base_alive = np.ones(len(index.base), dtype=bool)
+        width, dtype = (index.m, np.uint8) if index.trained else (index.dim, np.float32)
+        index.tail = _Entries.concat([], width, dtype)
+        return index.with_deltas(path)
+
+
+class AnnStore:
+    """
+    The IVF-PQ index under ANN_INDEX_DIR, with string keys (document hashes)
+    mapped to labels. Searches use the current snapshot, reloading it whenever
+    another process has published a newer one.
+    """
+
+    def __init__(self, directory: str = ANN_INDEX_DIR, dim: int = 0, nlist: int = ANN_NLIST, m: int = ANN_PQ_M,
+                 train_size: int = ANN_TRAIN_SIZE):
+        self.directory = directory
+        self.dim = dim
+        self.nlist = nlist
+        self.m = m
+        self.train_size = train_size
+        self._index: Optional[IVFPQIndex] = None
+        self._version: Optional[str] = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _refresh(self) -> IVFPQIndex:
+        snapshot = snapshots.current(self.directory)
+        try:
+            if snapshot is None:
+                if self._index is None:
+                    self._index = IVFPQIndex(self.dim, self.nlist, self.m, self.train_size)
+            elif self._index is None or snapshot.version != self._version:
+                self._index = IVFPQIndex.load(snapshot.path)
+                self._version = snapshot.version
+            else:
+                self._index = self._index.with_deltas(snapshot.path)
+        except FileNotFoundError:
+            if self._index is None:
+                raise
+            # Pruned while we were opening it; a newer one is current, picked up next time
+        return self._index
+
+    def add(self, key: str, vectors: np.ndarray, payloads: Sequence[bytes]) -> None:
+        with snapshots.lock(self.directory):
+            # Caught up with every other writer; a fork, so the index searches use is never modified
+            with self._lock:
+                index = self._refresh()._fork()
+                version = self._version
+            label = index.keys.setdefault(key, len(index.keys))
+            part = index.entries(vectors, label, payloads)
+            index.append(label, part)
+            if version is None or index.needs_training \
+                    or index.delta_size > ANN_DELTA_FRACTION * max(len(index.base), index.train_size):
+                if index.needs_training:
+                    index.train()
+                published = index.save(self.directory)
+                index, version = IVFPQIndex.load(published.path), published.version
+            else:
+                index.save_delta(os.path.join(self.directory, version), key, label, part)
+            with self._lock:
+                self._index = index
+                self._version = version
+
+    def search(self, query: np.ndarray, k: int, keys: Optional[Sequence[str]] = None,
+               nprobe: int = ANN_NPROBE) -> List[AnnHit]:
+        with self._lock:
+            index = self._refresh()
+        labels = None
+        if keys is not None:
+            labels = [index.keys[key] for key in keys if key in index.keys]
+            if not labels:
+                return []
+        return index.search(query, k, nprobe=nprobe, labels=labels)
+
+
+_store: Optional[AnnStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store(dim: int) -> AnnStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = AnnStore(dim=dim)
+        return _store
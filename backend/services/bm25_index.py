@@ -0,0 +1,231 @@
+"""
+In-process BM25 retrieval over a sparse inverted index, used instead of
+Chroma when RETRIEVAL_BACKEND=bm25.
+
+Text is tokenised into TERM_BUCKETS hashed term ids, so no vocabulary is
+kept. Each indexed document is one segment under BM25_INDEX_DIR/<content
+hash>, published as a versioned snapshot (services/snapshots.py). A segment
+is built straight from the sparse term-count matrix, with no dense step, and
+holds these arrays:
+
+    terms.npy         sorted term ids present in the segment
+    offsets.npy       postings of terms[i] are [offsets[i], offsets[i + 1])
+    postings.npy      chunk numbers, grouped by term
+    frequencies.npy   term frequency of each posting
+    lengths.npy       tokens per chunk
+    text.bin          chunk texts, UTF-8, delimited by text_offsets.npy
+    meta.json         source name and chunk ids
+
+All arrays are memory-mapped read-only. Re-indexing a document publishes a
+new snapshot of its segment and swaps the document's CURRENT pointer, so
+readers never see it half written or missing. Every process notices new or
+replaced segments the next time it searches.
+
+Corpus statistics (chunk count, average length, document frequencies) are
+summed at query time over the segments being searched, which is usually
+just the one document a quiz is generated from. Scores are accumulated per
+segment with numpy and the best top_k across segments are kept in a heap.
+"""
+import heapq
+import json
+import mmap
+import os
+import threading
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+
+from services import snapshots
+
+BM25_INDEX_DIR = os.getenv("BM25_INDEX_DIR", "db/bm25_index")
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+TERM_BUCKETS = 2 ** 20
+
+_analyzer = HashingVectorizer(n_features=TERM_BUCKETS, alternate_sign=False, norm=None, dtype=np.float32)
+_ARRAYS = ("terms", "offsets", "postings", "frequencies", "lengths", "text_offsets")
+
+
+class SearchHit(NamedTuple):
+    score: float
+    chunk_id: str
+    text: str
+
+
+class Segment:
+    """One document's chunks, memory-mapped read-only."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.source = meta["source"]
+        self.chunk_ids: List[str] = meta["chunk_ids"]
+        for name in _ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+        self.total_length = int(self.lengths.sum())
+        with open(os.path.join(path, "text.bin"), "rb") as f:
+            self._text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+    @property
+    def chunk_count(self) -> int:
+        return len(self.chunk_ids)
+
+    def find(self, term: int) -> Optional[Tuple[int, int]]:
+        """The postings range of term, or None if no chunk here contains it."""
+        i = int(np.searchsorted(self.terms, term))
+        if i == len(self.terms) or self.terms[i] != term:
+            return None
+        return int(self.offsets[i]), int(self.offsets[i + 1])
+
+    def text(self, chunk: int) -> str:
+        return bytes(self._text[self.text_offsets[chunk]:self.text_offsets[chunk + 1]]).decode("utf-8")
+
+
+def write_segment(directory: str, key: str, chunk_texts: List[str], source_name: str, chunk_ids: List[str]) -> str:
+    """Build the segment for key and publish it in place of any earlier one. Returns its path."""
+    counts = _analyzer.transform(chunk_texts)  # chunks x terms, CSR
+    by_term = counts.tocsc()
+    by_term.sort_indices()
+    present = np.flatnonzero(np.diff(by_term.indptr))
+    offsets = np.append(by_term.indptr[present], by_term.indptr[-1]).astype(np.int64)
+
+    encoded = [text.encode("utf-8") for text in chunk_texts]
+    arrays = {
+        "terms": present.astype(np.int32),
+        "offsets": offsets,
+        "postings": by_term.indices.astype(np.int32),
+        "frequencies": by_term.data.astype(np.float32),
+        "lengths": np.asarray(counts.sum(axis=1), dtype=np.float32).ravel(),
+        "text_offsets": np.concatenate(([0], np.cumsum([len(b) for b in encoded]))).astype(np.int64),
+    }
+
+    def write(path: str) -> None:
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), array)
+        with open(os.path.join(path, "text.bin"), "wb") as f:
+            for blob in encoded:
+                f.write(blob)
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"source": source_name, "chunk_ids": chunk_ids}, f)
+
+    return snapshots.publish(os.path.join(directory, key), write).path
+
+
+class BM25Index:
+    def __init__(self, directory: str = BM25_INDEX_DIR, k1: float = BM25_K1, b: float = BM25_B):
+        self.directory = directory
+        self.k1 = k1
+        self.b = b
+        self._segments: Dict[str, Tuple[str, Segment]] = {}  # key -> (snapshot version, segment)
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, key: str, chunk_texts: List[str], source_name: str, chunk_ids: List[str]) -> int:
+        """Index (or re-index) one document's chunks under key. Returns the chunk count."""
+        if chunk_texts:
+            write_segment(self.directory, key, chunk_texts, source_name, chunk_ids)
+        return len(chunk_texts)
+
+    def _load(self, key: str) -> Optional[Tuple[str, Segment]]:
+        snapshot = snapshots.current(os.path.join(self.directory, key))
+        if snapshot is None:
+            return None  # Not indexed (yet)
+        cached = self._segments.get(key)
+        if cached is not None and cached[0] == snapshot.version:
+            return cached
+        try:
+            return snapshot.version, Segment(snapshot.path)
+        except FileNotFoundError:
+            return cached  # Pruned while we were opening it; the newer one is picked up next time
+
+    def segments(self, keys: Optional[Sequence[str]] = None) -> List[Segment]:
+        """
+        Current segments, or only those for keys, loading any added or
+        replaced since they were last read.
+        """
+        with self._lock:
+            if keys is not None:
+                found = []
+                for key in dict.fromkeys(keys):
+                    loaded = self._load(key)
+                    if loaded:
+                        self._segments[key] = loaded
+                        found.append(loaded[1])
+                return found
+
+            seen = {}
+            for entry in os.scandir(self.directory):
+                if entry.name.startswith(".") or not entry.is_dir():
+                    continue
+                loaded = self._load(entry.name)
+                if loaded:
+                    seen[entry.name] = loaded
+            self._segments = seen
+            return [segment for _, segment in seen.values()]
+
+    def search(self, query: str, top_k: int = 3, keys: Optional[Sequence[str]] = None) -> List[SearchHit]:
+        """
+        The top_k chunks for query across all segments, or only the segments for
+        keys. Corpus statistics are taken over the segments searched.
+        """
+        counts = _analyzer.transform([query])
+        if counts.nnz == 0:
+            return []
+        terms, query_tf = counts.indices, counts.data
+        segments = self.segments(keys)
+        total_chunks = sum(s.chunk_count for s in segments)
+        if total_chunks == 0:
+            return []
+        avg_length = sum(s.total_length for s in segments) / total_chunks
+
+        # Postings ranges per segment, reused for the document frequencies and the scoring
+        ranges = [[s.find(int(t)) for t in terms] for s in segments]
+        doc_freq = np.zeros(len(terms))
+        for segment_ranges in ranges:
+            for j, found in enumerate(segment_ranges):
+                if found:
+                    doc_freq[j] += found[1] - found[0]
+        idf = np.log(1 + (total_chunks - doc_freq + 0.5) / (doc_freq + 0.5))
+        weights = idf * query_tf
+
+        heap: List[Tuple[float, int, int]] = []
+        for n, (segment, segment_ranges) in enumerate(zip(segments, ranges)):
+            if not any(segment_ranges):
+                continue
+            scores = np.zeros(segment.chunk_count, dtype=np.float64)
+            length_norm = self.k1 * (1 - self.b + self.b * np.asarray(segment.lengths) / avg_length)
+            for weight, found in zip(weights, segment_ranges):
+                if not found:
+                    continue
+                chunks = segment.postings[found[0]:found[1]]
+                tf = segment.frequencies[found[0]:found[1]]
+                # A chunk appears at most once per term's postings, so plain fancy-index add is exact
+                scores[chunks] += weight * tf * (self.k1 + 1) / (tf + length_norm[chunks])
+            candidates = np.flatnonzero(scores)
+            if len(candidates) > top_k:
+                candidates = candidates[np.argpartition(scores[candidates], -top_k)[-top_k:]]
+            for chunk in candidates:
+                item = (float(scores[chunk]), n, int(chunk))
+                if len(heap) < top_k:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+
+        return [
+            SearchHit(score, segments[n].chunk_ids[chunk], segments[n].text(chunk))
+            for score, n, chunk in sorted(heap, reverse=True)
+        ]
+
+
+_index: Optional[BM25Index] = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> BM25Index:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = BM25Index()
+        return _index
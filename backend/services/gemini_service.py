@@ -1,11 +1,22 @@
 import os
 from google import genai
 from dotenv import load_dotenv
-from .retrieval_service import retrieve_context
+from typing import Optional
+
+from .retrieval_service import document_query, retrieve_context
 
 # Load environment variables
 load_dotenv()
 
+# Part of the quiz generation cache key; bump it whenever these prompts, the model or the refinement constitution change
+PROMPT_VERSION = "2"
+
+MAX_QUESTIONS = 20
+
+def clamp_question_count(num_questions: Optional[int]) -> int:
+    """The number of questions the prompts actually ask for; also what the generation cache is keyed by."""
+    return max(1, min(int(num_questions or 10), MAX_QUESTIONS))
+
 def _get_configured_client():
     """Get a configured Gemini client, checking API key at runtime"""
     api_key = os.getenv("GEMINI_API_KEY")
@@ -26,12 +37,23 @@ def _level_guidance(level: str) -> str:
         return "Advanced level: nuanced scenarios, multi-step reasoning, strong distractors."
     return "Intermediate level: moderate difficulty, balanced distractors."
 
-def generate_quiz(text_iterator, query: str = "Generate a quiz from this text", level: str = "intermediate", num_questions: int = 10) -> str:
-    """Generate a multiple-choice quiz using Gemini"""
+def generate_quiz(
+    text_iterator,
+    query: Optional[str] = None,
+    level: str = "intermediate",
+    num_questions: int = 10,
+    document_hash: Optional[str] = None
+) -> str:
+    """
+    Generate a multiple-choice quiz using Gemini. Retrieval context comes only from
+    the indexed document document_hash, searched with query or, by default, with
+    the document's own key terms. Without a document_hash no context is retrieved.
+    """
+    pages = list(text_iterator)
     # Concatenate text from iterator, respecting context window limits
     full_text_list = []
     current_length = 0
-    for chunk in text_iterator:
+    for chunk in pages:
         if current_length + len(chunk) <= 4000:
             full_text_list.append(chunk)
             current_length += len(chunk)
@@ -42,15 +64,17 @@ def generate_quiz(text_iterator, query: str = "Generate a quiz from this text",
             break
     text_for_gemini = " ".join(full_text_list)
 
-    # Retrieve context from your notes/pdf retrieval system
-    context = retrieve_context(query)
+    # Retrieve context from this document's chunks in the retrieval index
+    context = ""
+    if document_hash:
+        context = retrieve_context(query or document_query(pages), [document_hash])
 
     # Get the client
     client = _get_configured_client()
 
     # Construct the prompt
     guidance = _level_guidance(level)
-    qn = max(1, min(int(num_questions or 10), 20))
+    qn = clamp_question_count(num_questions)
     prompt = f"""You are an educational quiz generator. Generate {qn} ethical multiple-choice questions from the following text.
 
 IMPORTANT CONSTITUTIONAL AI PRINCIPLES:
@@ -102,7 +126,7 @@ Continue until you produce {qn} questions. IMPORTANT: Only output the quiz in th
 def generate_quiz_from_text(text: str, level: str = "intermediate", num_questions: int = 10) -> str:
     client = _get_configured_client()
     guidance = _level_guidance(level)
-    qn = max(1, min(int(num_questions or 10), 20))
+    qn = clamp_question_count(num_questions)
     text_for_gemini = (text or "")[:8000]
     prompt = f"""You are an educational quiz generator. Generate {qn} ethical multiple-choice questions from the following text.
 
@@ -137,7 +161,7 @@ Continue until you produce {qn} questions."""
 def reformat_quiz_output(raw_text: str, num_questions: int = 10) -> str:
     """Ask Gemini to reformat an existing quiz-like text into strict A/B/C/D/Answer markup."""
     client = _get_configured_client()
-    qn = max(1, min(int(num_questions or 10), 20))
+    qn = clamp_question_count(num_questions)
     prompt = f"""Reformat the following content into EXACTLY the quiz format below for {qn} questions. If content is insufficient, output as many as possible but keep the format strictly.
 
 CONTENT:
@@ -1,89 +1,327 @@
+"""
+Parsing of generated quiz text into questions.
+
+The model is asked for this layout (gemini_service prompts):
+
+    1. Question text
+    A) Option
+    B) Option
+    C) Option
+    D) Option
+    Answer: A
+    Explanation: Brief explanation
+
+QuizParser reads it line by line in one pass, classifying each line with a
+single compiled pattern. Text can be fed in chunks of any size as it
+arrives; a question is complete when the next one starts or the input is
+closed. Question numbers are only recognised at the start of a line, and a
+number that does not follow the previous question (a wrapped line such as
+"19. century ...") continues the question instead of starting a new one.
+
+Each parsed question records its exact [start, end) character span in the
+input, a confidence between 0 and 1, and the diagnostics raised while
+reading it. Diagnostics are (line, code, message) records rather than log
+lines, so callers can count and report them.
+"""
 import re
+from collections import Counter
+from typing import List, NamedTuple, Optional, Tuple
+
+from utils.access_log import get_logger
+
+PLACEHOLDER_EXPLANATION = "This is a placeholder question."
+
+logger = get_logger("quiz_parser")
+
+_LINE = re.compile(r"""
+      (?:(?i:question|q)\s*)?(?P<number>\d{1,3})\s*[.):](?:\s+|$)(?P<question>.*)
+    | \(?(?P<letter>[A-D])[.)](?:\s+|$)(?P<option>.*)
+    | (?i:(?:correct\s+)?answer)\s*[:\-]\s*(?P<answer>.*)
+    | (?i:explanation)\s*[:\-]\s*(?P<explanation>.*)
+""", re.VERBOSE)
+# A letter alone ("B", "(b)", "B."), or one marked off from text ("B) text", "(B) text");
+# never a bare leading word, so "a consequentialist view" is not option A
+_ANSWER_LETTER = re.compile(r"\(?(?P<alone>[A-Da-d])\)?[.):]?|(?:\((?P<marked>[A-Da-d])\)|(?P<prefix>[A-Da-d])[.):])\s*(?P<text>.*)")
+
+# Checks behind a question's confidence, each worth an equal share
+_CHECKS = ("four_options", "answer_matches_option", "has_explanation", "in_sequence", "no_stray_lines")
+
+
+class Diagnostic(NamedTuple):
+    line: int  # 1-based line of the input
+    code: str
+    message: str
+
+
+class ParsedQuestion(NamedTuple):
+    number: int
+    question: str
+    options: Tuple[str, ...]
+    answer: str  # The correct option's text, or the answer as written if it names no option
+    explanation: str
+    start: int  # Character span of the question in the input
+    end: int
+    confidence: float
+    diagnostics: Tuple[Diagnostic, ...]
+
+    def as_dict(self, question_id: int) -> dict:
+        return {
+            "id": question_id,
+            "question": self.question,
+            "options": list(self.options),
+            "answer": self.answer,
+            "explanation": self.explanation,
+        }
+
+
+class _Draft:
+    """A question being read."""
+
+    def __init__(self, number: int, text: str, start: int, line: int, in_sequence: bool):
+        self.number = number
+        self.text = [text] if text else []
+        self.options: List[List[str]] = []
+        self.answer: Optional[str] = None
+        self.explanation: List[str] = []
+        self.start = start
+        self.end = start
+        self.line = line
+        self.in_sequence = in_sequence
+        self.stray_lines = 0
+        self.field = "question"  # Where an unmarked line is appended
+        self.diagnostics: List[Diagnostic] = []
+
+
+class QuizParser:
+    """
+    Incremental quiz parser.
+
+        parser = QuizParser()
+        for chunk in chunks:
+            questions.extend(parser.feed(chunk))
+        questions.extend(parser.close())
+
+    Questions missing their text, options or answer are dropped, with a
+    "dropped" diagnostic. All diagnostics are in parser.diagnostics.
+    """
+
+    def __init__(self):
+        self.diagnostics: List[Diagnostic] = []
+        self._pending = ""  # Incomplete last line of the input so far
+        self._offset = 0  # Input offset of _pending
+        self._line = 0
+        self._draft: Optional[_Draft] = None
+        self._last_number = 0
+        self._after_blank = False
+        self._closed = False
+
+    def feed(self, chunk: str) -> List[ParsedQuestion]:
+        """Read more input. Returns the questions it completed."""
+        if self._closed:
+            raise ValueError("QuizParser is closed")
+        done: List[ParsedQuestion] = []
+        lines = (self._pending + chunk).split("\n")
+        self._pending = lines.pop()
+        offset = self._offset
+        for raw in lines:
+            self._read_line(raw, offset, done)
+            offset += len(raw) + 1
+        self._offset = offset
+        return done
+
+    def close(self) -> List[ParsedQuestion]:
+        """Read the rest of the input. Returns the questions it completed, including the last."""
+        if self._closed:
+            return []
+        done: List[ParsedQuestion] = []
+        if self._pending:
+            self._read_line(self._pending, self._offset, done)
+            self._offset += len(self._pending)
+            self._pending = ""
+        self._finish(done)
+        self._closed = True
+        return done
+
+    def _diagnose(self, code: str, message: str) -> None:
+        diagnostic = Diagnostic(self._line, code, message)
+        self.diagnostics.append(diagnostic)
+        if self._draft is not None:
+            self._draft.diagnostics.append(diagnostic)
+
+    def _read_line(self, raw: str, offset: int, done: List[ParsedQuestion]) -> None:
+        self._line += 1
+        raw = raw.rstrip("\r")
+        line = raw.replace("**", "").lstrip("#").strip()
+        if not line:
+            self._after_blank = True
+            return
+        after_blank, self._after_blank = self._after_blank, False
+        draft = self._draft
+        match = _LINE.match(line)
+        kind = match.lastgroup if match else None
+
+        if kind == "question":
+            number = int(match.group("number"))
+            # A question starts at a numbered line unless the current one is still
+            # waiting for its options and the number does not come next
+            if draft is None or draft.options or draft.answer is not None or number == draft.number + 1:
+                self._finish(done)
+                in_sequence = number == self._last_number + 1
+                self._draft = _Draft(number, match.group("question").strip(), offset, self._line, in_sequence)
+                self._draft.end = offset + len(raw)
+                if not in_sequence:
+                    self._diagnose("out_of_sequence", f"question {number} follows {self._last_number}")
+                self._last_number = number
+                return
+            kind = None  # Continuation of the question text
+
+        if draft is None:
+            self._diagnose("preamble", "text before the first question")
+            return
+        if kind is None and after_blank and draft.field != "question":
+            # Set apart from the question's last field, so commentary rather than part of it
+            self._diagnose("trailing_text", "unmarked text after a blank line")
+            return
+        draft.end = offset + len(raw)
+
+        if kind == "option":
+            letter = match.group("letter")
+            expected = chr(ord("A") + len(draft.options))
+            if letter != expected:
+                self._diagnose("option_order", f"option {letter} where {expected} was expected")
+            draft.options.append([match.group("option").strip()])
+            draft.field = "option"
+        elif kind == "answer":
+            if draft.answer is not None:
+                self._diagnose("duplicate_answer", "answer given more than once; the first is kept")
+            else:
+                draft.answer = match.group("answer").strip()
+            draft.field = "answer"
+        elif kind == "explanation":
+            draft.explanation = [match.group("explanation").strip()]
+            draft.field = "explanation"
+        elif draft.field == "question":
+            draft.text.append(line)
+        elif draft.field == "option":
+            draft.options[-1].append(line)
+            draft.stray_lines += 1
+            self._diagnose("option_continued", "unmarked line appended to the option above")
+        elif draft.field == "explanation":
+            draft.explanation.append(line)
+        else:
+            draft.stray_lines += 1
+            self._diagnose("unrecognised", "line after the answer is not an explanation")
+
+    def _finish(self, done: List[ParsedQuestion]) -> None:
+        draft, self._draft = self._draft, None
+        if draft is None:
+            return
+
+        def diagnose(code: str, message: str) -> None:
+            diagnostic = Diagnostic(draft.line, code, message)
+            self.diagnostics.append(diagnostic)
+            draft.diagnostics.append(diagnostic)
+
+        text = " ".join(draft.text)
+        options = tuple(" ".join(parts).strip() for parts in draft.options)
+        answer, answer_matches = self._resolve_answer(draft.answer, options)
+        if draft.answer is not None and not answer_matches:
+            diagnose("answer_unmatched", f"answer {draft.answer!r} names none of the {len(options)} options")
+
+        missing = [name for name, value in (("text", text), ("options", options), ("answer", answer)) if not value]
+        if missing:
+            diagnose("dropped", f"question {draft.number} has no {', '.join(missing)}")
+            return
+
+        checks = {
+            "four_options": len(options) == 4,
+            "answer_matches_option": answer_matches,
+            "has_explanation": bool(draft.explanation),
+            "in_sequence": draft.in_sequence,
+            "no_stray_lines": draft.stray_lines == 0,
+        }
+        done.append(ParsedQuestion(
+            number=draft.number,
+            question=text,
+            options=options,
+            answer=answer,
+            explanation=" ".join(draft.explanation),
+            start=draft.start,
+            end=draft.end,
+            confidence=round(sum(checks[name] for name in _CHECKS) / len(_CHECKS), 2),
+            diagnostics=tuple(draft.diagnostics),
+        ))
+
+    @staticmethod
+    def _resolve_answer(written: Optional[str], options: Tuple[str, ...]) -> Tuple[str, bool]:
+        """
+        The answer's option text and whether it named an option, else the answer
+        as written. An answer equal to an option's text wins over reading its
+        first character as a letter.
+        """
+        if not written:
+            return "", False
+        folded = _fold(written)
+        for option in options:
+            if _fold(option) == folded:
+                return option, True
+        match = _ANSWER_LETTER.fullmatch(written)
+        if match:
+            letter = (match.group("alone") or match.group("marked") or match.group("prefix")).upper()
+            index = ord(letter) - ord("A")
+            if index < len(options):
+                return options[index], True
+            return letter, False
+        return written, False
+
+
+def _fold(text: str) -> str:
+    """Case, surrounding whitespace and trailing full stops ignored, for comparing answers with options."""
+    return " ".join(text.rstrip(". ").split()).casefold()
+
+
+def parse_quiz(quiz_text: str) -> Tuple[List[ParsedQuestion], List[Diagnostic]]:
+    """Parse complete quiz text. Returns the questions and every diagnostic raised."""
+    parser = QuizParser()
+    questions = parser.feed(quiz_text)
+    questions.extend(parser.close())
+    return questions, parser.diagnostics
+
+
+def title_from_filename(filename: str) -> str:
+    return filename.replace(".pdf", "").replace("_", " ").title()
+
+
+def is_placeholder_quiz(quiz: dict) -> bool:
+    """True for the fallback quiz returned when nothing could be parsed."""
+    questions = quiz.get("questions", [])
+    return len(questions) == 1 and questions[0].get("explanation") == PLACEHOLDER_EXPLANATION
+
 
 def parse_quiz_to_json(quiz_text: str, filename: str = "quiz") -> dict:
     """Parse quiz text into structured JSON format"""
-    
-    print(f"DEBUG: Parsing quiz text (length: {len(quiz_text)})")
-    
-    # Try to extract title from filename
-    title = filename.replace(".pdf", "").replace("_", " ").title()
-    
-    questions = []
-    
-    # Split by question markers (1. 2. 3. etc.)
-    question_sections = re.split(r'(\d+)\.\s+', quiz_text)
-    
-    # Process sections in pairs (number, content)
-    for i in range(1, len(question_sections), 2):
-        if i + 1 >= len(question_sections):
-            break
-            
-        question_num = question_sections[i]
-        content = question_sections[i + 1]
-        
-        lines = content.strip().split('\n')
-        question_text = ""
-        options = []
-        answer_letter = ""
-        explanation = ""
-        
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-            
-            # Extract question text (first non-empty line)
-            if not question_text and not re.match(r'^[A-D][\.\)]\s+', line) and 'answer' not in line.lower() and 'explanation' not in line.lower():
-                question_text = line.strip()
-            
-            # Extract options (A), B), C), D))
-            elif re.match(r'^[A-D][\.\)]\s+', line):
-                option_text = re.sub(r'^[A-D][\.\)]\s+', '', line).strip()
-                options.append(option_text)
-            
-            # Extract answer
-            elif 'answer:' in line.lower():
-                match = re.search(r'answer:\s*([A-D])', line, re.IGNORECASE)
-                if match:
-                    answer_letter = match.group(1).strip()
-            
-            # Extract explanation
-            elif 'explanation:' in line.lower():
-                explanation_match = re.search(r'explanation:\s*(.+)', line, re.IGNORECASE)
-                if explanation_match:
-                    explanation = explanation_match.group(1).strip()
-        
-        # Only add if we have valid data
-        if question_text and options and answer_letter:
-            # Get the correct answer text
-            answer_index = ord(answer_letter.upper()) - ord('A')
-            correct_answer = ""
-            if 0 <= answer_index < len(options):
-                correct_answer = options[answer_index]
-            
-            questions.append({
-                "id": len(questions) + 1,
-                "question": question_text,
-                "options": options,
-                "answer": correct_answer or answer_letter,
-                "explanation": explanation
-            })
-    
+    parsed, diagnostics = parse_quiz(quiz_text)
+    questions = [question.as_dict(n) for n, question in enumerate(parsed, start=1)]
+
+    if diagnostics or not questions:
+        logger.info("Parsed quiz with diagnostics", extra={
+            "questions": len(questions),
+            "diagnostics": dict(Counter(d.code for d in diagnostics)),
+            "min_confidence": min((q.confidence for q in parsed), default=None),
+            "text_length": len(quiz_text),
+        })
+
     # Fallback if no questions parsed
     if not questions:
-        print("DEBUG: No questions parsed, using fallback")
-        # Just create a simple placeholder quiz
         questions = [{
             "id": 1,
             "question": "Unable to parse quiz questions from the provided text. Please ensure the text contains properly formatted questions with options labeled A), B), C), D) and answers.",
             "options": ["Option A", "Option B", "Option C", "Option D"],
             "answer": "Option A",
-            "explanation": "This is a placeholder question."
+            "explanation": PLACEHOLDER_EXPLANATION
         }]
-    
-    print(f"DEBUG: Successfully parsed {len(questions)} questions")
-    
+
     return {
-        "title": title,
+        "title": title_from_filename(filename),
         "questions": questions
-    }
\ No newline at end of file
+    }
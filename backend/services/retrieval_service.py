@@ -1,72 +1,197 @@
-import chromadb
-from chromadb.config import Settings
-from sklearn.feature_extraction.text import TfidfVectorizer # Import TfidfVectorizer
-import uuid
+"""
+Chunk storage and retrieval over the quiz_context Chroma collection.
+
+Embeddings are stateless: a HashingVectorizer maps tokens into HASH_FEATURES
+fixed buckets, so every process embeds the same text the same way without
+fitting anything. Chunks are stored as L2-normalised term frequencies.
+Inverse document frequencies come from retrieval_term_stats in Postgres,
+which counts the chunks containing each bucket and grows as documents are
+indexed. They are applied to the query at retrieval time, so documents
+indexed earlier never need re-embedding when the statistics change.
+
+With RETRIEVAL_BACKEND=bm25, the same two functions use the in-process BM25
+index in services/bm25_index.py instead, and Chroma is not written to. With
+RETRIEVAL_BACKEND=ivfpq, the same embeddings go to the IVF-PQ index in
+services/ann_index.py instead of Chroma.
+
+Retrieval is scoped to the documents it is given, by the chunks' document
+metadata in Chroma, by segment in the BM25 index and by label in the IVF-PQ
+index. The search never
+crosses into documents other users uploaded, and its cost depends on the
+size of those documents rather than on the whole corpus.
+"""
+from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
+import hashlib
 import os
+import threading
+from typing import Callable, Dict, NamedTuple, Optional, Sequence
+
+import numpy as np
+from sqlalchemy import func, select
+
+from database import SessionLocal
+from documents import models as document_models
+from services import ann_index, bm25_index
+from utils.access_log import get_logger
+
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "chroma").lower()
+
+# Fixed embedding dimension; changing it means a new collection and rebuilding the term stats
+HASH_FEATURES = 2 ** 12
+COLLECTION_NAME = f"quiz_context_h{HASH_FEATURES}"
+
+logger = get_logger("retrieval")
+
+# Stateless, so building it costs nothing and every process embeds identically
+vectorizer = HashingVectorizer(n_features=HASH_FEATURES, alternate_sign=False, norm=None)
+
+_collection = None
+_collection_lock = threading.Lock()
+
+
+def get_collection():
+    """The Chroma collection, opened on first use so workers on the other backends never load Chroma."""
+    global _collection
+    with _collection_lock:
+        if _collection is None:
+            import chromadb
+
+            os.makedirs("db/chroma_store", exist_ok=True)
+            client = chromadb.PersistentClient(path="db/chroma_store")
+            _collection = client.get_or_create_collection(COLLECTION_NAME, metadata={"hnsw:space": "cosine"})
+        return _collection
+
 
-# Ensure the database directory exists
-os.makedirs("db/chroma_store", exist_ok=True)
+class ChunkStats(NamedTuple):
+    chunk_count: int
+    doc_freqs: Dict[int, int]  # Hash bucket -> chunks containing it
 
-client = chromadb.Client(Settings(persist_directory="db/chroma_store"))
-collection = client.get_or_create_collection("quiz_context")
 
-# Initialize TfidfVectorizer
-# We need to fit this vectorizer when we store chunks, and reuse it for retrieval
-vectorizer = TfidfVectorizer()
+def chunk_id(document_key: str, index: int) -> str:
+    return f"{document_key}:{index}"
 
-def store_text_chunks(text_iterator, source_name: str, chunk_size: int = 1000, batch_size: int = 32):
-    """Split the text into chunks and store embeddings in batches"""
+def _normalise(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def store_text_chunks(text_iterator, source_name: str, content_hash: Optional[str] = None,
+                      chunk_size: int = 1000, batch_size: int = 32,
+                      on_progress: Optional[Callable[[int, int], None]] = None) -> ChunkStats:
+    """
+    Split the text into chunks and upsert their embeddings in batches.
+    Chunk ids are "<content_hash>:<n>", so storing the same document again replaces its
+    chunks instead of adding copies. Without a content_hash the text itself is hashed.
+    on_progress(chunks_done, chunks_total) is called after each batch is written.
+    Returns the chunk count and, for Chroma and IVF-PQ, per-bucket document frequencies for the term stats.
+    """
     all_chunks = []
     for page_text in text_iterator:
         all_chunks.extend([page_text[i:i+chunk_size] for i in range(0, len(page_text), chunk_size)])
 
     if not all_chunks:
-        return
-
-    # Fit and transform the vectorizer with all chunks
-    # Note: For production, you might want to save/load the fitted vectorizer
-    global vectorizer # Access the global vectorizer instance
-    # If the vectorizer has not been fitted, fit it. Otherwise, only transform.
-    # This simplified approach assumes the vectorizer should learn from all data.
-    # A more robust solution would involve persisting the vectorizer.
-    if not hasattr(vectorizer, 'vocabulary_') or not vectorizer.vocabulary_:
-        chunk_embeddings = vectorizer.fit_transform(all_chunks)
-    else:
-        chunk_embeddings = vectorizer.transform(all_chunks)
+        return ChunkStats(0, {})
+
+    if content_hash is None:
+        content_hash = hashlib.sha256("\0".join(all_chunks).encode("utf-8")).hexdigest()
+
+    if on_progress and RETRIEVAL_BACKEND in ("bm25", "ivfpq"):
+        on_progress(0, len(all_chunks))  # These write the document in one step
 
-    # Convert sparse TF-IDF matrix to dense list for ChromaDB
-    dense_embeddings = chunk_embeddings.toarray().tolist()
+    if RETRIEVAL_BACKEND == "bm25":
+        ids = [chunk_id(content_hash, i) for i in range(len(all_chunks))]
+        # The BM25 index keeps its own statistics, so there are no term stats to add
+        stats = ChunkStats(bm25_index.get_index().add(content_hash, all_chunks, source_name, ids), {})
+        if on_progress:
+            on_progress(len(all_chunks), len(all_chunks))
+        return stats
+
+    # Counts stay sparse for the whole document; only one batch at a time is made dense
+    counts = vectorizer.transform(all_chunks)
+    buckets, chunk_freqs = np.unique(counts.indices, return_counts=True)
+    doc_freqs = dict(zip(buckets.tolist(), chunk_freqs.tolist()))
+
+    if RETRIEVAL_BACKEND == "ivfpq":
+        # A document's entries are replaced all at once, so its batches are gathered first
+        embeddings = np.concatenate([
+            _normalise(counts[i : i + batch_size].toarray().astype(np.float32))
+            for i in range(0, len(all_chunks), batch_size)
+        ])
+        ann_index.get_store(HASH_FEATURES).add(content_hash, embeddings, [c.encode("utf-8") for c in all_chunks])
+        if on_progress:
+            on_progress(len(all_chunks), len(all_chunks))
+        return ChunkStats(len(all_chunks), doc_freqs)
 
     for i in range(0, len(all_chunks), batch_size):
         batch_chunks = all_chunks[i:i+batch_size]
-        if not batch_chunks:  # Skip if batch is empty
-            continue
-        
-        # Get corresponding embeddings for the batch
-        batch_embeddings = dense_embeddings[i : i + len(batch_chunks)]
-
-        ids = [str(uuid.uuid4()) for _ in batch_chunks]
-        metadatas = [{"source": source_name}] * len(batch_chunks)
+        ids = [chunk_id(content_hash, i + j) for j in range(len(batch_chunks))]
+        metadatas = [{"source": source_name, "document": content_hash}] * len(batch_chunks)
+        embeddings = _normalise(counts[i : i + len(batch_chunks)].toarray().astype(np.float32))
 
-        collection.add(
+        get_collection().upsert(
             documents=batch_chunks,
-            embeddings=batch_embeddings,
+            embeddings=embeddings.tolist(),
             ids=ids,
             metadatas=metadatas
         )
+        if on_progress:
+            on_progress(i + len(batch_chunks), len(all_chunks))
+    return ChunkStats(len(all_chunks), doc_freqs)
 
-def retrieve_context(query: str, top_k: int = 3) -> str:
-    """Retrieve top matching chunks for the query"""
-    global vectorizer # Access the global vectorizer instance
-    # Ensure vectorizer has been fitted before transforming the query
-    if not hasattr(vectorizer, 'vocabulary_') or not vectorizer.vocabulary_:
-        # If vectorizer is not fitted, we cannot retrieve meaningful context.
-        # This scenario should ideally not happen if store_text_chunks is called first.
-        # For now, return empty or raise an error.
-        print("Warning: TfidfVectorizer not fitted. Cannot retrieve context.")
+def _idf(buckets) -> Optional[np.ndarray]:
+    """Smoothed IDF of each bucket over all indexed chunks, or None if nothing is indexed yet."""
+    with SessionLocal() as db:
+        total = db.execute(
+            select(func.coalesce(func.sum(document_models.Document.chunk_count), 0))
+            .where(document_models.Document.indexed_at.isnot(None))
+        ).scalar()
+        if not total:
+            return None
+        stats = dict(db.execute(
+            select(document_models.RetrievalTermStat.feature, document_models.RetrievalTermStat.doc_freq)
+            .where(document_models.RetrievalTermStat.feature.in_([int(b) for b in buckets]))
+        ).all())
+    doc_freq = np.array([stats.get(int(b), 0) for b in buckets], dtype=np.float64)
+    return np.log((1 + total) / (1 + doc_freq)) + 1
+
+def document_query(pages: Sequence[str], max_terms: int = 20) -> str:
+    """A retrieval query made of the document's most frequent content words."""
+    counter = CountVectorizer(stop_words="english", token_pattern=r"(?u)\b[^\W\d_]{3,}\b")
+    try:
+        counts = counter.fit_transform(pages)
+    except ValueError:
+        return ""  # No content words at all
+    totals = np.asarray(counts.sum(axis=0)).ravel()
+    terms = counter.get_feature_names_out()
+    return " ".join(terms[i] for i in np.argsort(-totals, kind="stable")[:max_terms])
+
+def retrieve_context(query: str, document_hashes: Sequence[str], top_k: int = 3) -> str:
+    """Retrieve the top matching chunks for the query from the given documents only"""
+    if not document_hashes:
+        return ""
+    if RETRIEVAL_BACKEND == "bm25":
+        return "\n".join(hit.text for hit in bm25_index.get_index().search(query, top_k, keys=document_hashes))
+
+    counts = vectorizer.transform([query])
+    if counts.nnz == 0:
+        return ""
+    idf = _idf(counts.indices)
+    if idf is None:
+        logger.warning("No documents indexed yet; retrieving no context")
         return ""
 
-    query_embedding = vectorizer.transform([query]).toarray().tolist()[0] # Transform query and convert to list
-    results = collection.query(query_embeddings=[query_embedding], n_results=top_k)
+    # Stored chunks carry plain term frequencies, so the query carries IDF for both sides
+    query_embedding = np.zeros(HASH_FEATURES, dtype=np.float32)
+    query_embedding[counts.indices] = counts.data * idf * idf
+    query_embedding /= np.linalg.norm(query_embedding)
+    if RETRIEVAL_BACKEND == "ivfpq":
+        # Both sides are unit length, so nearest by L2 is nearest by cosine
+        hits = ann_index.get_store(HASH_FEATURES).search(query_embedding, top_k, keys=document_hashes)
+        return "\n".join(hit.payload.decode("utf-8") for hit in hits)
+    if len(document_hashes) == 1:
+        where = {"document": document_hashes[0]}
+    else:
+        where = {"document": {"$in": list(document_hashes)}}
+    results = get_collection().query(query_embeddings=[query_embedding.tolist()], n_results=top_k, where=where)
     docs = [d for doclist in results["documents"] for d in doclist]
     return "\n".join(docs)
@@ -0,0 +1,90 @@
+"""
+Immutable, versioned index snapshots with an atomically swapped CURRENT pointer.
+
+An index directory holds numbered snapshot directories and a CURRENT file
+naming the live one:
+
+    CURRENT         "v00000042"
+    v00000041/      previous snapshot, kept for readers still on it
+    v00000042/
+
+A snapshot is written in full to a staging directory, renamed to the next
+version, and published by replacing CURRENT with os.replace. Readers never
+see a half-written snapshot, and there is no moment without one. Files in a
+published snapshot are never modified, so every process can memory-map them
+read-only and share their pages through the page cache. A reader notices a
+new snapshot when CURRENT names another version. An index may add files to
+its current snapshot, as the IVF-PQ delta segments do, but never rewrites one.
+
+Only the newest SNAPSHOT_KEEP versions are kept. A process that still has
+an older one mapped keeps reading it after it is removed.
+"""
+import fcntl
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from typing import Callable, NamedTuple, Optional
+
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "2"))
+
+POINTER = "CURRENT"
+_PREFIX = "v"
+
+
+class Snapshot(NamedTuple):
+    version: str
+    path: str
+
+
+def current(directory: str) -> Optional[Snapshot]:
+    """The published snapshot in directory, or None if nothing has been published."""
+    try:
+        with open(os.path.join(directory, POINTER), "r", encoding="utf-8") as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return Snapshot(version, os.path.join(directory, version))
+
+
+def _versions(directory: str):
+    return sorted(name for name in os.listdir(directory) if name.startswith(_PREFIX) and name[1:].isdigit())
+
+
+@contextmanager
+def lock(directory: str, name: str = ".lock"):
+    """Exclusive lock on directory across processes, for read-modify-write of its snapshots."""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, name), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def publish(directory: str, write: Callable[[str], None], keep: int = SNAPSHOT_KEEP) -> Snapshot:
+    """
+    Call write(path) to fill a new snapshot directory, then make it current.
+    Older snapshots beyond the newest keep are removed.
+    """
+    os.makedirs(directory, exist_ok=True)
+    staging = os.path.join(directory, f".tmp-{os.getpid()}-{threading.get_ident()}")
+    os.makedirs(staging)
+    try:
+        write(staging)
+        with lock(directory, ".publish.lock"):
+            versions = _versions(directory)
+            version = f"{_PREFIX}{int(versions[-1][1:]) + 1 if versions else 1:08d}"
+            final = os.path.join(directory, version)
+            os.rename(staging, final)
+            pointer = os.path.join(directory, f".{POINTER}-{os.getpid()}-{threading.get_ident()}")
+            with open(pointer, "w", encoding="utf-8") as f:
+                f.write(version)
+            os.replace(pointer, os.path.join(directory, POINTER))
+            for old in _versions(directory)[:-max(keep, 1)]:
+                shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return Snapshot(version, final)
@@ -0,0 +1,163 @@
+"""
+Structured, non-blocking logging.
+
+Records are put on a queue by the request path and written as JSON lines to
+stdout by a background listener thread, so a slow stdout never stalls a request.
+Every record carries the id of the request it was logged from.
+
+AccessLogMiddleware writes one line per request with method, path, status
+and duration. It assigns a request id (X-Request-ID, taken from the request
+if present) and samples with ACCESS_LOG_SAMPLE_RATE. Errors and requests
+slower than ACCESS_LOG_SLOW_MS are always logged. Body capture is off by
+default. ACCESS_LOG_BODY_BYTES > 0 records that many leading bytes of each
+request body as it streams through, without buffering the rest. Bodies of the
+paths in ACCESS_LOG_BODY_EXCLUDE (credentials by default) are never captured.
+"""
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+ACCESS_LOG_SAMPLE_RATE = float(os.getenv("ACCESS_LOG_SAMPLE_RATE", "1.0"))
+ACCESS_LOG_SLOW_MS = float(os.getenv("ACCESS_LOG_SLOW_MS", "1000"))
+ACCESS_LOG_BODY_BYTES = int(os.getenv("ACCESS_LOG_BODY_BYTES", "0"))
+ACCESS_LOG_BODY_EXCLUDE = {
+    p.strip() for p in os.getenv("ACCESS_LOG_BODY_EXCLUDE", "/register,/token").split(",") if p.strip()
+}
+REQUEST_ID_HEADER = "X-Request-ID"
+
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+# Attributes every LogRecord has; anything else was passed via extra= and goes into the JSON line
+_RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            line["request_id"] = request_id
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED:
+                line[key] = value
+        if record.exc_info:
+            line["exc"] = self.formatException(record.exc_info)
+        return json.dumps(line, default=str)
+
+
+class _RequestIdFilter(logging.Filter):
+    # Runs in the logging thread's caller, where the request's context is still current
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+def setup_logging() -> None:
+    """Route the "ethq" logger through a queue to a JSON stdout handler. Safe to call more than once."""
+    global _listener
+    if _listener is not None:
+        return
+    log_queue: "queue.SimpleQueue" = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(_RequestIdFilter())
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    logger = logging.getLogger("ethq")
+    logger.setLevel(LOG_LEVEL)
+    logger.handlers = [queue_handler]
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"ethq.{name}")
+
+
+access_logger = get_logger("access")
+
+
+class AccessLogMiddleware:
+    """Pure ASGI middleware, so it never reads or buffers the body itself."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", []):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+
+        start = time.perf_counter()
+        status_code = 500
+        response_bytes = 0
+        body_preview = bytearray()
+
+        async def capturing_receive():
+            message = await receive()
+            if message["type"] == "http.request" and len(body_preview) < ACCESS_LOG_BODY_BYTES:
+                body_preview.extend(message.get("body", b"")[:ACCESS_LOG_BODY_BYTES - len(body_preview)])
+            return message
+
+        async def send_with_request_id(message):
+            nonlocal status_code, response_bytes
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(REQUEST_ID_HEADER.lower().encode(), request_id.encode())]
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            capture = ACCESS_LOG_BODY_BYTES > 0 and scope["path"] not in ACCESS_LOG_BODY_EXCLUDE
+            await self.app(scope, capturing_receive if capture else receive, send_with_request_id)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            if status_code >= 500 or duration_ms >= ACCESS_LOG_SLOW_MS or random.random() < ACCESS_LOG_SAMPLE_RATE:
+                fields = {
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status_code,
+                    "duration_ms": round(duration_ms, 2),
+                    "response_bytes": response_bytes,
+                }
+                if body_preview:
+                    fields["body_preview"] = body_preview.decode("utf-8", errors="replace")
+                access_logger.info("request", extra=fields)
+            request_id_var.reset(token)
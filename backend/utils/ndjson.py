@@ -0,0 +1,32 @@
+from typing import AsyncIterator, Tuple
+
+# Guard against a body with no newlines being buffered whole
+MAX_LINE_BYTES = 1024 * 1024
+
+
+async def iter_ndjson_lines(
+    chunks: AsyncIterator[bytes], max_line_bytes: int = MAX_LINE_BYTES
+) -> AsyncIterator[Tuple[int, bytes]]:
+    """
+    Split a stream of byte chunks into NDJSON / JSON Lines records.
+    Yields (line_number, line) for every non-blank line; only the current
+    partial line is held in memory.
+    """
+    buffer = b""
+    line_number = 0
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_number += 1
+            line = line.strip()
+            if line:
+                yield line_number, line
+        if len(buffer) > max_line_bytes:
+            raise ValueError(f"Line {line_number + 1} exceeds {max_line_bytes} bytes")
+    line_number += 1
+    buffer = buffer.strip()
+    if buffer:
+        yield line_number, buffer
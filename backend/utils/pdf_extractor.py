@@ -1,5 +1,131 @@
+"""
+PDF text extraction.
+
+Small documents are read page by page in the calling thread. Documents with at
+least PDF_PARALLEL_MIN_PAGES pages are split into ranges of PDF_PAGES_PER_TASK
+pages and handed to a pool of PDF_EXTRACT_WORKERS processes. Each worker opens
+the file on its own, so only a path and two page numbers cross the process
+boundary. iter_pages yields the texts in page order as ranges complete.
+"""
+import multiprocessing
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, NamedTuple, Optional, Tuple, Union
+
 import fitz  # PyMuPDF
 
+MAX_PDF_PAGES = int(os.getenv("MAX_PDF_PAGES", "500"))
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "64"))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+class PdfTooManyPages(ValueError):
+    pass
+
+
+class ExtractedDocument(NamedTuple):
+    """Page texts of one PDF, extracted once and shared by validation, indexing and generation."""
+    source_name: str
+    pages: Tuple[str, ...]
+
+    @property
+    def page_count(self) -> int:
+        return len(self.pages)
+
+    def preview(self, max_pages: int = 5) -> str:
+        return " ".join(self.pages[:max_pages])
+
+
+def _open(source: Union[bytes, str]):
+    if isinstance(source, (bytes, bytearray)):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source, filetype="pdf")
+
+
+def _extract_range(path: str, start: int, stop: int) -> List[str]:
+    # Runs in a pool worker; every worker opens its own handle on the file
+    with fitz.open(path, filetype="pdf") as pdf:
+        return [pdf[i].get_text() for i in range(start, stop)]
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn, not fork: the server process has threads (logging, submission flusher) a fork would copy mid-lock
+        _pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+def _iter_parallel(path: str, page_count: int, workers: int) -> Iterator[str]:
+    pool = _get_pool()
+    ranges = deque((start, min(start + PDF_PAGES_PER_TASK, page_count)) for start in range(0, page_count, PDF_PAGES_PER_TASK))
+    in_flight = deque()
+    try:
+        # Keep a couple of ranges per worker queued, so a slow reader does not pile up extracted text
+        while ranges or in_flight:
+            while ranges and len(in_flight) < workers * 2:
+                in_flight.append(pool.submit(_extract_range, path, *ranges.popleft()))
+            yield from in_flight.popleft().result()
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+
+def iter_pages(
+    source: Union[bytes, str],
+    max_pages: Optional[int] = MAX_PDF_PAGES,
+    workers: int = PDF_EXTRACT_WORKERS
+) -> Iterator[str]:
+    """
+    Yield each page's text in order, extracting large documents on the process pool.
+    Raises PdfTooManyPages before extracting anything if it has more than max_pages.
+    """
+    with _open(source) as pdf:
+        page_count = pdf.page_count
+        if max_pages is not None and page_count > max_pages:
+            raise PdfTooManyPages(f"PDF has {page_count} pages; the limit is {max_pages}")
+        if workers <= 1 or page_count < PDF_PARALLEL_MIN_PAGES:
+            for page in pdf:
+                yield page.get_text()
+            return
+
+    if isinstance(source, str):
+        yield from _iter_parallel(source, page_count, workers)
+        return
+    # Workers open files by path; an in-memory upload is written out once rather than pickled per task
+    spill = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
+    try:
+        with spill:
+            spill.write(source)
+        yield from _iter_parallel(spill.name, page_count, workers)
+    finally:
+        os.unlink(spill.name)
+
+
+def extract_document(
+    source: Union[bytes, str],
+    source_name: str = "unknown.pdf",
+    max_pages: Optional[int] = MAX_PDF_PAGES
+) -> ExtractedDocument:
+    """
+    Parse the PDF from its bytes or a file path in one pass over the pages.
+    Raises PdfTooManyPages before extracting anything if it has more than max_pages.
+    """
+    return ExtractedDocument(source_name, tuple(iter_pages(source, max_pages)))
+
+
 def extract_text_from_pdf(file_path: str):
     with fitz.open(file_path) as pdf:
         for page in pdf:
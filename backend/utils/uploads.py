@@ -0,0 +1,270 @@
+"""
+Bounded-memory file uploads.
+
+UploadSizeLimitMiddleware rejects oversized request bodies on the upload
+routes, given as regular expressions matched against the whole path, with 413. A too-large Content-Length is refused before any of the body
+is read. A chunked or understated body is refused as soon as the running
+count passes the limit. Because the body is only pulled as the app reads it,
+a slow consumer applies back-pressure to the client instead of buffering.
+
+spool_multipart_upload parses a multipart/form-data request body itself, as
+it arrives, instead of letting Starlette spool the file part first. The file
+part's bytes go straight into memory up to UPLOAD_SPOOL_BYTES and into a
+named temporary file beyond that, so PyMuPDF and the extraction workers can
+open it by path. They are hashed on the way through, so identical uploads
+can be recognised without reading them twice. The other form fields are
+returned as strings.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from python_multipart.exceptions import FormParserError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+MAX_UPLOAD_BYTES = int(float(os.getenv("MAX_UPLOAD_MB", "25")) * 1024 * 1024)
+GRADE_BATCH_MAX_BYTES = int(float(os.getenv("GRADE_BATCH_MAX_MB", "25")) * 1024 * 1024)
+UPLOAD_SPOOL_BYTES = int(float(os.getenv("UPLOAD_SPOOL_MB", "5")) * 1024 * 1024)
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# Multipart boundaries and the small form fields sent with the file
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, limit: int):
+        super().__init__(f"Upload exceeds the {limit // (1024 * 1024)} MB limit")
+        self.limit = limit
+
+
+class InvalidUpload(Exception):
+    """The body is not multipart/form-data with the expected file part."""
+
+
+class SpooledUpload:
+    """An upload held in memory when small and in a temporary file otherwise."""
+
+    def __init__(self, data: Optional[bytes], path: Optional[str], size: int, content_hash: str,
+                 filename: Optional[str] = None):
+        self.data = data
+        self.path = path
+        self.size = size
+        self.content_hash = content_hash  # sha256 hex digest of the upload
+        self.filename = filename
+
+    @property
+    def source(self) -> Union[bytes, str]:
+        """What PyMuPDF should open: the bytes, or the temp file path."""
+        return self.data if self.path is None else self.path
+
+    def close(self) -> None:
+        if self.path and os.path.exists(self.path):
+            os.unlink(self.path)
+            self.path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _Spool:
+    """Bytes in memory up to UPLOAD_SPOOL_BYTES, then in a named temporary file; hashed as they are written."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.buffer = bytearray()
+        self.spill = None
+        self.size = 0
+        self.digest = hashlib.sha256()
+
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise UploadTooLarge(self.max_bytes)
+        self.digest.update(chunk)
+        if self.spill is None and len(self.buffer) + len(chunk) > UPLOAD_SPOOL_BYTES:
+            self.spill = tempfile.NamedTemporaryFile(delete=False, suffix=".upload")
+            self.spill.write(self.buffer)
+            self.buffer = bytearray()
+        if self.spill is None:
+            self.buffer.extend(chunk)
+        else:
+            self.spill.write(chunk)
+
+    def finish(self, filename: Optional[str]) -> SpooledUpload:
+        if self.spill is None:
+            return SpooledUpload(bytes(self.buffer), None, self.size, self.digest.hexdigest(), filename)
+        self.spill.close()
+        return SpooledUpload(None, self.spill.name, self.size, self.digest.hexdigest(), filename)
+
+    def discard(self) -> None:
+        if self.spill is not None:
+            self.spill.close()
+            os.unlink(self.spill.name)
+
+
+async def spool_multipart_upload(
+    request: Request, file_field: str = "file", max_bytes: int = MAX_UPLOAD_BYTES
+) -> Tuple[SpooledUpload, Dict[str, str]]:
+    """
+    Read a multipart/form-data body, spooling the file_field part and
+    returning the other fields (the first value of each) as strings.
+    Raises UploadTooLarge, or InvalidUpload if the body is malformed or has no such file part.
+    """
+    _, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise InvalidUpload("Expected multipart/form-data with a boundary")
+
+    spool = _Spool(max_bytes)
+    fields: Dict[str, str] = {}
+    field_bytes = 0
+    filename: Optional[str] = None
+    found = False
+    pending: List[bytes] = []  # File data parsed from the current chunk
+    part = {"name": None, "is_file": False, "value": bytearray(), "header": b"", "headers": {}}
+
+    def on_part_begin() -> None:
+        part.update(name=None, is_file=False, value=bytearray(), header=b"", headers={})
+
+    def on_header_field(data: bytes, start: int, end: int) -> None:
+        part["header"] += data[start:end]
+
+    def on_header_value(data: bytes, start: int, end: int) -> None:
+        name = part["header"].lower()
+        part["headers"][name] = part["headers"].get(name, b"") + data[start:end]
+
+    def on_header_end() -> None:
+        part["header"] = b""
+
+    def on_headers_finished() -> None:
+        nonlocal filename, found
+        _, options = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        part["name"] = options.get(b"name", b"").decode("utf-8", "replace")
+        if part["name"] == file_field and b"filename" in options and not found:
+            found = True
+            part["is_file"] = True
+            filename = options[b"filename"].decode("utf-8", "replace")
+
+    def on_part_data(data: bytes, start: int, end: int) -> None:
+        nonlocal field_bytes
+        if part["is_file"]:
+            pending.append(data[start:end])
+        elif part["name"] is not None:
+            field_bytes += end - start
+            if field_bytes > MULTIPART_OVERHEAD_BYTES:
+                raise InvalidUpload("Form fields are too large")
+            part["value"] += data[start:end]
+
+    def on_part_end() -> None:
+        if not part["is_file"] and part["name"] and part["name"] not in fields:
+            fields[part["name"]] = part["value"].decode("utf-8", "replace")
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    def write_pending() -> None:
+        for data in pending:
+            spool.write(data)
+
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if pending:
+                # Once spilled to disk, write off the event loop
+                if spool.spill is None:
+                    write_pending()
+                else:
+                    await run_in_threadpool(write_pending)
+                pending.clear()
+        parser.finalize()
+        if not found:
+            raise InvalidUpload(f"Missing file field '{file_field}'")
+    except FormParserError as e:
+        spool.discard()
+        raise InvalidUpload(f"Invalid multipart data: {e}")
+    except BaseException:
+        spool.discard()
+        raise
+    return spool.finish(filename), fields
+
+
+class UploadSizeLimitMiddleware:
+    """Pure ASGI middleware capping the request body size on paths matching the given patterns."""
+
+    def __init__(self, app, paths: Iterable[str], max_bytes: int = MAX_UPLOAD_BYTES):
+        self.app = app
+        self.paths = re.compile("|".join(f"(?:{path})" for path in paths))
+        self.max_body = max_bytes + MULTIPART_OVERHEAD_BYTES
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.paths.fullmatch(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    declared = int(value)
+                except ValueError:
+                    declared = 0
+                if declared > self.max_body:
+                    await self._reject(send)
+                    return
+                break
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def counting_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body:
+                    exceeded = True
+                    raise UploadTooLarge(self.max_bytes)
+            return message
+
+        async def limited_send(message):
+            nonlocal response_started
+            if exceeded:
+                # The framework turned the aborted read into its own error response; answer 413 instead
+                if message["type"] == "http.response.start" and not response_started:
+                    response_started = True
+                    await self._reject(send)
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, limited_send)
+        except UploadTooLarge:
+            if response_started:
+                return
+            await self._reject(send)
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": str(UploadTooLarge(self.max_bytes))}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), (b"connection", b"close")],
+        })
+        await send({"type": "http.response.body", "body": body})
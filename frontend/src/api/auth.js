@@ -2,6 +2,7 @@ import axios from 'axios';
 import { API_BASE_URL } from './config';
 
 const API_URL = API_BASE_URL;
+const READ_PRIMARY_HEADER = 'X-Read-Primary-Until';
 
 // Add request interceptor for debugging
 axios.interceptors.request.use(
@@ -21,6 +22,11 @@ axios.interceptors.request.use(
 axios.interceptors.response.use(
   (response) => {
     console.log('API Response:', response.status, response.config.url);
+    // After a write the API asks for our reads to stay on the primary until this time
+    const readPrimaryUntil = response.headers?.[READ_PRIMARY_HEADER.toLowerCase()];
+    if (readPrimaryUntil) {
+      sessionStorage.setItem(READ_PRIMARY_HEADER, readPrimaryUntil);
+    }
     return response;
   },
   (error) => {
@@ -97,5 +103,9 @@ export const getAuthHeaders = () => {
   if (token) {
     headers.Authorization = `Bearer ${token}`;
   }
+  const readPrimaryUntil = sessionStorage.getItem(READ_PRIMARY_HEADER);
+  if (readPrimaryUntil && Number(readPrimaryUntil) > Date.now() / 1000) {
+    headers[READ_PRIMARY_HEADER] = readPrimaryUntil;
+  }
   return headers;
 };
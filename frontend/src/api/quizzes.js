@@ -70,9 +70,22 @@ export const generateQuizFromText = async ({ text, level, questions }) => {
   return response.data;
 };
 
+const HISTORY_PAGE_SIZE = 500;
+
+// The history is paged (oldest first); follow X-Next-Cursor until the last page
 export const getUserAttempts = async () => {
-  const response = await axios.get(`${API_URL}/quizzes/history`, { headers: getAuthHeaders() });
-  return response.data;
+  const attempts = [];
+  let cursor = null;
+  do {
+    const params = { limit: HISTORY_PAGE_SIZE };
+    if (cursor) {
+      params.cursor = cursor;
+    }
+    const response = await axios.get(`${API_URL}/quizzes/history`, { headers: getAuthHeaders(), params });
+    attempts.push(...response.data);
+    cursor = response.headers['x-next-cursor'];
+  } while (cursor);
+  return attempts;
 };
 
 export const getAnalyticsSummary = async () => {
@@ -19,7 +19,7 @@ export const QuizCard = ({ quiz }) => {
           Category: {quiz.category}
         </Typography>
         <Typography variant="body2" color="text.secondary">
-          Questions: {quiz.questions.length}
+          Questions: {quiz.question_count ?? quiz.questions?.length ?? 0}
         </Typography>
         <Box sx={{ mt: 2 }}>
           <Button variant="contained" onClick={handleTakeQuiz}>